@@ -0,0 +1,63 @@
+"""Replays a recorded Supervisor event stream through the event listener
+
+Measures how many events per second :py:class:`supermann.supervisor.EventListener`
+can read. The stream is repeated to fill a temporary file, which is read
+through its file descriptor in the same way as STDIN. Run it from an
+environment where Supermann is installed::
+
+    python benchmarks/events.py supermann/tests/supervisor.txt --events 100000
+
+By default payloads are not read, as for ``TICK`` events. ``--payload``
+parses the payload of every event.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import tempfile
+import time
+
+import supermann.supervisor
+
+
+def record(path, events):
+    """Writes a stream of ``events`` events, repeating the recording"""
+    with open(path, 'rb') as f:
+        recording = f.read()
+    count = recording.count('eventname:')
+    stream = tempfile.TemporaryFile()
+    stream.write(recording * (events // count + 1))
+    stream.seek(0)
+    return stream, (events // count + 1) * count
+
+
+def replay(stream, events, payload=False):
+    """Reads ``events`` events from a stream, returning the elapsed time"""
+    listener = supermann.supervisor.EventListener(
+        stdin=stream, stdout=open(os.devnull, 'w'),
+        reserve_stdin=False, reserve_stdout=False)
+    start = time.time()
+    for _ in range(events):
+        event = listener.wait()
+        if payload:
+            event.payload
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('recording', help="A recorded Supervisor event stream")
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--payload', action='store_true',
+                        help="Parse the payload of each event")
+    args = parser.parse_args()
+
+    stream, events = record(args.recording, args.events)
+    elapsed = replay(stream, events, args.payload)
+    print("{0} events in {1:.3f}s ({2:.0f} events/s)".format(
+        events, elapsed, events / elapsed))
+
+
+if __name__ == '__main__':
+    main()
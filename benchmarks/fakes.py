@@ -0,0 +1,156 @@
+"""Fake Supervisor programs and ``/proc`` used by the benchmarks
+
+Each fake runs in the benchmark's own process, so a benchmark measures the
+cost of Supermann rather than of the host it runs on:
+
+- :py:class:`FakeSupervisord` serves the Supervisor XML-RPC methods that
+  Supermann calls for the fake programs, and :py:func:`event_stream` writes
+  the events Supervisor would send to an event listener's STDIN.
+- :py:func:`build_proc` writes a ``/proc`` tree with a process tree of a
+  given depth for each program, which is read by setting
+  ``psutil.PROCFS_PATH``.
+
+The Riemann and InfluxDB servers, and the Supervisor XML-RPC server, are
+shared with the tests in :py:mod:`supermann.testing`.
+"""
+
+from __future__ import absolute_import
+
+import os
+import tempfile
+import time
+
+import supermann.testing
+
+#: The first PID used for fake processes
+FIRST_PID = 100000
+
+#: ``/proc/[pid]/stat`` fields after the process name, with the state, PPID,
+#: CPU times and start time (in clock ticks) filled in by :py:func:`stat`
+STAT_FIELDS = 50
+
+MEMINFO = """MemTotal:       16384000 kB
+MemFree:         8192000 kB
+MemAvailable:   12288000 kB
+Buffers:          512000 kB
+Cached:          2048000 kB
+SReclaimable:     256000 kB
+Shmem:             64000 kB
+Active:          4096000 kB
+Inactive:        2048000 kB
+SwapTotal:       4096000 kB
+SwapFree:        4096000 kB
+"""
+
+IO = """rchar: 4096
+wchar: 2048
+syscr: 10
+syscw: 5
+read_bytes: {0}
+write_bytes: {1}
+cancelled_write_bytes: 0
+"""
+
+LIMITS = """Limit                     Soft Limit           Hard Limit           Units
+Max open files            1024                 4096                 files
+"""
+
+
+def stat(pid, ppid, start):
+    """Returns the contents of ``/proc/[pid]/stat`` for a fake process"""
+    fields = ['0'] * STAT_FIELDS
+    fields[0] = 'S'
+    fields[1] = str(ppid)
+    fields[11] = str(pid % 1000)
+    fields[12] = str(pid % 100)
+    fields[19] = str(start)
+    return '{0} (worker) {1}\n'.format(pid, ' '.join(fields))
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build_proc(programs, depth=2, fds=8):
+    """Writes a fake ``/proc`` to a temporary directory
+
+    Each program has a chain of ``depth`` processes, with the root process
+    first. PID 1 is the parent of every root process.
+
+    :param int programs: The number of programs
+    :param int depth: The number of processes in each program's tree
+    :param int fds: The number of open file descriptors of each process
+    :returns: The path of the directory, and a list of root PIDs
+    """
+    proc = tempfile.mkdtemp(prefix='supermann-proc-')
+    cpus = '0 ' * 10
+    write(os.path.join(proc, 'stat'), (
+        'cpu  {0}\ncpu0 {0}\ncpu1 {0}\nintr 0\nbtime {1}\n'.format(
+            cpus, int(time.time()) - 3600)))
+    write(os.path.join(proc, 'meminfo'), MEMINFO)
+    write(os.path.join(proc, 'loadavg'), '0.50 0.25 0.10 1/100 1000\n')
+    write(os.path.join(proc, 'uptime'), '3600.00 7000.00\n')
+    write(os.path.join(proc, 'diskstats'), '')
+    os.mkdir(os.path.join(proc, 'net'))
+    write(os.path.join(proc, 'net', 'dev'), 'Inter-|\n face |\n')
+
+    roots = list()
+    pid = FIRST_PID
+    for program in range(programs):
+        parent = 1
+        for level in range(depth):
+            if level == 0:
+                roots.append(pid)
+            directory = os.path.join(proc, str(pid))
+            os.makedirs(os.path.join(directory, 'fd'))
+            for fd in range(fds):
+                write(os.path.join(directory, 'fd', str(fd)), '')
+            write(os.path.join(directory, 'stat'), stat(pid, parent, 100))
+            write(os.path.join(directory, 'statm'),
+                  '{0} {1} 100 10 0 200 0\n'.format(2048 + pid % 10, 512))
+            write(os.path.join(directory, 'io'), IO.format(pid * 10, pid))
+            write(os.path.join(directory, 'limits'), LIMITS)
+            parent, pid = pid, pid + 1
+    return proc, roots
+
+
+def event_stream(ticks, eventname='TICK_5'):
+    """Writes the events Supervisor sends to an event listener to a file
+
+    :param int ticks: The number of events
+    :returns: A temporary file, positioned at the start
+    """
+    stream = tempfile.TemporaryFile()
+    for serial in range(ticks):
+        payload = 'when:{0}'.format(int(time.time()) + serial * 5)
+        stream.write(
+            'ver:3.0 server:supervisor serial:{0} pool:supermann '
+            'poolserial:{0} eventname:{1} len:{2}\n{3}'.format(
+                serial, eventname, len(payload), payload))
+    stream.seek(0)
+    return stream
+
+
+class FakeSupervisord(supermann.testing.FakeSupervisor):
+    """Serves the info of a program for each fake process tree"""
+
+    def __init__(self, roots):
+        """
+        :param list roots: The PID of each program
+        """
+        processes = list()
+        for index, pid in enumerate(roots):
+            name = 'program_{0}'.format(index)
+            processes.append(dict(
+                name=name, group=name, pid=pid, state=20,
+                statename='RUNNING', start=int(time.time()) - 60, stop=0,
+                description='', spawnerr='', exitstatus=0,
+                logfile='', stdout_logfile='', stderr_logfile=''))
+        #: The number of process infos sent
+        self.infos = 0
+        supermann.testing.FakeSupervisor.__init__(self, processes)
+
+    def info(self, data):
+        self.infos += 1
+        return dict(data, now=int(time.time()))
@@ -0,0 +1,225 @@
+"""Measures the cost of each Supermann cycle against a fake Supervisor
+
+Drives :py:meth:`supermann.core.Supermann.run` end to end: events are read
+from a recorded stream through the event listener, process info is fetched
+from a fake supervisord over XML-RPC, process trees are read from a fake
+``/proc``, and metrics are sent to fake Riemann and InfluxDB servers (see
+``benchmarks/fakes.py``). Run it from an environment where Supermann is
+installed::
+
+    python benchmarks/ticks.py --programs 10 100 1000 --save results.json
+
+Each program count runs in its own process, so that peak RSS and the
+``psutil.PROCFS_PATH`` used for the fake ``/proc`` don't leak between runs.
+``--compare`` prints the change from a previous results file.
+
+Python 2 has no ``tracemalloc``, so allocations are reported as the growth
+in objects tracked by the garbage collector over the run, and the number of
+garbage collections of each generation.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import ConfigParser
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import psutil
+
+import fakes
+import supermann
+import supermann.core
+import supermann.index
+import supermann.sampler
+import supermann.supervisor
+import supermann.testing
+import supermann.utils
+
+OUTPUTS = dict(
+    riemann='supermann.outputs.riemann.RiemannOutput',
+    influx='supermann.outputs.influx.InfluxLineOutput',
+)
+
+
+def percentiles(durations):
+    """Returns percentiles of a list of durations, in milliseconds"""
+    durations = sorted(durations)
+
+    def rank(percent):
+        return durations[min(int(len(durations) * percent / 100),
+                             len(durations) - 1)] * 1000
+    return dict(p50=rank(50), p90=rank(90), p99=rank(99),
+                max=durations[-1] * 1000)
+
+
+class GarbageCollections(object):
+    """Counts the cycles in which each generation was garbage collected
+
+    Python 2 has no ``gc.callbacks``, so collections are detected by the
+    count of a generation going down between cycles, and several collections
+    in one cycle are only counted once.
+    """
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.last = gc.get_count()
+
+    def sample(self):
+        count = gc.get_count()
+        for generation in range(3):
+            # A generation's count is reset when it is collected
+            if count[generation] < self.last[generation]:
+                self.collections[generation] += 1
+        self.last = count
+
+
+def run(programs, depth, ticks, outputs, fds):
+    """Runs Supermann for ``ticks`` events and returns its measurements"""
+    proc, roots = fakes.build_proc(programs, depth, fds)
+    supervisord = fakes.FakeSupervisord(roots)
+    sinks = dict(riemann=supermann.testing.FakeRiemann(record=False),
+                 influx=supermann.testing.FakeInflux(record=False))
+
+    parser = ConfigParser.ConfigParser()
+    parser.add_section('riemann')
+    parser.set('riemann', 'host', '127.0.0.1')
+    parser.set('riemann', 'port', str(sinks['riemann'].port))
+    parser.add_section('influx')
+    parser.set('influx', 'host', '127.0.0.1')
+    parser.set('influx', 'port', str(sinks['influx'].port))
+    parser.set('influx', 'database', 'supermann')
+
+    try:
+        os.environ['SUPERVISOR_SERVER_URL'] = supervisord.url
+        instance = supermann.core.Supermann().with_all_recivers()
+        # The listener reserves STDIN and STDOUT, which are not used here
+        sys.stdin, sys.stdout = sys.__stdin__, sys.__stdout__
+        instance.load_output(
+            ', '.join(OUTPUTS[o] for o in outputs), parser)
+        instance.supervisor.listener = supermann.supervisor.EventListener(
+            stdin=fakes.event_stream(ticks), stdout=open(os.devnull, 'w'),
+            reserve_stdin=False, reserve_stdout=False)
+
+        # Everything after this reads the fake /proc
+        psutil.PROCFS_PATH = proc
+        instance.process_index = supermann.index.ProcfsIndex(proc)
+        instance.sampler = supermann.sampler.SystemSampler(proc)
+
+        durations = list()
+        collections = GarbageCollections()
+        collect = instance.collect
+
+        def timed(event, now=None):
+            collections.sample()
+            start = supermann.utils.monotonic()
+            collect(event, now)
+            durations.append(supermann.utils.monotonic() - start)
+        instance.collect = timed
+
+        gc.collect()
+        objects = len(gc.get_objects())
+        start = supermann.utils.monotonic()
+        try:
+            instance.run()
+        except EOFError:
+            pass
+        elapsed = supermann.utils.monotonic() - start
+        gc.collect()
+        objects = len(gc.get_objects()) - objects
+    finally:
+        supervisord.stop()
+        for sink in sinks.values():
+            sink.stop()
+        shutil.rmtree(proc)
+
+    return dict(
+        programs=programs,
+        depth=depth,
+        ticks=len(durations),
+        ticks_per_second=len(durations) / elapsed,
+        latency_ms=percentiles(durations),
+        events_per_tick=dict(
+            (name, sinks[name].received_events / len(durations))
+            for name in outputs),
+        bytes_per_tick=dict(
+            (name, sinks[name].received_bytes / len(durations))
+            for name in outputs),
+        rpc_calls=supervisord.infos,
+        object_growth=objects,
+        cycles_with_gc=collections.collections,
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+
+def compare(results, path):
+    """Prints the change in each measurement from a previous results file"""
+    with open(path) as f:
+        previous = dict((r['programs'], r) for r in json.load(f)['results'])
+    for result in results:
+        old = previous.get(result['programs'])
+        if old is None:
+            continue
+        print("{0} programs: ticks/s {1:+.1%}, p99 {2:+.1%}, "
+              "peak RSS {3:+.1%}".format(
+                  result['programs'],
+                  result['ticks_per_second'] / old['ticks_per_second'] - 1,
+                  result['latency_ms']['p99'] / old['latency_ms']['p99'] - 1,
+                  result['peak_rss_kb'] / old['peak_rss_kb'] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--programs', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--depth', type=int, default=2,
+                        help="Processes in each program's tree")
+    parser.add_argument('--fds', type=int, default=8,
+                        help="Open files of each process")
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--outputs', nargs='+', default=['riemann'],
+                        choices=sorted(OUTPUTS))
+    parser.add_argument('--save', help="Write the results to a JSON file")
+    parser.add_argument('--compare', help="A results file to compare to")
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run(args.programs[0], args.depth, args.ticks, args.outputs,
+                      args.fds), sys.stdout)
+        return
+
+    results = list()
+    for programs in args.programs:
+        output = subprocess.check_output([
+            sys.executable, __file__, '--child',
+            '--programs', str(programs), '--depth', str(args.depth),
+            '--fds', str(args.fds), '--ticks', str(args.ticks),
+            '--outputs'] + args.outputs)
+        result = json.loads(output)
+        results.append(result)
+        print("{programs} programs: {ticks_per_second:.1f} ticks/s, "
+              "p50 {latency_ms[p50]:.1f}ms, p99 {latency_ms[p99]:.1f}ms, "
+              "peak RSS {peak_rss_kb}KB".format(**result))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(
+                version=supermann.__version__,
+                python=platform.python_version(),
+                time=time.time(),
+                results=results), f, indent=2, sort_keys=True)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""The metrics collected in one cycle, stored in columns
+
+Receivers used to send each metric to the output as keyword arguments, which
+created a dict for every metric on every cycle, and outputs then read the
+values back out of it. Receivers now add each metric to the
+:py:class:`MetricBatch` for the cycle, which keeps the service, value, state
+and time of each metric in parallel lists. At the end of the cycle the batch
+is sent to the output with :py:meth:`supermann.outputs.base.BaseOutput.event_batch`,
+and outputs that support it read the columns directly.
+
+:py:meth:`MetricBatch.event` accepts the same keyword arguments as
+:py:meth:`supermann.outputs.base.BaseOutput.event`, and iterating over a
+batch yields them back, so outputs and receivers that only use
+``event(**data)`` keep working.
+"""
+
+from __future__ import absolute_import
+
+import itertools
+
+
+class MetricBatch(object):
+    """The service, value, state and time of each metric, in columns
+
+    A value, state or time that was not set is None. Other attributes of an
+    event, such as ``tags`` or ``ttl``, are rare, so they are kept in a dict
+    by row instead of in a column.
+    """
+
+    __slots__ = ['services', 'values', 'states', 'times', 'extra']
+
+    def __init__(self):
+        #: The service name of each metric
+        self.services = list()
+        #: The ``metric_f`` of each metric
+        self.values = list()
+        #: The ``state`` of each metric
+        self.states = list()
+        #: The ``time`` of each metric
+        self.times = list()
+        #: Other event attributes, by row
+        self.extra = dict()
+
+    def __repr__(self):
+        return "MetricBatch({0} metrics)".format(len(self.services))
+
+    def __len__(self):
+        return len(self.services)
+
+    @classmethod
+    def from_events(cls, events):
+        """Creates a batch from event dicts, i.e. read from a spool"""
+        batch = cls()
+        for data in events:
+            batch.event(**data)
+        return batch
+
+    def add(self, service, metric=None, state=None, time=None):
+        """Adds a metric
+
+        :param str service: The service name
+        :param metric: The ``metric_f`` value
+        :param str state: The ``state``
+        :param float time: The ``time`` of the metric
+        """
+        self.services.append(service)
+        self.values.append(metric)
+        self.states.append(state)
+        self.times.append(time)
+
+    def event(self, service=None, metric_f=None, state=None, time=None,
+              **extra):
+        """Adds a metric given as event keyword arguments"""
+        if extra:
+            self.extra[len(self.services)] = extra
+        self.add(service, metric_f, state, time)
+
+    def extend(self, batch):
+        """Adds the metrics from another batch"""
+        offset = len(self.services)
+        self.services.extend(batch.services)
+        self.values.extend(batch.values)
+        self.states.extend(batch.states)
+        self.times.extend(batch.times)
+        for index, extra in batch.extra.items():
+            self.extra[offset + index] = extra
+
+    def stamp(self, time):
+        """Sets the time of each metric that does not have one
+
+        :param float time: The time the metrics were collected
+        """
+        self.times = [time if t is None else t for t in self.times]
+
+    def rows(self):
+        """Returns an iterator of ``(service, metric, state)`` tuples"""
+        return itertools.izip(self.services, self.values, self.states)
+
+    def __getitem__(self, index):
+        """Returns the event keyword arguments for a row"""
+        if index < 0:
+            index += len(self.services)
+        data = dict(service=self.services[index])
+        if self.values[index] is not None:
+            data['metric_f'] = self.values[index]
+        if self.states[index] is not None:
+            data['state'] = self.states[index]
+        if self.times[index] is not None:
+            data['time'] = self.times[index]
+        if index in self.extra:
+            data.update(self.extra[index])
+        return data
+
+    def __iter__(self):
+        """Yields the event keyword arguments for each row"""
+        for index in xrange(len(self.services)):
+            yield self[index]
+
+    def clear(self):
+        del self.services[:]
+        del self.values[:]
+        del self.states[:]
+        del self.times[:]
+        self.extra.clear()
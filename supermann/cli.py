@@ -9,6 +9,11 @@ import click
 import sys
 
 import supermann.core
+import supermann.parallel
+import supermann.runtime
+import supermann.scheduler
+import supermann.selection
+import supermann.telemetry
 import supermann.utils
 
 
@@ -21,16 +26,21 @@ import supermann.utils
 @click.option(
     '--system/--no-system', default=True,
     help='Enable or disable system metrics.')
+@click.option(
+    '--profile', type=click.Path(dir_okay=False), default=None,
+    help='Profile Supermann, writing stats to this file on SIGUSR1.')
 @click.argument(
     'host', type=click.STRING, default='localhost', envvar='RIEMANN_HOST')
 @click.argument(
     'port', type=click.INT, default=5555, envvar='RIEMANN_PORT')
-def main(log_level, host, port, system):
+def main(log_level, host, port, system, profile):
     """The main entry point for Supermann"""
     # Log messages are sent to stderr, and Supervisor takes care of the rest
 
     try:
         supermann.utils.configure_logging(log_level)
+        if profile:
+            supermann.telemetry.Profiler(profile).start()
 
         s = supermann.core.Supermann(host, port)
         if system:
@@ -50,40 +60,90 @@ def from_file(config):
     main.main(args=config.read().split())
 
 @click.command()
+@click.option(
+    '--profile', type=click.Path(dir_okay=False), default=None,
+    help='Profile Supermann, writing stats to this file on SIGUSR1.')
 @click.argument('config', type=click.File('r'))
-def from_config(config):
+def from_config(config, profile):
     """
     Entry point that reads arguments from a .ini config
     """
 
     parser = ConfigParser()
     parser.readfp(config)
+    options = read_options(parser)
 
     try:
-        log_level = parser.get("supermann", "log_level")
-    except NoOptionError:
-        log_level = "INFO"
-
-    try:
-        system = parser.getboolean("supermann", "system")
-    except NoOptionError:
-        system = True
-
-    try:
-        output_class = parser.get("supermann", "output_class")
-    except NoOptionError:
-        output_class = "supermann.outputs.riemann.RiemannOutput"
+        supermann.utils.configure_logging(options['log_level'])
+        if profile:
+            supermann.telemetry.Profiler(profile).start()
 
-    try:
-        supermann.utils.configure_logging(log_level)
-
-        s = supermann.core.Supermann()
-        s.load_output(output_class, parser)
+        s = supermann.core.Supermann(
+            process_index=options['process_index'],
+            process_info_ttl=options['process_info_ttl'])
+        s.load_output(options['output_class'], parser)
+        configure_sections(s, parser)
 
-        if system:
+        if options['system']:
             s.connect_system_metrics()
+        if options['extended_system']:
+            s.connect_extended_system_metrics()
         s.connect_process_metrics()
         s.run()
     except Exception as e:
         logging.exception("Exception running supermann: %s", e)
         raise e, None, sys.exc_traceback
+
+
+#: The options in the ``[supermann]`` section, the ``ConfigParser`` method
+#: used to read each one, and their defaults
+OPTIONS = [
+    ('log_level', 'get', "INFO"),
+    ('system', 'getboolean', True),
+    ('output_class', 'get', "supermann.outputs.riemann.RiemannOutput"),
+    ('process_index', 'get', None),
+    ('extended_system', 'getboolean', False),
+    ('process_info_ttl', 'getfloat', 300.0),
+]
+
+
+def read_options(parser):
+    """Reads the options in the ``[supermann]`` section, with defaults
+
+    :type parser: ConfigParser
+    :returns: A dict of option values by name
+    """
+    options = dict()
+    for name, method, default in OPTIONS:
+        try:
+            options[name] = getattr(parser, method)("supermann", name)
+        except NoOptionError:
+            options[name] = default
+    return options
+
+
+def configure_sections(s, parser):
+    """Enables the features configured by optional config sections
+
+    :param supermann.core.Supermann s: The instance to configure
+    :type parser: ConfigParser
+    """
+    if parser.has_section("telemetry"):
+        s.instrument(supermann.telemetry.Telemetry.from_items(
+            parser.items("telemetry")))
+
+    if parser.has_section("schedule"):
+        s.schedule = supermann.scheduler.Schedule.from_items(
+            parser.items("schedule"))
+
+    selection = supermann.selection.Selection.from_config(parser)
+    if selection.rules:
+        s.selection = selection
+
+    if parser.has_section("parallel"):
+        s.parallel = supermann.parallel.ParallelSnapshots.from_items(
+            parser.items("parallel"))
+
+    if parser.has_section("concurrent"):
+        s.runtime = supermann.runtime.Runtime.from_items(
+            parser.items("concurrent"))
@@ -5,15 +5,31 @@ from __future__ import absolute_import
 import collections
 import os
 import sys
+import threading
+import time
 from ConfigParser import ConfigParser
 
 import psutil
 
+import supermann.batch
+import supermann.index
 import supermann.metrics.process
 import supermann.metrics.system
+import supermann.sampler
+import supermann.scheduler
+import supermann.selection
+import supermann.services
 import supermann.signals
+import supermann.snapshot
 import supermann.supervisor
+import supermann.utils
 from supermann.outputs import load_output
+from supermann.outputs.aggregate import AggregateOutput
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.deadband import DeadbandOutput
+from supermann.outputs.fanout import FanoutOutput
+from supermann.outputs.rate import RateOutput
+from supermann.outputs.telemetry import TelemetryOutput
 
 
 class Supermann(object):
@@ -24,11 +40,61 @@ class Supermann(object):
     signals.
     """
 
-    def __init__(self, host=None, port=None):
+    def __init__(self, host=None, port=None, process_index=None,
+                 process_info_ttl=300.0):
         self.actions = collections.defaultdict(list)
+
+        #: The metrics collected by receivers in the current cycle
+        self.batch = supermann.batch.MetricBatch()
         self.process_cache = dict()
+        self.snapshots = dict()
+
+        #: The ``(pid, create_time)`` of each running program, by name
+        self.identities = dict()
+        #: The names of the programs emitted in the last cycle
+        self.programs = set()
+
+        #: ``(start time, process)`` tuples for child processes by PID, kept
+        #: between cycles
+        self.child_cache = dict()
+        self.children_seen = set()
+
+        #: Calculates CPU utilisation for each snapshot
+        self.cpu = supermann.snapshot.CpuTracker()
+
+        #: Reads system metrics, once per cycle
+        self.sampler = supermann.sampler.SystemSampler()
+        self.sample = None
+        self.sample_lock = threading.Lock()
         self.log = supermann.utils.getLogger(self)
 
+        #: If set to a :py:class:`supermann.scheduler.Schedule`, metrics are
+        #: collected on that schedule instead of when an event is received
+        self.schedule = None
+        self.collector = None
+
+        #: If set to a :py:class:`supermann.selection.Selection`, only the
+        #: process receivers it selects are run for each program
+        self.selection = None
+
+        #: If set to a :py:class:`supermann.runtime.Runtime`, receivers are
+        #: run concurrently in a pool of worker threads
+        self.runtime = None
+
+        #: If set to a :py:class:`supermann.parallel.ParallelSnapshots`,
+        #: process snapshots are read in a pool of workers
+        self.parallel = None
+
+        #: If set to a :py:class:`supermann.telemetry.Telemetry` with
+        #: :py:meth:`instrument`, each stage of a cycle is timed
+        self.telemetry = None
+
+        # The process index is used to find the children of each process
+        if process_index:
+            self.process_index = supermann.utils.import_object(process_index)()
+        else:
+            self.process_index = supermann.index.default_index()
+
         # Before connecting to Supervisor and Riemann, show when Supermann
         # started up and which supervisord instance it is running under
         process = psutil.Process(os.getpid())
@@ -43,7 +109,7 @@ class Supermann(object):
 
         # The Supervisor listener and client take their configuration from
         # the environment variables provided by Supervisor
-        self.supervisor = supermann.supervisor.Supervisor()
+        self.supervisor = supermann.supervisor.Supervisor(process_info_ttl)
 
         # This sets an exception handler to deal with uncaught exceptions -
         # this is used to ensure both a log message (and more importantly, a
@@ -54,17 +120,73 @@ class Supermann(object):
         """
         Loads output by it class path and inits it from configparser instance or from attrs dict
 
+        ``output_class`` can be a comma separated list of class paths, in which
+        case events are sent to every output through a
+        :py:class:`supermann.outputs.fanout.FanoutOutput`.
+
         :type configparser: ConfigParser
         """
+        classes = [c.strip() for c in (output_class or '').split(',') if c.strip()]
+        outputs = [self._load_output(c, configparser, attrs) for c in classes or [None]]
+
+        # The concurrent runtime always flushes from a background thread
+        section = BackgroundOutput.section_name
+        in_background = configparser and (
+            configparser.has_section(section) or
+            configparser.has_section('concurrent'))
+        background = dict(configparser.items(section)) if (
+            configparser and configparser.has_section(section)) else {}
+
+        if len(outputs) > 1:
+            # Each output is flushed by its own background thread
+            self.output_client = FanoutOutput(outputs)
+            self.output_client.init(**background)
+        elif in_background:
+            # Flush the output from a background thread if configured to
+            self.output_client = BackgroundOutput(outputs[0])
+            self.output_client.init(**background)
+        else:
+            self.output_client = outputs[0]
+
+        # Rates are calculated, metrics are aggregated, and unchanged metrics
+        # are dropped, in that order, before events are batched for flushing
+        if configparser and configparser.has_section(
+                DeadbandOutput.section_name):
+            self.output_client = DeadbandOutput(self.output_client)
+            self.output_client.init(
+                **dict(configparser.items(DeadbandOutput.section_name)))
+        if configparser and configparser.has_section(
+                AggregateOutput.section_name):
+            self.output_client = AggregateOutput(self.output_client)
+            self.output_client.init(
+                **dict(configparser.items(AggregateOutput.section_name)))
+        if configparser and configparser.has_section(RateOutput.section_name):
+            self.output_client = RateOutput(
+                self.output_client, self.process_identity)
+            self.output_client.init(
+                **dict(configparser.items(RateOutput.section_name)))
+
+    def _load_output(self, output_class, configparser=None, attrs=None):
+        """Loads a single output and inits it
+
+        :returns: An initialised output
+        """
+        output = load_output(output_class)
+        output.init(**(attrs or dict(configparser.items(output.section_name))))
+        return output
 
-        # Output client wrapper
-        self.output_client = load_output(output_class)
-
-        # init output client
+    def instrument(self, telemetry):
+        """Times each stage of a cycle, and reports the timings as metrics
 
-        attrs = attrs or dict(configparser.items(self.output_client.section_name))
+        Must be called after the output is loaded.
 
-        self.output_client.init(**attrs)
+        :param supermann.telemetry.Telemetry telemetry: Records the timings
+        :returns: the Supermann instance the method was called on
+        """
+        self.telemetry = telemetry
+        self.supervisor.client.telemetry = telemetry
+        self.output_client = TelemetryOutput(self.output_client, telemetry)
+        return self
 
     def connect(self, signal, reciver):
         """Connects a signal that will recive messages from this instance
@@ -99,6 +221,16 @@ class Supermann(object):
         self.connect_event(supermann.metrics.system.load_scaled)
         self.connect_event(supermann.metrics.system.uptime)
 
+    def connect_extended_system_metrics(self):
+        """Collect per-CPU, disk and network metrics when an event is received
+
+        :returns: the Supermann instance the method was called on
+        """
+        self.connect_event(supermann.metrics.system.cpu_per_core)
+        self.connect_event(supermann.metrics.system.disk)
+        self.connect_event(supermann.metrics.system.net)
+        return self
+
     def connect_process_metrics(self):
         """Collect metrics for each process when an event is received
 
@@ -116,41 +248,430 @@ class Supermann(object):
     def run(self):
         """Runs forever, ensuring output client is disconnected properly
 
+        The process table is updated from each event. If a schedule is set,
+        events are acknowledged as soon as they are received, and a
+        :py:class:`supermann.scheduler.Collector` thread collects and flushes
+        metrics, reporting state changes as soon as they are received.
+
         :returns: the Supermann instance the method was called on
+        :raises ValueError: if the selection names metrics that are not
+            collected
         """
-        with self.output_client:
-            for event in self.supervisor.run_forever():
-                # Emit a signal for each event
-                supermann.signals.event.send(self, event=event)
-                # Emit a signal for each Supervisor subprocess
-                self.emit_processes(event=event)
-                # Send the queued events at the end of the cycle
-                self.output_client.flush()
+        if self.selection is not None:
+            self.selection.validate(
+                list(supermann.signals.process.receivers_for(self)))
+        if self.parallel is not None:
+            self.parallel.start()
+        if self.runtime is not None:
+            self.runtime.start(self)
+        try:
+            self._run()
+        finally:
+            if self.runtime is not None:
+                self.runtime.stop()
+            if self.parallel is not None:
+                self.parallel.stop()
         return self
 
+    def _run(self):
+        with self.output_client:
+            if self.schedule is None:
+                for event in self.supervisor.run_forever():
+                    self.supervisor.update_processes(event)
+                    self.collect(event)
+            else:
+                self.collector = supermann.scheduler.Collector(
+                    self, self.schedule)
+                self.collector.start()
+                try:
+                    for event in self.supervisor.run_forever():
+                        self.collector.check()
+                        self.collector.notify(
+                            event, self.supervisor.update_processes(event))
+                finally:
+                    self.collector.stop()
+                self.collector.check()
+
+    def receivers(self, signal, now=None):
+        """Returns the receivers connected to a signal for this instance
+
+        If a schedule is set, only the receivers that are due to run are
+        returned.
+
+        :param blinker.Signal signal: The signal to find receivers for
+        :param float now: The current time, used by the schedule
+        """
+        receivers = list(signal.receivers_for(self))
+        if self.schedule is not None:
+            receivers = self.schedule.due(receivers, now or time.time())
+        return receivers
+
+    def collect(self, event, now=None):
+        """Collects metrics for one cycle and flushes them to the output
+
+        :param event: The last event received from Supervisor
+        :param float now: The current time, used by the schedule
+        """
+        start = supermann.utils.monotonic()
+        # The system sample is read by the first receiver that uses it
+        self.sample = None
+        # Emit a signal for each event
+        for receiver in self.receivers(supermann.signals.event, now):
+            self.dispatch(receiver, event=event)
+        # Emit a signal for each Supervisor subprocess
+        self.emit_processes(
+            event, self.receivers(supermann.signals.process, now), now)
+        # Send the queued events at the end of the cycle
+        if self.runtime is not None:
+            self.runtime.wait(self)
+        if self.telemetry is not None:
+            self.telemetry.record('tick', supermann.utils.monotonic() - start)
+        self.flush()
+
+    def flush(self):
+        """Sends the metrics collected this cycle to the output and flushes it
+
+        A new batch is started for the next cycle, so the output can keep the
+        batch it was given. Metrics are stamped with the time of the flush,
+        so they keep the time they were collected at if they are spooled or
+        retried by a background output.
+
+        Errors from the output are logged rather than raised. Outputs keep
+        the metrics they could not send for the next flush, and Supervisor
+        would restart Supermann if the error stopped it, losing them.
+        """
+        batch, self.batch = self.batch, supermann.batch.MetricBatch()
+        try:
+            if batch:
+                batch.stamp(time.time())
+                self.output_client.event_batch(batch)
+            self.output_client.flush()
+        except Exception as e:
+            self.log.warning("Flush of {0} metrics failed ({1}: {2})".format(
+                len(batch), e.__class__.__name__, e))
+
+    def dispatch(self, receiver, key=None, **kwargs):
+        """Calls a receiver, or submits it to the runtime if one is set
+
+        :param receiver: A receiver connected to a signal
+        :param key: Identifies the call in the runtime, i.e. a process name
+        :param kwargs: The arguments to send to the receiver
+        """
+        if self.runtime is None:
+            if self.telemetry is None:
+                receiver(self, **kwargs)
+            else:
+                with self.telemetry.timer(self.telemetry.receiver_key(receiver)):
+                    receiver(self, **kwargs)
+        else:
+            self.runtime.submit(self, receiver, key=key, **kwargs)
+
+    def system_sample(self):
+        """Returns a sample of system metrics, reading it once per cycle
+
+        The extended counters are only read if a receiver that uses them is
+        connected.
+
+        :rtype: supermann.sampler.SystemSampler
+        """
+        with self.sample_lock:
+            if self.sample is None:
+                extended = any(
+                    getattr(r, 'extended', False)
+                    for r in supermann.signals.event.receivers_for(self))
+                self.sample = self.sampler.read(extended)
+            return self.sample
+
+    def process_info(self):
+        """Returns the info for each Supervisor process
+
+        If a runtime is set, this is the table last read by its poller.
+        """
+        if self.runtime is not None:
+            return self.runtime.process_info()
+        return self.supervisor.process_info()
+
+    def process_identity(self, name):
+        """Returns the ``(pid, create_time)`` of a running program
+
+        :param str name: The name of a program emitted in the last cycle
+        :returns: A tuple, or None if the program is not running
+        """
+        return self.identities.get(name)
+
+    def collect_state_changes(self, names):
+        """Emits the new state of processes that changed state and flushes
+
+        Only the process receivers marked with ``on_state_change`` are run,
+        so state changes are reported as soon as they happen instead of when
+        the process receivers are next due.
+
+        :param list names: The ``group:name`` of each process that changed
+        """
+        receivers = [r for r in supermann.signals.process.receivers_for(self)
+                     if getattr(r, 'on_state_change', False)]
+        if not receivers:
+            return
+
+        processes = dict(
+            (supermann.supervisor.ProcessInfoCache.key(data), data)
+            for data in self.process_info())
+        for name in names:
+            data = processes.get(name)
+            if data is None:
+                continue
+            selected = receivers
+            if self.selection is not None:
+                selected = self.selection.receivers(data['name'], receivers)
+            if not selected:
+                continue
+            try:
+                process = self._get_process(data.pop('pid'))
+            except psutil.NoSuchProcess:
+                process = None
+            for receiver in selected:
+                self.dispatch(receiver, key=name, process=process, data=data)
+        if self.runtime is not None:
+            self.runtime.wait(self)
+        self.flush()
+
     def exception_handler(self, *exc_info):
         """Used as a global exception handler to ensure errors are logged"""
         self.log.error("A fatal exception occurred:", exc_info=exc_info)
 
-    def emit_processes(self, event):
+    def emit_processes(self, event, receivers=None, now=None):
         """Emit a signal for each Supervisor child process
 
         A new cache is created from the processes emitted in this cycle, which
-        drops processes that no longer exist from the cache.
+        drops processes that no longer exist from the cache. Each running
+        process tree is read into a snapshot before any signals are sent, if
+        any of the receivers for that process read from it.
+
+        If a selection is set, it chooses the receivers for each program
+        before any process is read. Programs with no receivers to run are
+        not read, and are kept in the cache until they are next emitted.
 
         :param event: An event received from Supervisor
+        :param list receivers: The receivers to send each process to,
+            defaulting to all receivers connected to the process signal
+        :param float now: The current time, used by the selection
         """
-        cache = dict()
+        if receivers is None:
+            receivers = self.receivers(supermann.signals.process)
+        if not receivers:
+            return
 
-        for data in self.supervisor.rpc.getAllProcessInfo():
-            pid = data.pop('pid')
-            cache[pid] = self._get_process(pid)
-            self.log.debug("Emitting signal for process {0}({1})".format(
-                data['name'], pid))
-            supermann.signals.process.send(self, process=cache[pid], data=data)
+        cache = dict()
+        identities = dict()
+        skipped = list()
+        selected = self.select_programs(
+            receivers, now or time.time(), cache, identities, skipped)
+        emit = self.open_processes(selected, cache, identities, skipped)
 
         # The cache is stored for use in _get_process and the next call
         self.process_cache = cache
+        self.identities = identities
+
+        self.snapshots = dict()
+        running = [process for process, _, _, reads in emit
+                   if process is not None and reads]
+        if running:
+            self.read_snapshots(running, skipped)
+            emit = [self.check_snapshot(*item) for item in emit]
+
+        for process, data, program_receivers, _ in emit:
+            self.log.debug("Emitting signal for process {0}({1})".format(
+                data['name'], process.pid if process else 0))
+            for receiver in program_receivers:
+                self.dispatch(receiver, key=data['name'], process=process,
+                              data=data)
+
+    def select_programs(self, receivers, now, cache, identities, skipped):
+        """Chooses the receivers to run for each program in this cycle
+
+        Programs with no receivers to run keep their cached process and
+        identity, which are added to ``cache`` and ``identities``, and their
+        PIDs are added to ``skipped``.
+
+        :param list receivers: The receivers connected to the process signal
+        :param float now: The current time, used by the selection
+        :returns: A list of ``(pid, data, receivers, reads)`` tuples for the
+            programs to emit, where ``reads`` is True if a receiver reads the
+            process tree
+        """
+        programs = set()
+        selected = list()
+        for data in self.process_info():
+            pid = data.pop('pid')
+            programs.add(data['name'])
+            program_receivers = receivers
+            if self.selection is not None:
+                program_receivers = self.selection.select(
+                    data['name'], receivers, now)
+            if program_receivers:
+                reads = pid != 0 and any(
+                    getattr(r, 'reads_process', False)
+                    for r in program_receivers)
+                selected.append((pid, data, program_receivers, reads))
+            elif pid in self.process_cache:
+                cache[pid] = self.process_cache[pid]
+                if data['name'] in self.identities:
+                    identities[data['name']] = self.identities[data['name']]
+                skipped.append(pid)
+        self.forget_programs(programs)
+        return selected
+
+    def forget_programs(self, programs):
+        """Drops the state kept for programs that are no longer running
+
+        :param set programs: The names of the programs running this cycle
+        """
+        # Service names are no longer needed for programs that have gone
+        gone = self.programs - programs
+        supermann.services.registry.forget(gone)
+        if self.selection is not None:
+            self.selection.forget(gone)
+        self.programs = programs
+
+    def open_processes(self, selected, cache, identities, skipped):
+        """Finds the process for each program that will be emitted
+
+        :param list selected: The tuples returned by :py:meth:`select_programs`
+        :returns: A list of ``(process, data, receivers, reads)`` tuples,
+            where ``process`` is None if the program is not running
+        """
+        # The index is only needed to find the children of processes read
+        if any(reads for _, _, _, reads in selected):
+            self.process_index.refresh()
+
+        emit = list()
+        for pid, data, program_receivers, reads in selected:
+            if reads:
+                self.process_index.verify(pid)
+            try:
+                process = self._get_process(pid)
+                if process is not None:
+                    identities[data['name']] = (pid, process.create_time())
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                process = self.process_gone(data)
+            if process is not None:
+                cache[pid] = process
+                if not reads:
+                    skipped.append(pid)
+            emit.append((process, data, program_receivers, reads))
+        return emit
+
+    def read_snapshots(self, running, skipped):
+        """Reads a snapshot of each running process tree for this cycle
+
+        :param list running: The ``psutil.Process`` objects to read
+        :param list skipped: The PIDs of processes not read in this cycle,
+            whose CPU times are kept
+        """
+        start = supermann.utils.monotonic()
+        self.expire_children()
+        self.cpu.expire(keep=skipped)
+        if self.parallel is not None:
+            self.snapshots.update(self.parallel.collect(self, running))
+        elif self.runtime is not None:
+            self.runtime.map(self.read_snapshot, running)
+        else:
+            for process in running:
+                self.read_snapshot(process)
+        if self.telemetry is not None:
+            self.telemetry.record(
+                'snapshots', supermann.utils.monotonic() - start)
+
+    def process_gone(self, data):
+        """Handles a program whose process has exited or can't be read
+
+        The PID may be out of date, i.e. if the process exited without a
+        ``PROCESS_STATE`` event, so the process info for the program is
+        fetched again the next time it is read.
+
+        :param dict data: The process info for the program
+        :returns: None, which is emitted in place of the process
+        """
+        self.log.debug("Process for '{0}' has exited".format(data['name']))
+        self.supervisor.mark_stale(
+            supermann.supervisor.ProcessInfoCache.key(data))
+        return None
+
+    def check_snapshot(self, process, data, receivers, reads):
+        """Emits a program without a process if its snapshot can't be read
+
+        Snapshots that were not read in time, i.e. by a runtime, are read
+        again here.
+
+        :returns: The ``(process, data, receivers, reads)`` to emit
+        """
+        if (reads and process is not None and
+                process.pid not in self.snapshots and
+                self.read_snapshot(process) is None):
+            self.process_cache.pop(process.pid, None)
+            self.identities.pop(data['name'], None)
+            process = self.process_gone(data)
+        return process, data, receivers, reads
+
+    def read_snapshot(self, process):
+        """Returns a snapshot of a process tree, or None if it has exited
+
+        :param psutil.Process process: A process emitted in this cycle
+        :rtype: supermann.snapshot.ProcessSnapshot
+        """
+        try:
+            return self.snapshot(process)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+
+    def snapshot(self, process):
+        """Returns a snapshot of a process tree, reading it once per cycle
+
+        :param psutil.Process process: A process emitted in this cycle
+        :rtype: supermann.snapshot.ProcessSnapshot
+        """
+        try:
+            return self.snapshots[process.pid]
+        except KeyError:
+            snapshot = supermann.snapshot.ProcessSnapshot.collect(
+                process, self.children(process))
+            self.cpu.update(snapshot, time.time())
+            self.snapshots[process.pid] = snapshot
+            return snapshot
+
+    def children(self, process):
+        """Returns the descendants of a process using the process index
+
+        ``psutil.Process`` objects for children are cached by PID, so they
+        are only created once for each child process. A cached process is
+        replaced if its start time does not match the one in the index, as
+        the PID has been reused.
+
+        :param psutil.Process process: The root process
+        :returns: A list of ``psutil.Process`` objects
+        """
+        children = list()
+        for pid in self.process_index.descendants(process.pid):
+            start_time = self.process_index.start_time(pid)
+            cached = self.child_cache.get(pid)
+            if cached is not None and cached[0] == start_time:
+                child = cached[1]
+            else:
+                try:
+                    child = psutil.Process(pid)
+                except psutil.NoSuchProcess:
+                    self.child_cache.pop(pid, None)
+                    continue
+                self.child_cache[pid] = (start_time, child)
+            self.children_seen.add(pid)
+            children.append(child)
+        return children
+
+    def expire_children(self):
+        """Drops the child processes that were not seen in the last cycle"""
+        for pid in set(self.child_cache) - self.children_seen:
+            del self.child_cache[pid]
+        self.children_seen = set()
 
     def _get_process(self, pid):
         """Returns a psutil.Process object or None for a PID
@@ -0,0 +1,220 @@
+"""Indexes of the host process table, used to find the children of a process
+
+``psutil.Process.children()`` scans every process on the host each time it
+is called, so finding the children of every Supervisor program costs
+O(programs x host processes). An index is refreshed once per cycle, and maps
+each PID to its children so that finding descendants is a dictionary walk.
+
+The index used by :py:class:`supermann.core.Supermann` can be replaced by
+passing the path to another :py:class:`ProcessIndex` class.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import os
+
+import psutil
+
+import supermann.utils
+
+
+class ProcessIndex(object):
+    """Base class for process indexes
+
+    Subclasses should implement :py:meth:`refresh`, and fill
+    :py:attr:`children` with a set of child PIDs for each parent PID.
+    """
+
+    def __init__(self):
+        self.log = supermann.utils.getLogger(self)
+        self.children = collections.defaultdict(set)
+
+    def refresh(self):
+        """Updates the index from the host process table"""
+        raise NotImplementedError
+
+    def verify(self, pid):
+        """Checks the index entry for a PID is still for the same process
+
+        :param int pid: The PID to check
+        """
+
+    def start_time(self, pid):
+        """Returns the start time recorded for a PID, if the index has one
+
+        Used with the PID to tell apart processes that reuse a PID.
+        """
+        return None
+
+    def descendants(self, pid):
+        """Returns the PIDs of all descendants of a process
+
+        :param int pid: The PID of the root process
+        :returns: A list of PIDs, parents before their children
+        """
+        descendants = list()
+        stack = list(self.children.get(pid, ()))
+        while stack:
+            child = stack.pop()
+            descendants.append(child)
+            stack.extend(self.children.get(child, ()))
+        return descendants
+
+
+class PsutilIndex(ProcessIndex):
+    """Rebuilds the index from ``psutil.process_iter()`` each refresh
+
+    This works on any platform psutil supports, but reads every process on
+    each refresh.
+    """
+
+    def __init__(self):
+        super(PsutilIndex, self).__init__()
+        self.start_times = dict()
+
+    def start_time(self, pid):
+        return self.start_times.get(pid)
+
+    def refresh(self):
+        children = collections.defaultdict(set)
+        start_times = dict()
+        for process in psutil.process_iter():
+            try:
+                info = process.as_dict(attrs=['ppid', 'create_time'])
+            except psutil.NoSuchProcess:
+                continue
+            children[info['ppid']].add(process.pid)
+            start_times[process.pid] = info['create_time']
+        self.children = children
+        self.start_times = start_times
+
+
+class ProcfsIndex(ProcessIndex):
+    """Maintains the index incrementally from ``/proc``
+
+    Each refresh lists ``/proc`` once, and only reads ``/proc/[pid]/stat``
+    for PIDs that were not present on the last refresh. When a process exits
+    its children are re-read, as they will have been reparented.
+
+    A PID that is reused between two refreshes cannot be seen by listing
+    ``/proc``, so :py:meth:`verify` compares the start time of each process
+    in a tree with the one recorded when it was indexed.
+    """
+
+    def __init__(self, proc='/proc'):
+        super(ProcfsIndex, self).__init__()
+        self.proc = proc
+        #: Maps each indexed PID to a ``(ppid, start time)`` tuple
+        self.entries = dict()
+
+    def stat(self, pid):
+        """Reads the parent PID and start time of a process
+
+        :param int pid: The PID to read
+        :returns: A ``(ppid, start time)`` tuple, or None if the process
+            no longer exists
+        """
+        try:
+            with open(os.path.join(self.proc, str(pid), 'stat'), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        # The process name is in brackets, and may contain spaces
+        fields = data[data.rfind(b')') + 2:].split()
+        return int(fields[1]), int(fields[19])
+
+    def add(self, pid, entry=None):
+        """Reads a process into the index, moving it if it was reparented
+
+        :param int pid: The PID to read
+        :param tuple entry: The result of :py:meth:`stat`, if already read
+        """
+        entry = entry or self.stat(pid)
+        if entry is None:
+            return
+        if pid in self.entries:
+            self.unlink(pid)
+        self.entries[pid] = entry
+        self.children[entry[0]].add(pid)
+
+    def unlink(self, pid):
+        """Removes a process from the children of its parent
+
+        :param int pid: The PID to unlink
+        """
+        ppid = self.entries[pid][0]
+        siblings = self.children.get(ppid)
+        if siblings is not None:
+            siblings.discard(pid)
+            if not siblings:
+                del self.children[ppid]
+
+    def remove(self, pid):
+        """Removes a process from the index
+
+        :param int pid: The PID to remove
+        :returns: The PIDs of the process's children
+        """
+        self.unlink(pid)
+        del self.entries[pid]
+        return self.children.pop(pid, set())
+
+    def start_time(self, pid):
+        entry = self.entries.get(pid)
+        return entry[1] if entry else None
+
+    def refresh(self):
+        pids = set(int(name) for name in os.listdir(self.proc)
+                   if name.isdigit())
+
+        # The children of exited processes have been reparented
+        orphans = set()
+        for pid in set(self.entries) - pids:
+            orphans.update(self.remove(pid))
+
+        for pid in (pids - set(self.entries)) | (orphans & pids):
+            self.add(pid)
+
+    def verify(self, pid):
+        """Checks the entries for a process and its descendants
+
+        Each process in the tree is read again, and an entry whose start time
+        no longer matches is replaced, as its PID has been reused since the
+        last refresh. Processes that have exited are removed.
+
+        :param int pid: The PID of the root process
+        """
+        stack = [pid]
+        while stack:
+            pid = stack.pop()
+            entry = self.stat(pid)
+            if entry is None or entry[1] != self.start_time(pid):
+                self.replace(pid, entry)
+            elif entry[0] != self.entries[pid][0]:
+                self.add(pid, entry)
+            stack.extend(self.children.get(pid, ()))
+
+    def replace(self, pid, entry):
+        """Replaces the entry for a process that has exited or been reused
+
+        The children of the old process are read again, as they will have
+        been reparented.
+
+        :param int pid: The PID to replace
+        :param tuple entry: The result of :py:meth:`stat` for the PID
+        """
+        if pid in self.entries:
+            if entry is not None:
+                self.log.debug("PID {0} has been reused".format(pid))
+            for orphan in self.remove(pid):
+                self.add(orphan)
+        if entry is not None:
+            self.add(pid, entry)
+
+def default_index():
+    """Returns a :py:class:`ProcfsIndex` if ``/proc`` exists, or a
+    :py:class:`PsutilIndex` if it does not"""
+    if os.path.isdir('/proc'):
+        return ProcfsIndex()
+    return PsutilIndex()
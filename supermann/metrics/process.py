@@ -3,21 +3,41 @@
 from __future__ import absolute_import, division
 
 import functools
-import logging
-from pprint import pformat
 
-import psutil
 from psutil import Process
 
 import supermann.utils
+from supermann.services import registry
+from supermann.snapshot import get_nofile_limit  # noqa
+
+CPU_PERCENT = registry.process('cpu:percent')
+CPU_ABSOLUTE = registry.process('cpu:absolute')
+MEM_VIRT_ABSOLUTE = registry.process('mem:virt:absolute')
+MEM_RSS_ABSOLUTE = registry.process('mem:rss:absolute')
+MEM_RSS_PERCENT = registry.process('mem:rss:percent')
+FDS_ABSOLUTE = registry.process('fds:absolute')
+FDS_PERCENT = registry.process('fds:percent')
+IO_READ_BYTES = registry.process('io:read:bytes')
+IO_WRITE_BYTES = registry.process('io:write:bytes')
+STATE = registry.process('state')
+UPTIME = registry.process('uptime')
+
 
 def with_children(process, metric_func):
+    """Sums a metric over a process and its children
 
+    :param psutil.Process process: The root of the process tree
+    :param metric_func: A function returning the metric for one process
+    """
     return metric_func(process) + sum(metric_func(p) for p in process.children())
 
 
 def running_process(function):
-    """Decorates a signals.process reciver to only run if the process exists"""
+    """Decorates a signals.process reciver to only run if the process exists
+
+    Decorated recivers are marked with ``reads_process``, so that Supermann
+    knows to read a snapshot of each process before they are run.
+    """
     @functools.wraps(function)
     def wrapper(sender, process, data):
         if process is None:
@@ -26,20 +46,18 @@ def running_process(function):
                 data['name'], data['statename']))
         else:
             return function(sender, process, data)
+    wrapper.reads_process = True
     return wrapper
 
 
-def get_nofile_limit(pid):
-    """Returns the NOFILE limit for a given PID
+def on_state_change(function):
+    """Marks a signals.process reciver to also run when a process changes state
 
-    :param int pid: The PID of the process
-    :returns: (*int*) The NOFILE limit
+    When metrics are collected on a schedule, marked recivers are run for a
+    process as soon as Supervisor reports that it changed state.
     """
-    with open('/proc/%s/limits' % pid, 'r') as f:
-        for line in f:
-            if line.startswith('Max open files'):
-                return int(line.split()[4])
-    raise RuntimeError('Could not find "Max open files" limit')
+    function.on_state_change = True
+    return function
 
 
 @running_process
@@ -49,12 +67,10 @@ def cpu(sender, process, data):
     - ``process:{name}:cpu:percent``
     - ``process:{name}:cpu:absolute``
     """
-    sender.output_client.event(
-        service='process:{name}:cpu:percent'.format(**data),
-        metric_f=with_children(process, lambda p: p.cpu_percent(interval=None)))
-    sender.output_client.event(
-        service='process:{name}:cpu:absolute'.format(**data),
-        metric_f=with_children(process, lambda p: sum(p.cpu_times())))
+    snapshot = sender.snapshot(process)
+    name = data['name']
+    sender.batch.add(CPU_PERCENT.service(name), snapshot.cpu_percent)
+    sender.batch.add(CPU_ABSOLUTE.service(name), snapshot.cpu_time)
 
 
 @running_process
@@ -67,16 +83,11 @@ def mem(sender, process, data):
 
     :type process: Process
     """
-
-    sender.output_client.event(
-        service='process:{name}:mem:virt:absolute'.format(name=data['name']),
-        metric_f=with_children(process, lambda p: p.memory_info().vms))
-    sender.output_client.event(
-        service='process:{name}:mem:rss:absolute'.format(name=data['name']),
-        metric_f=with_children(process, lambda p: p.memory_info().rss))
-    sender.output_client.event(
-        service='process:{name}:mem:rss:percent'.format(name=data['name']),
-        metric_f=with_children(process, lambda p: p.memory_percent()))
+    snapshot = sender.snapshot(process)
+    name = data['name']
+    sender.batch.add(MEM_VIRT_ABSOLUTE.service(name), snapshot.vms)
+    sender.batch.add(MEM_RSS_ABSOLUTE.service(name), snapshot.rss)
+    sender.batch.add(MEM_RSS_PERCENT.service(name), snapshot.mem_percent)
 
 
 @running_process
@@ -86,14 +97,10 @@ def fds(sender, process, data):
     - ``process:{name}:fds:absolute``
     - ``process:{name}:fds:percent``
     """
-    num_fds = with_children(process, lambda p: p.num_fds())
-
-    sender.output_client.event(
-        service='process:{name}:fds:absolute'.format(**data),
-        metric_f=num_fds)
-    sender.output_client.event(
-        service='process:{name}:fds:percent'.format(**data),
-        metric_f=(num_fds / get_nofile_limit(process.pid)) * 100)
+    snapshot = sender.snapshot(process)
+    name = data['name']
+    sender.batch.add(FDS_ABSOLUTE.service(name), snapshot.num_fds)
+    sender.batch.add(FDS_PERCENT.service(name), snapshot.fds_percent)
 
 
 @running_process
@@ -101,41 +108,38 @@ def io(sender, process, data):
     """Bytes read and written by a process.
 
     If ``/proc/[pid]/io`` is not availible (i.e. you are running Supermann
-    inside an unprivileged Docker container), the events will have set
-    ``metric_f`` to 0 and ``state`` to ``access denied``.
+    inside an unprivileged Docker container), the events will have no
+    ``metric_f`` and ``state`` set to ``access denied``.
 
     - ``process:{name}:io:read:bytes``
     - ``process:{name}:io:write:bytes``
     """
-    try:
-        io_counters = process.io_counters()
-    except psutil.AccessDenied:
-        read_bytes = write_bytes = dict(state="access denied")
+    snapshot = sender.snapshot(process)
+    name = data['name']
+    if snapshot.io_read is None:
+        sender.batch.add(IO_READ_BYTES.service(name), state="access denied")
+        sender.batch.add(IO_WRITE_BYTES.service(name), state="access denied")
     else:
-        read_bytes = dict(metric_f=io_counters.read_bytes)
-        write_bytes = dict(metric_f=io_counters.write_bytes)
-
-    sender.output_client.event(
-        service='process:{name}:io:read:bytes'.format(**data), **read_bytes)
-    sender.output_client.event(
-        service='process:{name}:io:write:bytes'.format(**data), **write_bytes)
+        sender.batch.add(IO_READ_BYTES.service(name), snapshot.io_read)
+        sender.batch.add(IO_WRITE_BYTES.service(name), snapshot.io_write)
 
 
+@on_state_change
 def state(sender, process, data):
     """The process state that Supervisor reports
 
     - ``process:{name}:state``
     """
-    sender.output_client.event(
-        service='process:{name}:state'.format(**data),
-        state=data['statename'].lower())
+    sender.batch.add(
+        STATE.service(data['name']), state=data['statename'].lower())
 
 
+@on_state_change
 def uptime(sender, process, data):
     """The time in seconds Supervisor reports the process has been running
 
     - ``process:{name}:uptime``
     """
-    sender.output_client.event(
-        service='process:{name}:uptime'.format(**data),
-        metric_f=data['stop' if process is None else 'now'] - data['start'])
+    sender.batch.add(
+        UPTIME.service(data['name']),
+        data['stop' if process is None else 'now'] - data['start'])
@@ -1,10 +1,42 @@
-"""Metrics reported for the entire system"""
+"""Metrics reported for the entire system
 
-from __future__ import absolute_import
+Each receiver reports values from a :py:class:`supermann.sampler.SystemSampler`
+that is read once per cycle.
+"""
 
-import os
+from __future__ import absolute_import
 
-import psutil
+from supermann.services import registry
+
+CPU_PERCENT = registry.system('cpu:percent').service()
+MEM_PERCENT = registry.system('mem:percent').service()
+MEM_TOTAL = registry.system('mem:total').service()
+MEM_FREE = registry.system('mem:free').service()
+MEM_USED = registry.system('mem:used').service()
+MEM_CACHED = registry.system('mem:cached').service()
+MEM_BUFFERS = registry.system('mem:buffers').service()
+SWAP_PERCENT = registry.system('swap:percent').service()
+SWAP_ABSOLUTE = registry.system('swap:absolute').service()
+LOAD_1MIN = registry.system('load:1min').service()
+LOAD_5MIN = registry.system('load:5min').service()
+LOAD_15MIN = registry.system('load:15min').service()
+LOAD_SCALED_1MIN = registry.system('load_scaled:1min').service()
+UPTIME = registry.system('uptime').service()
+CPU_CORE_PERCENT = registry.system('cpu:{0}:percent')
+DISK_READ = registry.system('disk:{0}:read:bytes/s')
+DISK_WRITE = registry.system('disk:{0}:write:bytes/s')
+NET_RX = registry.system('net:{0}:rx:bytes/s')
+NET_TX = registry.system('net:{0}:tx:bytes/s')
+
+
+def extended(function):
+    """Marks a signals.event reciver as using the extended system counters
+
+    Per-CPU, disk and network counters are only read if a marked reciver is
+    connected.
+    """
+    function.extended = True
+    return function
 
 
 def cpu(self, event):
@@ -12,9 +44,8 @@ def cpu(self, event):
 
     - ``system:cpu:percent``
     """
-    self.output_client.event(
-        service='system:cpu:percent',
-        metric_f=psutil.cpu_percent(interval=None))
+    sample = self.system_sample()
+    self.batch.add(CPU_PERCENT, sample.cpu_percent)
 
 
 def mem(self, event):
@@ -26,13 +57,13 @@ def mem(self, event):
     - ``system:mem:cached``
     - ``system:mem:buffers``
     """
-    mem = psutil.virtual_memory()
-    self.output_client.event(service='system:mem:percent', metric_f=mem.percent)
-    self.output_client.event(service='system:mem:total', metric_f=mem.total)
-    self.output_client.event(service='system:mem:free', metric_f=mem.free)
-    self.output_client.event(service='system:mem:used', metric_f=mem.used)
-    self.output_client.event(service='system:mem:cached', metric_f=mem.cached)
-    self.output_client.event(service='system:mem:buffers', metric_f=mem.buffers)
+    sample = self.system_sample()
+    self.batch.add(MEM_PERCENT, sample.mem_percent)
+    self.batch.add(MEM_TOTAL, sample.mem_total)
+    self.batch.add(MEM_FREE, sample.mem_free)
+    self.batch.add(MEM_USED, sample.mem_used)
+    self.batch.add(MEM_CACHED, sample.mem_cached)
+    self.batch.add(MEM_BUFFERS, sample.mem_buffers)
 
 
 def swap(self, event):
@@ -41,9 +72,9 @@ def swap(self, event):
     - ``system:swap:percent``
     - ``system:swap:absolute``
     """
-    swap = psutil.swap_memory()
-    self.output_client.event(service='system:swap:percent', metric_f=swap.percent)
-    self.output_client.event(service='system:swap:absolute', metric_f=swap.used)
+    sample = self.system_sample()
+    self.batch.add(SWAP_PERCENT, sample.swap_percent)
+    self.batch.add(SWAP_ABSOLUTE, sample.swap_used)
 
 
 def load(self, event):
@@ -53,10 +84,10 @@ def load(self, event):
     - ``system:load:5min``
     - ``system:load:15min``
     """
-    load1, load5, load15 = os.getloadavg()
-    self.output_client.event(service='system:load:1min', metric_f=load1)
-    self.output_client.event(service='system:load:5min', metric_f=load5)
-    self.output_client.event(service='system:load:15min', metric_f=load15)
+    load1, load5, load15 = self.system_sample().load
+    self.batch.add(LOAD_1MIN, load1)
+    self.batch.add(LOAD_5MIN, load5)
+    self.batch.add(LOAD_15MIN, load15)
 
 
 def load_scaled(self, event):
@@ -64,8 +95,9 @@ def load_scaled(self, event):
 
     - ``system:load_scaled:1min``
     """
-    load1 = os.getloadavg()[0] / psutil.cpu_count()
-    self.output_client.event(service='system:load_scaled:1min', metric_f=load1)
+    sample = self.system_sample()
+    load1 = sample.load[0] / sample.cpu_count
+    self.batch.add(LOAD_SCALED_1MIN, load1)
 
 
 def uptime(self, event):
@@ -73,6 +105,47 @@ def uptime(self, event):
 
     - ``system:uptime``
     """
-    with open('/proc/uptime', 'r') as f:
-        uptime, idle = map(float, f.read().strip().split())
-    self.output_client.event(service='system:uptime', metric_f=uptime)
+    self.batch.add(UPTIME, self.system_sample().uptime)
+
+
+@extended
+def cpu_per_core(self, event):
+    """CPU utilisation of each CPU as a percentage
+
+    - ``system:cpu:{n}:percent``
+    """
+    for n, percent in enumerate(self.system_sample().per_cpu_percent):
+        self.batch.add(CPU_CORE_PERCENT.service(n), percent)
+
+
+@extended
+def disk(self, event):
+    """Bytes read and written per second by each disk that has been used
+
+    - ``system:disk:{device}:read:bytes/s``
+    - ``system:disk:{device}:write:bytes/s``
+    """
+    sample = self.system_sample()
+    for index, device in enumerate(sample.disks):
+        if not (sample.disk_counters[index * 2] or
+                sample.disk_counters[index * 2 + 1]):
+            continue
+        self.batch.add(
+            DISK_READ.service(device), sample.disk_rates[index * 2])
+        self.batch.add(
+            DISK_WRITE.service(device), sample.disk_rates[index * 2 + 1])
+
+
+@extended
+def net(self, event):
+    """Bytes received and sent per second by each network interface
+
+    - ``system:net:{interface}:rx:bytes/s``
+    - ``system:net:{interface}:tx:bytes/s``
+    """
+    sample = self.system_sample()
+    for index, interface in enumerate(sample.interfaces):
+        self.batch.add(
+            NET_RX.service(interface), sample.net_rates[index * 2])
+        self.batch.add(
+            NET_TX.service(interface), sample.net_rates[index * 2 + 1])
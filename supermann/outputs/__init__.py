@@ -11,6 +11,69 @@ Base class for all outputs. New outputs should inherit it
     :show-inheritance:
 
 
+supermann.outputs.background
+----------------------------
+
+Wraps another output, and flushes it from a background thread
+
+.. automodule:: supermann.outputs.background
+    :members:
+    :show-inheritance:
+
+supermann.outputs.fanout
+------------------------
+
+Sends events to several outputs, each flushed from its own background thread
+
+.. automodule:: supermann.outputs.fanout
+    :members:
+    :show-inheritance:
+
+supermann.outputs.aggregate
+---------------------------
+
+Wraps another output, and sends aggregates of metrics on an interval
+
+.. automodule:: supermann.outputs.aggregate
+    :members:
+    :show-inheritance:
+
+supermann.outputs.deadband
+--------------------------
+
+Wraps another output, and only sends metrics when they change
+
+.. automodule:: supermann.outputs.deadband
+    :members:
+    :show-inheritance:
+
+supermann.outputs.rate
+----------------------
+
+Wraps another output, and sends the rate of each process counter
+
+.. automodule:: supermann.outputs.rate
+    :members:
+    :show-inheritance:
+
+supermann.outputs.spool
+-----------------------
+
+On-disk spool for batches that could not be sent
+
+.. automodule:: supermann.outputs.spool
+    :members:
+    :show-inheritance:
+
+supermann.outputs.telemetry
+---------------------------
+
+Wraps another output, counting events and timing each flush
+
+.. automodule:: supermann.outputs.telemetry
+    :members:
+    :show-inheritance:
+
 supermann.outputs.debug
 ---------------------------------
 
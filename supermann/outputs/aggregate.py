@@ -0,0 +1,202 @@
+from __future__ import division
+
+import array
+import fnmatch
+import math
+import time
+
+import supermann.utils
+from supermann.outputs.base import BaseOutput
+
+
+def percentile(values, percent):
+    """Returns a percentile of a list of values, using the nearest rank"""
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+def statistic(name):
+    """Returns a function calculating a statistic from a list of values
+
+    :param str name: ``min``, ``max``, ``mean``, ``last`` or a percentile
+        such as ``p95``
+    """
+    if name == 'min':
+        return min
+    elif name == 'max':
+        return max
+    elif name == 'mean':
+        return lambda values: sum(values) / len(values)
+    elif name == 'last':
+        return lambda values: values[-1]
+    elif name.startswith('p') and name[1:].isdigit():
+        return lambda values: percentile(values, int(name[1:]))
+    raise ValueError("Unknown statistic {0!r}".format(name))
+
+
+class Family(object):
+    """The metrics matching a pattern, and the statistics sent for them"""
+
+    __slots__ = ['pattern', 'statistics']
+
+    def __init__(self, pattern, statistics):
+        """
+        :param str pattern: A glob matching services, i.e. ``system:*``
+        :param list statistics: ``(name, function)`` pairs
+        """
+        self.pattern = pattern
+        self.statistics = statistics
+
+    @classmethod
+    def parse(cls, value):
+        """Parses a family from a config option, i.e. ``system:* mean, p95``"""
+        pattern, _, statistics = value.strip().partition(' ')
+        names = [s.strip() for s in statistics.split(',') if s.strip()]
+        return cls(pattern, [(name, statistic(name)) for name in names])
+
+
+class Window(object):
+    """A ring buffer of the last values of a metric"""
+
+    __slots__ = ['family', 'values', 'index', 'count', 'data']
+
+    def __init__(self, family, size):
+        self.family = family
+        self.values = array.array('d', [0.0]) * size
+        self.index = 0
+        self.count = 0
+        #: The last event, which aggregated events are copied from
+        self.data = None
+
+    def add(self, value, data):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+        self.data = data
+
+    def samples(self):
+        """Returns the values added since the window was last reset, oldest
+        first
+        """
+        if self.count == len(self.values):
+            return (self.values[self.index:] +
+                    self.values[:self.index]).tolist()
+        start = self.index - self.count
+        if start >= 0:
+            return self.values[start:self.index].tolist()
+        return (self.values[start:] + self.values[:self.index]).tolist()
+
+    def reset(self):
+        self.count = 0
+
+
+class AggregateOutput(BaseOutput):
+    """
+    Wraps another output, and sends aggregates of metrics on an interval.
+
+    Each option in the config section other than ``interval``, ``window`` and
+    ``passthrough`` is a family of metrics: a glob matching services,
+    followed by the statistics to send for them (``min``, ``max``, ``mean``,
+    ``last`` or a percentile such as ``p95``). The values of each matching service
+    are kept in a ring buffer of ``window`` values, and every ``interval``
+    seconds an event is sent for each statistic of the values added since
+    the last interval, as ``{service}:{statistic}``.
+
+    Events matching a ``passthrough`` glob, events without a ``metric_f``
+    (i.e. ``process:{name}:state``), and events that are not in any family
+    are sent immediately.
+
+    Enabled by adding an ``[aggregate]`` section to the config file.
+    """
+    section_name = "aggregate"
+
+    def __init__(self, output=None):
+        super(AggregateOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.output = output
+        self.interval = 60.0
+        self.size = 12
+        self.passthrough = ()
+        self.families = ()
+        self.next_flush = None
+
+        #: The window for each service in a family, by service
+        self.windows = dict()
+
+    def init(self, interval=60, window=12, passthrough='process:*:state',
+             **families):
+        """
+        :param interval: Seconds between sending aggregates
+        :param window: The most values kept for each service
+        :param passthrough: A comma separated list of globs for services that
+            are always sent immediately
+        :param families: Families of metrics, by name
+        """
+        self.interval = float(interval)
+        self.size = int(window)
+        self.passthrough = tuple(
+            p.strip() for p in passthrough.split(',') if p.strip())
+        self.families = tuple(
+            Family.parse(value) for _, value in sorted(families.items()))
+
+    def __enter__(self):
+        self.output.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.output.__exit__(exc_type, exc_val, exc_tb)
+
+    def family(self, service):
+        """Returns the family a service is aggregated in, or None"""
+        for pattern in self.passthrough:
+            if fnmatch.fnmatchcase(service, pattern):
+                return None
+        for family in self.families:
+            if fnmatch.fnmatchcase(service, family.pattern):
+                return family
+        return None
+
+    def event(self, **data):
+        service, value = data.get('service'), data.get('metric_f')
+        window = self.windows.get(service)
+        if window is None:
+            family = self.family(service) if (
+                service and value is not None) else None
+            if family is None:
+                self.output.event(**data)
+                return
+            window = self.windows[service] = Window(family, self.size)
+        elif value is None:
+            self.output.event(**data)
+            return
+        window.add(value, data)
+
+    def aggregate(self):
+        """Sends the aggregates for each window, and resets the windows
+
+        Windows that have had no values added since the last interval are
+        dropped.
+        """
+        for service, window in self.windows.items():
+            if not window.count:
+                del self.windows[service]
+                continue
+            values = window.samples()
+            for name, function in window.family.statistics:
+                self.output.event(**dict(
+                    window.data, service='{0}:{1}'.format(service, name),
+                    metric_f=function(values)))
+            window.reset()
+
+    def flush(self):
+        now = time.time()
+        if self.next_flush is None:
+            self.next_flush = now + self.interval
+        elif now >= self.next_flush:
+            self.next_flush = now + self.interval
+            self.aggregate()
+        self.output.flush()
+
+    def clear(self):
+        self.output.clear()
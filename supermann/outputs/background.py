@@ -0,0 +1,294 @@
+import collections
+import random
+import threading
+import time
+
+import supermann.utils
+from supermann.batch import MetricBatch
+from supermann.outputs.base import BaseOutput
+from supermann.outputs.spool import Spool
+
+
+class BackgroundOutput(BaseOutput):
+    """
+    Wraps another output, and flushes it from a background thread.
+
+    Events are collected into a batch, and :meth:`flush` puts the batch on a
+    bounded queue and returns immediately. A sender thread takes batches from
+    the queue, coalesces them, and sends them through the wrapped output,
+    retrying failed flushes with exponential backoff.
+
+    When the queue is full, ``drop_policy`` decides which batch is dropped:
+    ``oldest`` drops the oldest queued batch, ``newest`` drops the batch being
+    flushed, and ``sample`` drops a random queued batch.
+
+    If ``spool_dir`` is set, batches that could not be sent are written to a
+    :class:`supermann.outputs.spool.Spool` instead of being dropped. Once a
+    flush succeeds again, spooled batches are replayed whenever the queue is
+    empty, at most ``replay_rate`` batches per second.
+
+    Enabled by adding a ``[background]`` section to the config file.
+    """
+    section_name = "background"
+
+    drop_policies = ('oldest', 'newest', 'sample')
+
+    def __init__(self, output=None):
+        super(BackgroundOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.output = output
+        self.batch = MetricBatch()
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.spool = None
+        self.spooled = False
+        self.healthy = True
+
+        #: Counters describing the state of the queue and the sender thread,
+        #: only updated while holding :attr:`condition`
+        self.counters = dict(
+            queue_depth=0,
+            queued_events=0,
+            dropped_events=0,
+            sent_events=0,
+            failed_flushes=0,
+            flush_latency=0.0,
+            spooled_events=0,
+            replayed_events=0,
+        )
+
+    def init(self, queue_size=100, drop_policy='oldest', max_batch_events=5000,
+             max_retries=5, retry_backoff=1.0, max_backoff=60.0,
+             spool_dir=None, spool_max_bytes=100 * 1024 * 1024,
+             spool_max_age=24 * 60 * 60, spool_segment_bytes=4 * 1024 * 1024,
+             replay_rate=1.0):
+        """
+        :param queue_size: The maximum number of batches waiting to be sent
+        :param drop_policy: One of ``oldest``, ``newest`` or ``sample``
+        :param max_batch_events: Queued batches are coalesced into a single
+            flush until it would contain more than this many events
+        :param max_retries: The number of times a failed flush is retried
+            before its events are dropped
+        :param retry_backoff: Seconds to wait before the first retry, doubled
+            after each failure
+        :param max_backoff: The maximum number of seconds between retries
+        :param spool_dir: A directory to spool batches that could not be sent
+        :param spool_max_bytes: The largest size of the spool in bytes
+        :param spool_max_age: Spooled batches older than this many seconds
+            are dropped
+        :param spool_segment_bytes: The size of each spool segment file
+        :param replay_rate: The most spooled batches replayed each second
+        """
+        if drop_policy not in self.drop_policies:
+            raise ValueError("Unknown drop_policy {0!r}".format(drop_policy))
+
+        self.queue_size = int(queue_size)
+        self.drop_policy = drop_policy
+        self.max_batch_events = int(max_batch_events)
+        self.max_retries = int(max_retries)
+        self.retry_backoff = float(retry_backoff)
+        self.max_backoff = float(max_backoff)
+        self.replay_rate = float(replay_rate)
+
+        if spool_dir:
+            self.spool = Spool(
+                spool_dir, max_bytes=int(spool_max_bytes),
+                max_age=float(spool_max_age),
+                segment_bytes=int(spool_segment_bytes))
+            self.spooled = bool(len(self.spool))
+
+        self.log.info(
+            "Flushing {0} in the background (queue_size={1}, "
+            "drop_policy={2})".format(
+                supermann.utils.fullname(self.output), self.queue_size,
+                self.drop_policy))
+
+    def __enter__(self):
+        self.output.__enter__()
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.run, name='supermann-output-sender')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.condition:
+            self.stopped.set()
+            self.condition.notify()
+        self.thread.join()
+        if self.spool is not None:
+            self.spool.close()
+        self.output.__exit__(exc_type, exc_val, exc_tb)
+
+    def event(self, **data):
+        self.batch.event(**data)
+
+    def event_batch(self, batch):
+        self.batch.extend(batch)
+
+    def flush(self):
+        batch, self.batch = self.batch, MetricBatch()
+        if batch:
+            self.enqueue(batch)
+
+    def enqueue(self, batch):
+        """Puts a batch on the queue, dropping a batch if the queue is full
+
+        :param supermann.batch.MetricBatch batch: The metrics to send
+        """
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.drop_policy == 'newest':
+                    self.drop(batch)
+                    return
+                elif self.drop_policy == 'oldest':
+                    self.drop(self.queue.popleft())
+                else:
+                    index = random.randrange(len(self.queue))
+                    self.drop(self.queue[index])
+                    del self.queue[index]
+            self.queue.append(batch)
+            self.counters['queued_events'] += len(batch)
+            self.counters['queue_depth'] = len(self.queue)
+            self.condition.notify()
+
+    def drop(self, batch):
+        """Counts the events in a batch that is being dropped"""
+        self.count('dropped_events', len(batch))
+        self.log.warning("Dropped {0} events".format(len(batch)))
+
+    def count(self, name, value=1):
+        """Adds to a counter
+
+        Counters are updated by both the collecting and the sending thread,
+        so the queue's lock is held while they are updated.
+        """
+        with self.condition:
+            self.counters[name] += value
+
+    def read_counters(self):
+        """Returns a copy of the counters, read while holding the lock"""
+        with self.condition:
+            return dict(self.counters)
+
+    def take(self, timeout=None):
+        """Waits for batches, and coalesces them into a list of events
+
+        :param float timeout: Seconds to wait for a batch, or None to wait
+            until one is queued or the output is stopped
+        :returns: A :py:class:`supermann.batch.MetricBatch`, or None if the
+            queue is empty
+        """
+        with self.condition:
+            while not self.queue and not self.stopped.is_set():
+                self.condition.wait(timeout)
+                if timeout is not None:
+                    break
+            if not self.queue:
+                return None
+            events = self.queue.popleft()
+            while self.queue and (len(events) + len(self.queue[0]) <=
+                                  self.max_batch_events):
+                events.extend(self.queue.popleft())
+            self.counters['queue_depth'] = len(self.queue)
+            return events
+
+    def run(self):
+        """Sends batches from the queue until the output is stopped
+
+        Spooled batches are replayed when there is nothing in the queue.
+        """
+        while True:
+            replaying = self.spooled and self.healthy
+            events = self.take(1 / self.replay_rate if replaying else None)
+            if events is not None:
+                self.send(events)
+            elif self.stopped.is_set():
+                return
+            elif replaying:
+                self.replay()
+
+    def replay(self):
+        """Sends the oldest batch in the spool, removing it if it was sent"""
+        try:
+            events = self.spool.peek()
+        except EnvironmentError as e:
+            self.log.warning("Reading the spool failed ({0}: {1})".format(
+                e.__class__.__name__, e))
+            events = None
+        if events is None:
+            self.spooled = False
+        elif self.send(MetricBatch.from_events(events), replay=True):
+            self.spool.pop()
+            self.count('replayed_events', len(events))
+
+    def send(self, events, replay=False):
+        """Sends events through the wrapped output, retrying on failure
+
+        Retries stop early if the output is stopping, so that shutting down
+        does not wait for a backend that is unavailable. Events that could
+        not be sent are spooled if a spool is configured, or dropped.
+
+        :param supermann.batch.MetricBatch events: The metrics to send
+        :param bool replay: The events are from the spool, so are only tried
+            once and are left in the spool if they can't be sent
+        :returns: True if the events were sent
+        """
+        backoff = self.retry_backoff
+        retries = 0 if replay else self.max_retries
+        for attempt in range(retries + 1):
+            start = time.time()
+            try:
+                self.output.event_batch(events)
+                self.output.flush()
+            except Exception as e:
+                self.output.clear()
+                self.healthy = False
+                self.count('failed_flushes')
+                self.log.warning("Flush of {0} events failed ({1}: {2})".format(
+                    len(events), e.__class__.__name__, e))
+            else:
+                self.healthy = True
+                latency = time.time() - start
+                with self.condition:
+                    self.counters['sent_events'] += len(events)
+                    self.counters['flush_latency'] = latency
+                return True
+
+            if attempt == retries or self.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+        if not replay and not self.write_spool(events):
+            self.drop(events)
+        return False
+
+    def write_spool(self, events):
+        """Writes events that could not be sent to the spool
+
+        :param supermann.batch.MetricBatch events: The metrics to spool
+        :returns: True if the events were spooled, or False if there is no
+            spool or it could not be written to
+        """
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(list(events))
+        except EnvironmentError as e:
+            self.log.warning("Spooling {0} events failed ({1}: {2})".format(
+                len(events), e.__class__.__name__, e))
+            return False
+        self.spooled = True
+        self.count('spooled_events', len(events))
+        return True
+
+    def wait(self, timeout):
+        """Waits before retrying a flush
+
+        :returns: True if the output is stopping
+        """
+        self.stopped.wait(timeout)
+        return self.stopped.is_set()
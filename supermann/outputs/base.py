@@ -42,8 +42,24 @@ class BaseOutput(object):
         """
         raise NotImplementedError
 
+    def event_batch(self, batch):
+        """
+        Should save the metrics collected in one cycle in bulk.
+        By default each metric is passed to :meth:`event`
+        :type batch: supermann.batch.MetricBatch
+        """
+        for data in batch:
+            self.event(**data)
+
     def flush(self):
         """
         Should send bulk in output
         """
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Should drop events saved in bulk that have not been sent.
+        Called after a flush fails, so that events are not sent
+        twice when it is retried. By default do nothing
+        """
@@ -0,0 +1,151 @@
+import fnmatch
+
+import supermann.utils
+from supermann.outputs.base import BaseOutput
+
+
+class Threshold(object):
+    """The smallest change in the value of matching services that is sent"""
+
+    __slots__ = ['pattern', 'absolute', 'relative']
+
+    def __init__(self, pattern='*', absolute=0.0, relative=0.0):
+        """
+        :param str pattern: A glob matching services
+        :param float absolute: The smallest change in value that is sent
+        :param float relative: The smallest change as a fraction of the last
+            value sent
+        """
+        self.pattern = pattern
+        self.absolute = float(absolute)
+        self.relative = float(relative)
+
+    @classmethod
+    def parse(cls, value):
+        """Parses a threshold from a config option
+
+        i.e. ``system:uptime relative=0.01`` or ``system:mem:* absolute=1024``
+        """
+        fields = value.split()
+        options = dict(field.split('=', 1) for field in fields[1:])
+        return cls(fields[0], **options)
+
+    def changed(self, last, value):
+        """Returns True if the value moved far enough to be sent"""
+        delta = abs(value - last)
+        return delta > self.absolute and delta > abs(last) * self.relative
+
+
+class Reading(object):
+    """The last event sent for a service"""
+
+    __slots__ = ['threshold', 'metric', 'state', 'sent', 'seen']
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.metric = None
+        self.state = None
+        self.sent = None
+        self.seen = None
+
+
+class DeadbandOutput(BaseOutput):
+    """
+    Wraps another output, and only sends metrics when they change.
+
+    An event is not sent if its ``state`` is the same as the last event sent
+    for that service, and its ``metric_f`` has not moved by more than the
+    ``absolute`` threshold and the ``relative`` threshold (a fraction of the
+    last value sent). By default both thresholds are 0, so only events that
+    have not changed at all are dropped. Each other option in the config
+    section sets the thresholds for services matching a glob, i.e.
+    ``uptime = system:uptime relative=0.01``.
+
+    Every event is sent at least once every ``heartbeat`` flushes, so that
+    metrics are not expired by a TTL in Riemann. The last events of services
+    that have not been seen for a heartbeat are dropped.
+
+    Enabled by adding a ``[deadband]`` section to the config file.
+    """
+    section_name = "deadband"
+
+    def __init__(self, output=None):
+        super(DeadbandOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.output = output
+        self.heartbeat = 12
+        self.default = Threshold()
+        self.thresholds = ()
+        self.tick = 0
+
+        #: The last event sent for each service, by service
+        self.readings = dict()
+
+        #: Counters describing the events that were sent and dropped
+        self.counters = dict(sent_events=0, suppressed_events=0)
+
+    def init(self, heartbeat=12, absolute=0.0, relative=0.0, **thresholds):
+        """
+        :param heartbeat: Events are sent at least once every this many
+            flushes
+        :param absolute: The default absolute threshold
+        :param relative: The default relative threshold
+        :param thresholds: Thresholds for services matching a glob, by name
+        """
+        self.heartbeat = int(heartbeat)
+        self.default = Threshold('*', absolute, relative)
+        self.thresholds = tuple(
+            Threshold.parse(value) for _, value in sorted(thresholds.items()))
+
+    def __enter__(self):
+        self.output.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.output.__exit__(exc_type, exc_val, exc_tb)
+
+    def threshold(self, service):
+        """Returns the threshold for a service"""
+        for threshold in self.thresholds:
+            if fnmatch.fnmatchcase(service, threshold.pattern):
+                return threshold
+        return self.default
+
+    def event(self, **data):
+        service = data.get('service')
+        if service is None:
+            self.output.event(**data)
+            return
+
+        reading = self.readings.get(service)
+        if reading is None:
+            reading = self.readings[service] = Reading(self.threshold(service))
+        reading.seen = self.tick
+
+        metric, state = data.get('metric_f'), data.get('state')
+        if (reading.sent is not None and
+                self.tick - reading.sent < self.heartbeat and
+                state == reading.state and
+                (metric == reading.metric or (
+                    metric is not None and reading.metric is not None and
+                    not reading.threshold.changed(reading.metric, metric)))):
+            self.counters['suppressed_events'] += 1
+            return
+
+        reading.metric, reading.state, reading.sent = metric, state, self.tick
+        self.counters['sent_events'] += 1
+        self.output.event(**data)
+
+    def expire(self):
+        """Drops the readings of services that have not been seen recently"""
+        for service, reading in self.readings.items():
+            if self.tick - reading.seen >= self.heartbeat:
+                del self.readings[service]
+
+    def flush(self):
+        self.tick += 1
+        self.expire()
+        self.output.flush()
+
+    def clear(self):
+        self.output.clear()
@@ -0,0 +1,96 @@
+import os
+
+import supermann.utils
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.base import BaseOutput
+
+
+class FanoutOutput(BaseOutput):
+    """
+    Sends each event to several outputs.
+
+    Each output is wrapped in a :class:`BackgroundOutput`, so that it has
+    its own sender thread and queue, and a slow or failing output does not
+    hold up the others. Metrics are still only collected once per cycle.
+
+    Used when ``output_class`` in the ``[supermann]`` section is a comma
+    separated list of outputs. Options in the ``[background]`` section apply
+    to every output, and ``spool_dir`` is split into a subdirectory for each
+    output, named by the output's class (i.e.
+    ``supermann.outputs.influx.InfluxLineOutput``), with a number added if
+    the same class is used more than once.
+    """
+    section_name = "fanout"
+
+    def __init__(self, outputs=()):
+        super(FanoutOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.outputs = [BackgroundOutput(output) for output in outputs]
+
+    def init(self, **params):
+        """
+        :param params: options for each :class:`BackgroundOutput`
+        """
+        names = self.spool_names()
+        for output, name in zip(self.outputs, names):
+            output_params = dict(params)
+            if output_params.get('spool_dir'):
+                output_params['spool_dir'] = os.path.join(
+                    output_params['spool_dir'], name)
+            output.init(**output_params)
+
+    def spool_names(self):
+        """Returns a unique spool subdirectory name for each output"""
+        return unique_names(self.outputs)
+
+    def __enter__(self):
+        entered = []
+        try:
+            for output in self.outputs:
+                output.__enter__()
+                entered.append(output)
+        except Exception:
+            for output in reversed(entered):
+                output.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for output in reversed(self.outputs):
+            try:
+                output.__exit__(exc_type, exc_val, exc_tb)
+            except Exception:
+                self.log.exception("Error closing {0}".format(
+                    supermann.utils.fullname(output.output)))
+
+    def event(self, **data):
+        for output in self.outputs:
+            output.event(**data)
+
+    def event_batch(self, batch):
+        for output in self.outputs:
+            output.event_batch(batch)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+
+    def clear(self):
+        for output in self.outputs:
+            output.clear()
+
+
+def unique_names(outputs):
+    """Returns a unique name for each :class:`BackgroundOutput`
+
+    Outputs are named by the class of the output they wrap, with a number
+    added if the same class is used more than once.
+    """
+    classes = [supermann.utils.fullname(o.output) for o in outputs]
+    names, seen = [], dict()
+    for name in classes:
+        if classes.count(name) > 1:
+            seen[name] = seen.get(name, 0) + 1
+            name = '{0}-{1}'.format(name, seen[name])
+        names.append(name)
+    return names
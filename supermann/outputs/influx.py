@@ -1,31 +1,150 @@
+import base64
+import collections
+import httplib
+import itertools
 import logging
+import math
 import re
 import socket
+import urllib
+import zlib
 
 import sys
 
 import supermann
 from supermann.outputs.base import BaseOutput
+from supermann.services import Service
 
 from influxdb.client import InfluxDBClient
 
+
+def timestamp(time):
+    """Returns a time in seconds as an InfluxDB timestamp in milliseconds
+
+    Both outputs write timestamps with millisecond precision, so that metrics
+    keep the time they were collected at when they are retried or spooled.
+    """
+    return int(round(time * 1000))
+
+
 class Point(object):
-    point = None
-    tags = None
-    measurement = None
+    __slots__ = ['measurement', 'point', 'tags', 'time']
 
-    def __init__(self, **k):
-        self.__dict__.update(k)
+    def __init__(self, measurement=None, point=None, tags=None, time=None):
+        self.measurement = measurement
+        self.point = point
+        self.tags = tags
+        self.time = time
 
     def __repr__(self):
-        return "Point({}, {}, {})".format(self.measurement, self.point, self.tags)
+        return "Point({}, {}, {}, {})".format(
+            self.measurement, self.point, self.tags, self.time)
 
     def to_influx(self):
-        return dict(
+        data = dict(
             measurement=self.measurement,
             tags=self.tags,
             fields=self.point
         )
+        if self.time is not None:
+            data['time'] = timestamp(self.time)
+        return data
+
+
+class WidePoints(object):
+    """
+    Merges the metrics in one flush into one point per process, in the
+    ``process`` measurement, and one point in the ``system`` measurement.
+
+    The rest of each service name becomes the field name, so
+    ``process:web:mem:rss:absolute`` is the ``mem_rss_absolute`` field of the
+    ``web`` point. The ``state`` of ``process:{name}:state`` is written to a
+    string field, and other events without a metric are skipped.
+
+    Points are also keyed by the time of their metrics, so batches from
+    several cycles that are flushed together (i.e. by a background output)
+    are written as one point per cycle.
+    """
+
+    #: The cache of parsed service names is cleared when it grows this large
+    max_keys = 100000
+
+    def __init__(self):
+        self.points = collections.OrderedDict()
+        self.keys = dict()
+
+    def __iter__(self):
+        """Yields a ``(measurement, process, time, fields)`` tuple per point
+
+        ``process`` is None for the system point, and ``time`` is None for
+        metrics without a time.
+        """
+        for (measurement, process, time), fields in self.points.items():
+            yield measurement, process, time, fields
+
+    def __len__(self):
+        return len(self.points)
+
+    def key(self, service):
+        """Returns the ``(measurement, process, field)`` for a service
+
+        :returns: A tuple, or None if the service is not written to InfluxDB
+        """
+        try:
+            return self.keys[service]
+        except KeyError:
+            pass
+
+        if isinstance(service, Service) and service.family in (
+                'process', 'system'):
+            key = (service.family, service.process,
+                   service.field.replace(':', '_'))
+        elif service.startswith('process:'):
+            _, process, tail = service.split(':', 2)
+            key = ('process', process, tail.replace(':', '_'))
+        elif service.startswith('system:'):
+            key = ('system', None, service[7:].replace(':', '_'))
+        else:
+            key = None
+
+        if len(self.keys) >= self.max_keys:
+            self.keys.clear()
+        self.keys[service] = key
+        return key
+
+    def add(self, service, metric_f=None, state=None, time=None, **data):
+        """Adds the metric from an event to its point"""
+        self.add_metric(service, metric_f, state, time)
+
+    def add_batch(self, batch):
+        """Adds each metric in a :class:`supermann.batch.MetricBatch`"""
+        rows = itertools.izip(
+            batch.services, batch.values, batch.states, batch.times)
+        for service, metric, state, time in rows:
+            self.add_metric(service, metric, state, time)
+
+    def add_metric(self, service, metric_f, state, time=None):
+        """Adds a metric to its point"""
+        key = self.key(service)
+        if key is None:
+            return
+        measurement, process, field = key
+        if metric_f is not None:
+            if not finite(metric_f):
+                return
+            value = metric_f
+        elif field == 'state' and state is not None:
+            value = state
+        else:
+            return
+        try:
+            fields = self.points[measurement, process, time]
+        except KeyError:
+            fields = self.points[measurement, process, time] = dict()
+        fields[field] = value
+
+    def clear(self):
+        self.points.clear()
 
 
 class InfluxOutput(BaseOutput):
@@ -36,6 +155,11 @@ class InfluxOutput(BaseOutput):
     All process metrics will be tagged by process_name and will be written into
     separated metrics.
 
+    With ``schema = wide``, all metrics for a process are written as fields
+    of a single point in the ``process`` measurement, and system metrics as
+    fields of a single point in the ``system`` measurement
+    (see :class:`WidePoints`).
+
     All points will be tagged with hostname.
     """
     section_name = "influx"
@@ -43,32 +167,73 @@ class InfluxOutput(BaseOutput):
     hostname = socket.gethostname()
     processname_pattern = re.compile(r"^process:([^\:]+):(.*)")
 
-    def init(self, **params):
+    def init(self, schema='narrow', **params):
+        self.wide = WidePoints() if schema == 'wide' else None
         self.influx_client = InfluxDBClient(
             **params
         )
 
         supermann.utils.getLogger(self).info(
-            "Using InfluxOutput with params %s", str(params))
+            "Using InfluxOutput with params %s (%s schema)", str(params), schema)
 
     def __init__(self):
         super(InfluxOutput, self).__init__()
         self.bulk = []
+        self.wide = None
 
     def flush(self):
+        if self.wide is not None:
+            for measurement, process, time, fields in self.wide:
+                tags = {"hostname": self.hostname}
+                if process is not None:
+                    tags["process"] = process
+                self.bulk.append(Point(
+                    measurement=measurement, point=fields, tags=tags,
+                    time=time))
+            self.wide.clear()
+
         self.influx_client.write_points(
-            [p.to_influx() for p in self.bulk]
+            [p.to_influx() for p in self.bulk], time_precision='ms'
         )
 
         self.bulk = []
 
+    def clear(self):
+        self.bulk = []
+        if self.wide is not None:
+            self.wide.clear()
+
     def event(self, **data):
+        if self.wide is not None:
+            return self.wide.add(**data)
 
         try:
             service = data["service"]
             metric = data["metric_f"]
         except:
             return
+        self.add_point(service, metric, data.get("time"))
+
+    def event_batch(self, batch):
+        if self.wide is not None:
+            return self.wide.add_batch(batch)
+
+        rows = itertools.izip(batch.services, batch.values, batch.times)
+        for service, metric, time in rows:
+            if metric is not None:
+                self.add_point(service, metric, time)
+
+    def add_point(self, service, metric, time=None):
+        """Adds a point for a metric to the bulk, unless it is not finite"""
+        if not finite(metric):
+            return
+        if isinstance(service, Service) and service.family == 'process':
+            # The process name and field are already split out
+            processname, tail = service.process, service.field
+        elif service.startswith("process"):
+            processname, tail = self.processname_pattern.findall(service)[0]
+        else:
+            processname = None
 
         if service.startswith("system"):
             self.bulk.append(Point(
@@ -78,11 +243,10 @@ class InfluxOutput(BaseOutput):
                 },
                 tags={
                     "hostname": self.hostname
-                }
+                },
+                time=time
             ))
-        elif service.startswith("process"):
-            processname, tail = self.processname_pattern.findall(service)[0]
-
+        elif processname is not None:
             self.bulk.append(Point(
                 measurement="process:{}".format(tail),
                 point={
@@ -91,5 +255,333 @@ class InfluxOutput(BaseOutput):
                 tags={
                     "hostname": self.hostname,
                     "process": processname
-                }
+                },
+                time=time
             ))
+
+
+def escape_measurement(value):
+    """Escapes a measurement name for the InfluxDB line protocol"""
+    return value.replace(',', '\\,').replace(' ', '\\ ')
+
+
+def escape_tag(value):
+    """Escapes a tag key or value for the InfluxDB line protocol"""
+    return value.replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def escape_field_key(value):
+    """Escapes a field key for the InfluxDB line protocol"""
+    return escape_tag(value)
+
+
+def format_string_field(value):
+    """Formats a string field value for the InfluxDB line protocol"""
+    return '"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def finite(value):
+    """Returns False for nan and infinite values, which InfluxDB rejects"""
+    return not (math.isnan(value) or math.isinf(value))
+
+
+def format_field(value):
+    """Formats a field value for the InfluxDB line protocol
+
+    Integers are written as integer fields, as ``InfluxDBClient`` does, so
+    that both outputs can write to the same database.
+    """
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        return '%di' % value
+    return repr(float(value))
+
+
+class InfluxLineOutput(BaseOutput):
+    """
+    Writes points into influxdb using the line protocol directly.
+
+    Writes the same measurements and tags as :class:`InfluxOutput`, but
+    encodes each metric straight into a line protocol buffer, without
+    building intermediate point objects. The measurement and tags for each
+    service are escaped once and cached.
+
+    Each flush is written over a persistent HTTP connection using chunked
+    transfer encoding, in requests of at most ``batch_size`` lines, and can
+    be gzip compressed.
+
+    Supports ``schema = wide`` in the same way as :class:`InfluxOutput`.
+    """
+    section_name = "influx"
+
+    hostname = socket.gethostname()
+
+    #: The cache of escaped line prefixes is cleared when it grows this large
+    max_prefixes = 100000
+
+    #: Bytes of line protocol sent in each HTTP chunk
+    chunk_size = 64 * 1024
+
+    def __init__(self):
+        super(InfluxLineOutput, self).__init__()
+        self.buffer = bytearray()
+        self.boundaries = []
+        self.lines = 0
+        self.prefixes = dict()
+        self.field_keys = dict()
+        self.tag_sets = dict()
+        self.connection = None
+        self.wide = None
+
+        #: The total size of the data written to InfluxDB, in bytes
+        self.bytes_sent = 0
+
+    def init(self, host='localhost', port=8086, database=None, username=None,
+             password=None, ssl=False, gzip=False, batch_size=5000,
+             timeout=10, retention_policy=None, schema='narrow', **params):
+        """
+        :param host: InfluxDB host
+        :param port: InfluxDB HTTP port
+        :param database: required, the database to write to
+        :param username: username, if authentication is enabled
+        :param password: password, if authentication is enabled
+        :param ssl: connect using HTTPS
+        :param gzip: compress writes with gzip
+        :param batch_size: the most lines written in one request
+        :param timeout: seconds to wait for a response
+        :param retention_policy: retention policy to write to
+        :param schema: ``narrow`` (default) or ``wide``
+        """
+        self.wide = WidePoints() if schema == 'wide' else None
+        self.host = host
+        self.port = int(port)
+        self.ssl = supermann.utils.boolean(ssl)
+        self.gzip = supermann.utils.boolean(gzip)
+        self.batch_size = int(batch_size)
+        self.timeout = float(timeout)
+
+        query = [('db', database), ('precision', 'ms')]
+        if retention_policy:
+            query.append(('rp', retention_policy))
+        self.path = '/write?' + urllib.urlencode(query)
+
+        self.headers = [('Content-Type', 'text/plain; charset=utf-8')]
+        if username:
+            self.headers.append(('Authorization', 'Basic ' + base64.b64encode(
+                '{0}:{1}'.format(username, password or ''))))
+        if self.gzip:
+            self.headers.append(('Content-Encoding', 'gzip'))
+
+        self.host_tags = ',hostname=' + escape_tag(self.hostname)
+
+        supermann.utils.getLogger(self).info(
+            "Using InfluxLineOutput at %s:%s (database=%s, gzip=%s)",
+            self.host, self.port, database, self.gzip)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def prefix(self, service):
+        """Returns the escaped measurement and tags for a service
+
+        :param str service: A service name like ``process:name:cpu:percent``
+        :returns: The start of a line up to the field value, or None if the
+            service is not written to InfluxDB
+        """
+        try:
+            return self.prefixes[service]
+        except KeyError:
+            pass
+
+        if isinstance(service, Service) and service.family == 'process':
+            process, tail = service.process, service.field
+        elif service.startswith('process:'):
+            _, process, tail = service.split(':', 2)
+        else:
+            process = None
+
+        if process is not None:
+            prefix = '{0}{1},process={2} metric='.format(
+                escape_measurement('process:' + tail), self.host_tags,
+                escape_tag(process))
+        elif service.startswith('system'):
+            prefix = '{0}{1} metric='.format(
+                escape_measurement(service), self.host_tags)
+        else:
+            prefix = None
+
+        if len(self.prefixes) >= self.max_prefixes:
+            self.prefixes.clear()
+        self.prefixes[service] = prefix
+        return prefix
+
+    def event(self, **data):
+        if self.wide is not None:
+            return self.wide.add(**data)
+
+        metric = data.get('metric_f')
+        if metric is None or not finite(metric):
+            return
+        prefix = self.prefix(data['service'])
+        if prefix is None:
+            return
+
+        self.buffer += prefix
+        self.buffer += format_field(metric)
+        self.end_line(data.get('time'))
+
+    def event_batch(self, batch):
+        """Encodes each metric in a batch straight into the buffer"""
+        if self.wide is not None:
+            return self.wide.add_batch(batch)
+
+        buffer, prefix_for = self.buffer, self.prefix
+        rows = itertools.izip(batch.services, batch.values, batch.times)
+        for service, metric, time in rows:
+            if metric is None or not finite(metric):
+                continue
+            prefix = prefix_for(service)
+            if prefix is None:
+                continue
+            buffer += prefix
+            buffer += format_field(metric)
+            self.end_line(time)
+
+    def end_line(self, time=None):
+        """Ends a line in the buffer, and starts a new batch if it is full
+
+        :param float time: The time of the line, or None to let InfluxDB
+            use the time it receives the line at
+        """
+        if time is not None:
+            self.buffer += ' %d' % timestamp(time)
+        self.buffer += '\n'
+        self.lines += 1
+        if self.lines % self.batch_size == 0:
+            self.boundaries.append(len(self.buffer))
+
+    def process_tags(self, process):
+        """Returns the escaped process tag, cached after it is first escaped"""
+        try:
+            return self.tag_sets[process]
+        except KeyError:
+            if len(self.tag_sets) >= self.max_prefixes:
+                self.tag_sets.clear()
+            tags = self.tag_sets[process] = ',process=' + escape_tag(process)
+            return tags
+
+    def field_key(self, field):
+        """Returns an escaped field key, cached after it is first escaped"""
+        try:
+            return self.field_keys[field]
+        except KeyError:
+            key = self.field_keys[field] = escape_field_key(field)
+            return key
+
+    def encode_wide(self):
+        """Encodes the merged points into the buffer, one line each"""
+        for measurement, process, time, fields in self.wide:
+            self.buffer += measurement
+            self.buffer += self.host_tags
+            if process is not None:
+                self.buffer += self.process_tags(process)
+            separator = ' '
+            for field, value in sorted(fields.items()):
+                self.buffer += separator
+                self.buffer += self.field_key(field)
+                self.buffer += '='
+                if isinstance(value, basestring):
+                    self.buffer += format_string_field(value)
+                else:
+                    self.buffer += format_field(value)
+                separator = ','
+            self.end_line(time)
+        self.wide.clear()
+
+    def flush(self):
+        """Writes the buffer in requests of at most ``batch_size`` lines
+
+        If a write fails, the requests that were already written are dropped
+        from the buffer before the error is raised, so they are not written
+        again when the flush is retried.
+        """
+        if self.wide is not None:
+            self.encode_wide()
+        if self.buffer:
+            view = memoryview(self.buffer)
+            start = written = 0
+            try:
+                for end in self.boundaries + [len(self.buffer)]:
+                    if end > start:
+                        self.write(view[start:end])
+                    start = end
+                    written += 1
+            except Exception:
+                # The buffer can't be resized while slices of it are viewed,
+                # i.e. by the traceback, so the rest is copied
+                self.buffer = self.buffer[start:]
+                self.boundaries = [
+                    end - start for end in self.boundaries[written:]]
+                self.lines -= written * self.batch_size
+                raise
+            del view
+        self.clear()
+
+    def clear(self):
+        del self.buffer[:]
+        del self.boundaries[:]
+        self.lines = 0
+        if self.wide is not None:
+            self.wide.clear()
+
+    def chunks(self, data):
+        """Splits data into HTTP chunks, compressing it if gzip is enabled"""
+        if self.gzip:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for start in range(0, len(data), self.chunk_size):
+            chunk = data[start:start + self.chunk_size].tobytes()
+            if self.gzip:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if self.gzip:
+            yield compressor.flush()
+
+    def connect(self):
+        """Returns the persistent HTTP connection, creating it if needed"""
+        if self.connection is None:
+            cls = httplib.HTTPSConnection if self.ssl else httplib.HTTPConnection
+            self.connection = cls(self.host, self.port, timeout=self.timeout)
+        return self.connection
+
+    def close(self):
+        """Closes the HTTP connection"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def write(self, data):
+        """Writes line protocol data to InfluxDB in one chunked request
+
+        :param memoryview data: Lines of line protocol
+        :raises IOError: if InfluxDB does not accept the write
+        """
+        connection = self.connect()
+        try:
+            connection.putrequest('POST', self.path, skip_accept_encoding=True)
+            for header, value in self.headers:
+                connection.putheader(header, value)
+            connection.putheader('Transfer-Encoding', 'chunked')
+            connection.endheaders()
+            for chunk in self.chunks(data):
+                connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.bytes_sent += len(chunk)
+            connection.send('0\r\n\r\n')
+            response = connection.getresponse()
+            body = response.read()
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            raise
+
+        if response.status != 204:
+            raise IOError("InfluxDB write failed ({0}): {1}".format(
+                response.status, body.strip()))
@@ -0,0 +1,127 @@
+from __future__ import division
+
+import time
+
+import supermann.utils
+from supermann.outputs.base import BaseOutput
+from supermann.services import Service
+
+
+class Counter(object):
+    """The last sample of a counter, and the process it was read from"""
+
+    __slots__ = ['identity', 'time', 'value']
+
+    def __init__(self, identity, time, value):
+        self.identity = identity
+        self.time = time
+        self.value = value
+
+
+class RateOutput(BaseOutput):
+    """
+    Wraps another output, and sends the rate of each process counter.
+
+    Counters such as ``process:{name}:cpu:absolute`` only ever increase while
+    a process is running. For each counter, the last sample is kept along
+    with the PID and create time of the process it was read from, and an
+    event with the rate per second is sent as ``{service}/s``, i.e.
+    ``process:{name}:io:read:bytes/s``.
+
+    No rate is sent the first time a counter is seen, or when the counter has
+    been reset - the process was restarted, or the counter went backwards.
+    The samples for a program are dropped once it is no longer running under
+    Supervisor.
+
+    Enabled by adding a ``[rate]`` section to the config file.
+    """
+    section_name = "rate"
+
+    def __init__(self, output=None, identity=None):
+        """
+        :param output: The output to send events to
+        :param identity: A function returning the ``(pid, create_time)`` of a
+            running program by name, or None if it is not running
+        """
+        super(RateOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.output = output
+        self.identity = identity or (lambda name: None)
+        self.counters = ()
+        self.fields = frozenset()
+        self.suffix = '/s'
+        self.keep_counters = True
+
+        #: The last sample of each counter, by service
+        self.samples = dict()
+
+    def init(self, counters='cpu:absolute, io:read:bytes, io:write:bytes',
+             suffix='/s', keep_counters=True):
+        """
+        :param counters: A comma separated list of process metrics that are
+            counters, without the ``process:{name}:`` prefix
+        :param suffix: Appended to the service of each rate
+        :param keep_counters: Also send the counters themselves
+        """
+        self.fields = frozenset(
+            c.strip() for c in counters.split(',') if c.strip())
+        self.counters = tuple(':' + field for field in self.fields)
+        self.suffix = suffix
+        self.keep_counters = supermann.utils.boolean(keep_counters)
+
+    def __enter__(self):
+        self.output.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.output.__exit__(exc_type, exc_val, exc_tb)
+
+    def program(self, service):
+        """Returns the program name in a counter's service, or None"""
+        if isinstance(service, Service):
+            if service.family == 'process' and service.field in self.fields:
+                return service.process
+            return None
+        if not service.startswith('process:'):
+            return None
+        for counter in self.counters:
+            if service.endswith(counter):
+                return service[len('process:'):-len(counter)]
+        return None
+
+    def event(self, **data):
+        service, value = data.get('service'), data.get('metric_f')
+        name = self.program(service) if value is not None and service else None
+        if name is None or self.keep_counters:
+            self.output.event(**data)
+        if name is None:
+            return
+
+        identity = self.identity(name)
+        if identity is None:
+            return
+        now = data.get('time') or time.time()
+        last = self.samples.get(service)
+        self.samples[service] = Counter(identity, now, value)
+        if last is None:
+            return
+        if last.identity != identity or value < last.value:
+            self.log.debug("Counter {0} was reset".format(service))
+            return
+        if now > last.time:
+            rate = dict(data, service=service + self.suffix,
+                        metric_f=(value - last.value) / (now - last.time))
+            self.output.event(**rate)
+
+    def expire(self):
+        """Drops the samples of programs that are no longer running"""
+        for service in list(self.samples):
+            if self.identity(self.program(service)) is None:
+                del self.samples[service]
+
+    def flush(self):
+        self.expire()
+        self.output.flush()
+
+    def clear(self):
+        self.output.clear()
@@ -1,28 +1,308 @@
+import functools
+import itertools
+import select
+import socket
+import ssl
+import time
+
 import riemann_client
+import riemann_client.riemann_pb2
+import riemann_client.transport
 from riemann_client.client import QueuedClient
 
 import supermann
 from supermann.outputs.base import BaseOutput
 
+
+def set_keepalive(sock, idle=60, interval=10, count=5):
+    """Enables TCP keepalive on a socket, using the Linux options if present
+
+    :param socket.socket sock: A connected TCP socket
+    :param int idle: Seconds before the first keepalive probe is sent
+    :param int interval: Seconds between keepalive probes
+    :param int count: Failed probes before the connection is closed
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval),
+                          ('TCP_KEEPCNT', count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def varint_size(value):
+    """Returns the number of bytes used to encode an integer as a varint"""
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def split_message(message, max_events=0, max_bytes=0):
+    """Splits the events in a message into several smaller messages
+
+    :param message: A ``riemann_pb2.Msg`` containing events
+    :param int max_events: The most events in each message (0 for no limit)
+    :param int max_bytes: The largest encoded size of each message (0 for no
+        limit). An event larger than this is sent in a message on its own.
+    :returns: An iterator of messages
+    """
+    if not (max_events or max_bytes):
+        if message.events:
+            yield message
+        return
+
+    chunk = riemann_client.riemann_pb2.Msg()
+    size = 0
+    for event in message.events:
+        # The encoded size of the event, its field tag and its length
+        event_size = event.ByteSize()
+        event_size += 1 + varint_size(event_size)
+        if chunk.events and (
+                (max_events and len(chunk.events) >= max_events) or
+                (max_bytes and size + event_size > max_bytes)):
+            yield chunk
+            chunk = riemann_client.riemann_pb2.Msg()
+            size = 0
+        chunk.events.add().MergeFrom(event)
+        size += event_size
+    if chunk.events:
+        yield chunk
+
+
+def tls_idle(sock):
+    """Checks a readable TLS socket for data from the server
+
+    TLS 1.3 servers send session tickets after the handshake, which make the
+    socket readable even though Riemann has not written anything. Reading
+    without blocking processes them, and fails if there is no data.
+
+    :param ssl.SSLSocket sock: A readable TLS socket
+    :returns: True if the connection is open and there is nothing to read
+    """
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        sock.recv(1)
+    except ssl.SSLWantReadError:
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.settimeout(timeout)
+    return False
+
+
+class TLSTransport(riemann_client.transport.TLSTransport):
+    """Communicates with Riemann over TCP and TLS
+
+    ``riemann_client`` only offers TLS 1.0, which OpenSSL 3 refuses by
+    default. This negotiates the newest version both ends support, and still
+    requires the server's certificate to be signed by ``ca_certs``, or by the
+    system's CAs if it is not set.
+    """
+
+    def connect(self):
+        riemann_client.transport.TCPTransport.connect(self)
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.verify_mode = ssl.CERT_REQUIRED
+        if self.ca_certs:
+            context.load_verify_locations(self.ca_certs)
+        else:
+            context.load_default_certs()
+        self.socket = context.wrap_socket(self.socket)
+
+
+class ReconnectingTransport(riemann_client.transport.Transport):
+    """A small pool of Riemann connections that reconnect when they fail
+
+    Messages are sent over each connection in turn. A connection is checked
+    before it is used, and is replaced if the server has closed it. If sending
+    a message fails, the connection is closed and the next one is tried.
+    Connections that can't be opened are retried after a backoff, so an
+    unavailable server is not contacted on every flush.
+    """
+
+    def __init__(self, host, port, pool_size=1, connect_timeout=5.0,
+                 write_timeout=10.0, keepalive=True, max_backoff=60.0,
+                 transport_class=None):
+        self.log = supermann.utils.getLogger(self)
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.write_timeout = write_timeout
+        self.keepalive = keepalive
+        self.max_backoff = max_backoff
+        self.transport_class = (transport_class or
+                                riemann_client.transport.TCPTransport)
+
+        self.pool = [None] * pool_size
+        self.retry_at = [0] * pool_size
+        self.backoff = [0] * pool_size
+        self.next = 0
+
+    def connect(self):
+        """Opens each connection in the pool, logging any failures"""
+        for index in range(len(self.pool)):
+            self.checkout(index)
+
+    def disconnect(self):
+        """Closes each open connection in the pool"""
+        for index in range(len(self.pool)):
+            self.close(index)
+
+    def open(self, index):
+        """Opens a connection for a slot in the pool
+
+        :returns: A connected transport, or None if the connection failed
+        """
+        transport = self.transport_class(
+            self.host, self.port, self.connect_timeout)
+        try:
+            transport.connect()
+            transport.socket.settimeout(self.write_timeout)
+            if self.keepalive:
+                set_keepalive(transport.socket)
+        except (socket.error, IOError) as e:
+            self.backoff[index] = min(
+                max(self.backoff[index] * 2, 1), self.max_backoff)
+            self.retry_at[index] = time.time() + self.backoff[index]
+            self.log.warning("Could not connect to Riemann at {0}:{1} ({2}), "
+                             "retrying in {3}s".format(
+                                 self.host, self.port, e, self.backoff[index]))
+            return None
+        self.backoff[index] = 0
+        self.pool[index] = transport
+        return transport
+
+    def close(self, index):
+        """Closes the connection in a slot in the pool, ignoring errors"""
+        transport, self.pool[index] = self.pool[index], None
+        if transport is not None:
+            try:
+                transport.disconnect()
+            except (socket.error, IOError):
+                pass
+
+    @staticmethod
+    def healthy(transport):
+        """Checks if the server has closed a connection
+
+        Riemann only writes to a connection in response to a message, so a
+        readable socket means it has been closed or is in an unknown state.
+        """
+        try:
+            readable, _, _ = select.select([transport.socket], [], [], 0)
+        except (socket.error, select.error, TypeError, ValueError):
+            return False
+        if readable and isinstance(transport.socket, ssl.SSLSocket):
+            return tls_idle(transport.socket)
+        return not readable
+
+    def checkout(self, index):
+        """Returns a healthy connection for a slot, reconnecting if needed
+
+        :returns: A connected transport, or None if one isn't available
+        """
+        transport = self.pool[index]
+        if transport is not None and not self.healthy(transport):
+            self.log.info("Riemann connection closed, reconnecting")
+            self.close(index)
+            transport = None
+        if transport is None and time.time() >= self.retry_at[index]:
+            transport = self.open(index)
+        return transport
+
+    def send(self, message):
+        """Sends a message over the next available connection
+
+        Each connection is tried in turn, and one more attempt is made if
+        they all fail, so that a connection found to be broken when writing
+        to it is replaced straight away.
+
+        :raises socket.error: if no connection could send the message
+        """
+        for _ in range(len(self.pool) + 1):
+            index, self.next = self.next, (self.next + 1) % len(self.pool)
+            transport = self.checkout(index)
+            if transport is None:
+                continue
+            try:
+                return transport.send(message)
+            except riemann_client.transport.RiemannError:
+                raise
+            except Exception as e:
+                self.log.warning("Sending to Riemann failed ({0})".format(e))
+                self.close(index)
+        raise socket.error("No connection to Riemann at {0}:{1}".format(
+            self.host, self.port))
+
+
 class RiemannOutput(BaseOutput):
     section_name = "riemann"
 
+    transports = ('tcp', 'udp', 'tls')
+
+    hostname = socket.gethostname()
+
+    #: The total size of the messages sent to Riemann, in bytes
+    bytes_sent = 0
+
     def init(self, **params):
         """
         Initialization of output
 
         :param host: required, host
         :param port: required, port
+        :param transport: ``tcp`` (default), ``udp`` or ``tls``
+        :param ca_certs: path to a CA certificate bundle, for ``tls``
+        :param max_events_per_message: split each flush into messages with
+            at most this many events (default 0, no limit)
+        :param mtu: largest UDP message in bytes, messages are split to fit
+            (default 1472)
+        :param pool_size: number of connections to keep open (default 1)
+        :param connect_timeout: seconds to wait for a connection (default 5)
+        :param write_timeout: seconds to wait for a send (default 10)
+        :param keepalive: enable TCP keepalive (default true)
+        :param max_buffered_events: events kept to resend while Riemann is
+            unavailable, dropping the oldest (default 10000)
 
         Other params are depend on kind of output
         """
         self.host = params["host"]
         self.port = params["port"]
-        self.riemann = riemann_client.client.QueuedClient(
-            riemann_client.transport.TCPTransport(self.host, self.port))  #type: QueuedClient
+        self.transport = params.get("transport", "tcp").lower()
+        self.max_events_per_message = int(params.get("max_events_per_message", 0))
+        self.max_buffered_events = int(params.get("max_buffered_events", 10000))
+
+        if self.transport == 'udp':
+            # UDP is fire-and-forget, so there is no connection to maintain
+            self.max_bytes = int(params.get("mtu", 1472))
+            transport = riemann_client.transport.UDPTransport(
+                self.host, int(self.port))
+        elif self.transport in ('tcp', 'tls'):
+            self.max_bytes = 0
+            transport_class = riemann_client.transport.TCPTransport
+            if self.transport == 'tls':
+                transport_class = functools.partial(
+                    TLSTransport, ca_certs=params.get("ca_certs"))
+            transport = ReconnectingTransport(
+                self.host, self.port,
+                pool_size=int(params.get("pool_size", 1)),
+                connect_timeout=float(params.get("connect_timeout", 5)),
+                write_timeout=float(params.get("write_timeout", 10)),
+                keepalive=supermann.utils.boolean(params.get("keepalive", True)),
+                transport_class=transport_class)
+        else:
+            raise ValueError("Unknown Riemann transport {0!r}".format(
+                self.transport))
+
+        self.riemann = riemann_client.client.QueuedClient(transport)  #type: QueuedClient
 
-        supermann.utils.getLogger(self).info(
-            "Using Riemann protobuf server at {0}:{1}".format(self.host, self.port))
+        self.log = supermann.utils.getLogger(self)
+        self.log.info("Using Riemann protobuf server at {0}:{1} ({2})".format(
+            self.host, self.port, self.transport))
 
     def __enter__(self):
         self.riemann.__enter__()
@@ -32,7 +312,65 @@ class RiemannOutput(BaseOutput):
         self.riemann.__exit__(exc_type, exc_val, exc_tb)
 
     def event(self, **data):
+        # Riemann times are whole seconds
+        if data.get('time') is not None:
+            data['time'] = int(data['time'])
         self.riemann.event(**data)
 
+    def event_batch(self, batch):
+        """
+        Adds each metric in a batch straight to the queued message, without
+        creating an event dict and an ``Event`` to copy for each one. Metrics
+        with other attributes are added with :meth:`event`.
+        """
+        events = self.riemann.queue.events
+        hostname = self.hostname
+        extra = batch.extra
+        rows = itertools.izip(
+            batch.services, batch.values, batch.states, batch.times)
+        for index, (service, metric, state, time) in enumerate(rows):
+            if extra and index in extra:
+                self.event(**batch[index])
+                continue
+            event = events.add()
+            event.host = hostname
+            event.service = service
+            if metric is not None:
+                event.metric_f = metric
+            if state is not None:
+                event.state = state
+            if time is not None:
+                event.time = int(time)
+
     def flush(self):
-        self.riemann.flush()
\ No newline at end of file
+        """
+        Sends queued events to Riemann. If Riemann can't be reached, the
+        events that were not sent are kept, up to ``max_buffered_events``,
+        and the error is raised so that a
+        :class:`supermann.outputs.background.BackgroundOutput` can retry or
+        spool them. Kept events are sent with the next flush unless
+        :meth:`clear` is called.
+        """
+        queue = self.riemann.queue
+        sent = 0
+        try:
+            for message in split_message(
+                    queue, self.max_events_per_message, self.max_bytes):
+                self.riemann.transport.send(message)
+                sent += len(message.events)
+                self.bytes_sent += message.ByteSize()
+        except (socket.error, IOError) as e:
+            events = queue.events
+            del events[:sent]
+            excess = len(events) - self.max_buffered_events
+            if excess > 0:
+                del events[:excess]
+            self.log.warning(
+                "Could not send to Riemann ({0}), buffering {1} events "
+                "(dropped {2})".format(e, len(events), max(excess, 0)))
+            raise
+        else:
+            self.riemann.clear_queue()
+
+    def clear(self):
+        self.riemann.clear_queue()
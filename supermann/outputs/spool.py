@@ -0,0 +1,221 @@
+import errno
+import json
+import mmap
+import os
+import struct
+import time
+
+import supermann.utils
+
+#: Each record in a segment is prefixed with its length
+HEADER = struct.Struct('!I')
+
+
+def decode_event(data):
+    """Converts the unicode strings in an event read from JSON to str"""
+    return dict((str(key), value.encode('utf-8') if isinstance(value, unicode)
+                 else value) for key, value in data.items())
+
+
+class Spool(object):
+    """
+    An on-disk queue of batches of events that could not be sent.
+
+    Batches are appended as length-prefixed JSON records to segment files in
+    a directory. A new segment is started when the current one reaches
+    ``segment_bytes``. When the spool is larger than ``max_bytes``, or a
+    segment is older than ``max_age`` seconds, the oldest segments are
+    deleted.
+
+    Segments are read back using ``mmap``, oldest first, and a segment is
+    deleted once every batch in it has been replayed. The read position is
+    only kept in memory, so batches from a partially replayed segment may be
+    sent again after a restart.
+    """
+
+    suffix = '.spool'
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024,
+                 max_age=24 * 60 * 60, segment_bytes=4 * 1024 * 1024):
+        """
+        :param str directory: The directory segments are written to
+        :param int max_bytes: The largest total size of the segments
+        :param float max_age: Segments older than this many seconds are
+            deleted
+        :param int segment_bytes: The size at which a new segment is started
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+
+        self.writer = None
+        self.writer_path = None
+        self.reader_map = None
+        self.reader_path = None
+        self.reader_offset = 0
+        self.reader_length = 0
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return "Spool({0!r})".format(self.directory)
+
+    def segments(self):
+        """Returns the paths of the segments in the spool, oldest first"""
+        return [os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if name.endswith(self.suffix)]
+
+    def __len__(self):
+        """Returns the number of segments in the spool"""
+        return len(self.segments())
+
+    def append(self, events):
+        """Writes a batch of events to the current segment
+
+        :param list events: A list of event dicts
+        """
+        if self.writer is None:
+            self.writer_path = os.path.join(self.directory, '{0:016d}{1}'.format(
+                int(time.time() * 1000000), self.suffix))
+            self.writer = open(self.writer_path, 'ab')
+
+        data = json.dumps(events, separators=(',', ':'))
+        try:
+            self.writer.write(HEADER.pack(len(data)) + data)
+            self.writer.flush()
+        except EnvironmentError:
+            # Records after a partial write could not be read, so the next
+            # append starts a new segment
+            self.abandon()
+            raise
+
+        if self.writer.tell() >= self.segment_bytes:
+            self.rotate()
+        self.expire()
+
+    def rotate(self):
+        """Closes the current segment, so the next append starts a new one"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.writer_path = None
+
+    def abandon(self):
+        """Closes the current segment after a failed write, ignoring errors
+        flushing what is left of the record"""
+        writer, self.writer, self.writer_path = self.writer, None, None
+        try:
+            writer.close()
+        except EnvironmentError:
+            pass
+
+    def remove(self, path):
+        """Deletes a segment"""
+        if path == self.writer_path:
+            self.rotate()
+        if path == self.reader_path:
+            self.close_reader()
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def expire(self):
+        """Deletes the oldest segments until the spool is within its limits"""
+        now = time.time()
+        segments = [(path, os.stat(path)) for path in self.segments()]
+        total = sum(stat.st_size for _, stat in segments)
+        for path, stat in segments:
+            if total <= self.max_bytes and now - stat.st_mtime <= self.max_age:
+                break
+            self.log.warning("Dropping spool segment {0} ({1} bytes)".format(
+                path, stat.st_size))
+            self.remove(path)
+            total -= stat.st_size
+
+    def peek(self):
+        """Returns the oldest batch in the spool without removing it
+
+        :returns: A list of event dicts, or None if the spool is empty
+        """
+        while True:
+            segments = self.segments()
+            if not segments:
+                return None
+            path = segments[0]
+            # Segments are only read once they are no longer being written
+            if path == self.writer_path:
+                self.rotate()
+            if path != self.reader_path:
+                self.open_reader(path)
+
+            events = self.read()
+            if events is not None:
+                return events
+            self.remove(path)
+
+    def open_reader(self, path):
+        """Maps a segment into memory so that it can be read"""
+        self.close_reader()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.reader_map = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader_path = path
+        self.reader_offset = 0
+
+    def close_reader(self):
+        """Unmaps the segment being read"""
+        if self.reader_map is not None:
+            self.reader_map.close()
+        self.reader_map = None
+        self.reader_path = None
+        self.reader_offset = 0
+
+    def read(self):
+        """Reads the record at the read position of the current segment
+
+        :returns: A list of event dicts, or None at the end of the segment
+            or if the rest of the segment can't be read
+        """
+        data, offset = self.reader_map, self.reader_offset
+        if data is None or offset + HEADER.size > len(data):
+            return None
+        length, = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        if start + length > len(data):
+            self.log.warning("Truncated record in {0}".format(self.reader_path))
+            return None
+        self.reader_length = HEADER.size + length
+        try:
+            return [decode_event(event)
+                    for event in json.loads(data[start:start + length])]
+        except (ValueError, TypeError, AttributeError) as e:
+            # The lengths of the records after a corrupt record can't be
+            # trusted, so the rest of the segment is skipped
+            self.log.warning("Corrupt record in {0} ({1}: {2})".format(
+                self.reader_path, e.__class__.__name__, e))
+            return None
+
+    def pop(self):
+        """Removes the batch last returned by :py:meth:`peek`
+
+        The segment is deleted once its last batch has been removed.
+        """
+        if self.reader_path is not None:
+            self.reader_offset += self.reader_length
+            if self.reader_offset >= len(self.reader_map):
+                self.remove(self.reader_path)
+
+    def close(self):
+        """Closes the segments being written and read"""
+        self.rotate()
+        self.close_reader()
@@ -0,0 +1,94 @@
+import supermann.utils
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.base import BaseOutput
+from supermann.outputs.fanout import FanoutOutput, unique_names
+
+
+def bytes_sent(output):
+    """Returns the total bytes sent by an output, or None if not counted
+
+    Wrapping outputs are followed to the outputs they wrap.
+    """
+    if hasattr(output, 'bytes_sent'):
+        return output.bytes_sent
+    if hasattr(output, 'outputs'):
+        counts = [bytes_sent(o) for o in output.outputs]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    if hasattr(output, 'output'):
+        return bytes_sent(output.output)
+    return None
+
+
+def background_outputs(output):
+    """Returns the :class:`BackgroundOutput` instances wrapped by an output
+
+    Wrapping outputs are followed to the outputs they wrap.
+    """
+    if isinstance(output, BackgroundOutput):
+        return [output]
+    if isinstance(output, FanoutOutput):
+        return output.outputs
+    if hasattr(output, 'output'):
+        return background_outputs(output.output)
+    return []
+
+
+class TelemetryOutput(BaseOutput):
+    """
+    Wraps another output, counting the events sent and timing each flush.
+
+    Before each flush, the metrics collected by a
+    :class:`supermann.telemetry.Telemetry` instance are sent to the wrapped
+    output. Created by :meth:`supermann.core.Supermann.instrument`.
+
+    If the wrapped output flushes from a :class:`BackgroundOutput`, a flush
+    only puts the events on a queue, so it is timed as ``enqueue`` and the
+    counters of each background output are reported instead.
+    """
+    section_name = "telemetry"
+
+    def __init__(self, output=None, telemetry=None):
+        super(TelemetryOutput, self).__init__()
+        self.log = supermann.utils.getLogger(self)
+        self.output = output
+        self.telemetry = telemetry
+        self.last_bytes_sent = bytes_sent(output)
+        self.background = background_outputs(output)
+
+    def init(self, **params):
+        pass
+
+    def __enter__(self):
+        self.output.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self.output.__exit__(exc_type, exc_val, exc_tb)
+
+    def event(self, **data):
+        self.telemetry.count()
+        self.output.event(**data)
+
+    def event_batch(self, batch):
+        self.telemetry.count(len(batch))
+        self.output.event_batch(batch)
+
+    def flush(self):
+        total = bytes_sent(self.output)
+        sent = None
+        if total is not None and self.last_bytes_sent is not None:
+            sent = total - self.last_bytes_sent
+        self.last_bytes_sent = total
+
+        names = unique_names(self.background)
+        if len(names) == 1:
+            names = [None]
+        counters = [(name, output.read_counters())
+                    for name, output in zip(names, self.background)]
+        self.telemetry.report(self.output, sent, counters)
+        with self.telemetry.timer('enqueue' if self.background else 'flush'):
+            self.output.flush()
+
+    def clear(self):
+        self.output.clear()
@@ -0,0 +1,160 @@
+"""Reads process snapshots in a pool of workers
+
+Reading ``/proc`` for hundreds of process trees one after another takes most
+of a cycle on a busy host. :py:class:`ParallelSnapshots` splits the running
+processes into shards, and reads the snapshots for each shard in a pool of
+threads or processes. The snapshots are merged before any receivers run, and
+receivers still run one after another in the main thread, so events are sent
+in the same order as when snapshots are read serially.
+
+In ``thread`` mode the workers use the same ``psutil.Process`` objects as
+the serial path. In ``process`` mode, workers are sent the PID and create
+time of each process in a tree and open their own ``psutil.Process``
+objects. In both modes ``cpu_percent`` is calculated from the CPU times in
+each snapshot by the :py:class:`supermann.snapshot.CpuTracker` in the main
+process.
+"""
+
+from __future__ import absolute_import
+
+import multiprocessing
+import multiprocessing.pool
+import time
+
+import psutil
+
+import supermann.utils
+from supermann.snapshot import ProcessSnapshot
+
+
+def shard(items, count):
+    """Splits a list into at most ``count`` contiguous shards"""
+    size = max(-(-len(items) // max(count, 1)), 1)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def read_processes(tree):
+    """Opens a process tree, skipping processes that have been replaced
+
+    :param tree: A list of ``(pid, create_time)`` pairs, root first
+    :returns: A list of ``psutil.Process`` objects, root first
+    :raises psutil.NoSuchProcess: if the root process has gone
+    """
+    processes = list()
+    for index, (pid, create_time) in enumerate(tree):
+        try:
+            process = psutil.Process(pid)
+            if process.create_time() != create_time:
+                raise psutil.NoSuchProcess(pid)
+        except psutil.NoSuchProcess:
+            if index == 0:
+                raise
+            continue
+        processes.append(process)
+    return processes
+
+
+def read_shard(trees):
+    """Reads the snapshots for a shard of process trees in a worker process
+
+    :param list trees: Process trees, as passed to :py:func:`read_processes`
+    :returns: A list of snapshots, with None for trees that could not be read
+    """
+    snapshots = list()
+    for tree in trees:
+        try:
+            processes = read_processes(tree)
+            snapshots.append(
+                ProcessSnapshot.collect(processes[0], processes[1:]))
+        except psutil.Error:
+            snapshots.append(None)
+    return snapshots
+
+
+class ParallelSnapshots(object):
+    """Reads the snapshots for a cycle in a pool of threads or processes
+
+    Enabled by adding a ``[parallel]`` section to the config file.
+    """
+
+    modes = ('thread', 'process')
+
+    def __init__(self, mode='thread', workers=None, shards=None):
+        """
+        :param str mode: ``thread`` or ``process``
+        :param int workers: The size of the pool, defaulting to the number
+            of CPUs
+        :param int shards: The number of shards the processes are split
+            into, defaulting to the number of workers
+        """
+        if mode not in self.modes:
+            raise ValueError("Unknown parallel mode {0!r}".format(mode))
+        self.log = supermann.utils.getLogger(self)
+        self.mode = mode
+        self.workers = workers or multiprocessing.cpu_count()
+        self.shards = shards or self.workers
+        self.pool = None
+
+    def __repr__(self):
+        return "ParallelSnapshots({0!r}, workers={1})".format(
+            self.mode, self.workers)
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates an instance from the items in a config section"""
+        options = dict(items)
+        return cls(mode=options.get('mode', 'thread'),
+                   workers=int(options.get('workers', 0)) or None,
+                   shards=int(options.get('shards', 0)) or None)
+
+    def start(self):
+        """Starts the pool, which should be done before any other threads"""
+        if self.mode == 'process':
+            self.pool = multiprocessing.Pool(self.workers)
+        else:
+            self.pool = multiprocessing.pool.ThreadPool(self.workers)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def collect(self, instance, processes):
+        """Reads a snapshot of each process tree
+
+        :param supermann.core.Supermann instance: The instance reading the
+            snapshots, used to find children and in ``thread`` mode to read
+            and cache the snapshots
+        :param list processes: The ``psutil.Process`` objects to read
+        :returns: A dict of snapshots by PID
+        """
+        if self.mode == 'process':
+            return self.collect_processes(instance, processes)
+        self.pool.map(
+            lambda items: [instance.read_snapshot(p) for p in items],
+            shard(processes, self.shards))
+        return instance.snapshots
+
+    def collect_processes(self, instance, processes):
+        """Reads snapshots in worker processes"""
+        trees = list()
+        for process in processes:
+            tree = list()
+            for p in [process] + instance.children(process):
+                try:
+                    tree.append((p.pid, p.create_time()))
+                except psutil.NoSuchProcess:
+                    if p is process:
+                        break
+            else:
+                trees.append(tree)
+
+        now = time.time()
+        results = self.pool.map(read_shard, shard(trees, self.shards))
+        snapshots = dict()
+        for snapshot in (s for result in results for s in result):
+            if snapshot is not None:
+                instance.cpu.update(snapshot, now)
+                snapshots[snapshot.pid] = snapshot
+        return snapshots
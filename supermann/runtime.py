@@ -0,0 +1,271 @@
+"""Runs receivers concurrently in a pool of worker threads
+
+Python 2 has no ``asyncio``, so the concurrent runtime is built from
+threads. When a :py:class:`Runtime` is set on a
+:py:class:`supermann.core.Supermann` instance, the stages of a cycle run
+concurrently instead of one after another:
+
+- Events are read from Supervisor and acknowledged by the main thread.
+- Process info is polled from Supervisor's XML-RPC interface by a
+  :py:class:`Poller` thread, so a slow Supervisor doesn't hold up collection.
+- Process snapshots and receivers run as tasks in a thread pool, where the
+  ``psutil`` calls release the GIL. Each task has a timeout, and a receiver
+  that is still running from a previous cycle is skipped until it finishes.
+- The output is flushed by a :py:class:`supermann.outputs.background.BackgroundOutput`.
+
+Receivers still use the blinker API. Each task is given a
+:py:class:`BufferedSender` in place of the Supermann instance, which records
+the metrics it collects in its own batch, and the metrics from each cycle
+are added to the instance's batch in the same order as the serial path would
+add them.
+"""
+
+from __future__ import absolute_import
+
+import multiprocessing.pool
+import sys
+import threading
+import time
+
+import supermann.batch
+import supermann.utils
+
+
+class BufferedOutput(object):
+    """Records the events sent by a receiver"""
+
+    __slots__ = ['events']
+
+    def __init__(self):
+        self.events = list()
+
+    def event(self, **data):
+        self.events.append(data)
+
+
+class BufferedSender(object):
+    """Stands in for the Supermann instance passed to a receiver
+
+    Metrics added to ``batch`` and events sent to ``output_client`` are
+    recorded, and all other attributes are read from the Supermann instance.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.batch = supermann.batch.MetricBatch()
+        self.output_client = BufferedOutput()
+
+    def __getattr__(self, name):
+        return getattr(self.instance, name)
+
+
+class Task(object):
+    """A receiver call submitted to the pool"""
+
+    __slots__ = ['key', 'sender', 'result']
+
+    def __init__(self, key, sender, result):
+        self.key = key
+        self.sender = sender
+        self.result = result
+
+
+def call(receiver, sender, kwargs):
+    """Calls a receiver in a worker thread, timing it if telemetry is set"""
+    telemetry = sender.telemetry
+    if telemetry is None:
+        return receiver(sender, **kwargs)
+    with telemetry.timer(telemetry.receiver_key(receiver)):
+        return receiver(sender, **kwargs)
+
+
+class Poller(threading.Thread):
+    """A thread that keeps a copy of the Supervisor process table
+
+    The process table is read every ``interval`` seconds, which only calls
+    Supervisor when the table needs reconciling (see
+    :py:class:`supermann.supervisor.ProcessInfoCache`).
+    """
+
+    def __init__(self, supervisor, interval=1.0):
+        """
+        :param supermann.supervisor.Supervisor supervisor: The interface to
+            read process info from
+        :param float interval: Seconds between reads of the process table
+        """
+        super(Poller, self).__init__(name='supermann-poller')
+        self.daemon = True
+        self.log = supermann.utils.getLogger(self)
+        self.supervisor = supervisor
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.processes = None
+        self.ready = threading.Event()
+
+    def poll(self):
+        """Reads the process table from Supervisor"""
+        self.processes = self.supervisor.process_info()
+        self.ready.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.log.exception("Could not read process info")
+            self.stopping.wait(self.interval)
+
+    def process_info(self):
+        """Returns the last process table read from Supervisor
+
+        The table is read in the calling thread if it has never been read.
+
+        :returns: A list of new process info dicts
+        """
+        if not self.ready.is_set():
+            self.poll()
+        return [dict(data) for data in self.processes]
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+
+
+class Runtime(object):
+    """Runs the receivers for a cycle concurrently, with a timeout
+
+    Enabled by adding a ``[concurrent]`` section to the config file.
+    """
+
+    def __init__(self, workers=4, timeout=10.0, poll_interval=1.0):
+        """
+        :param int workers: The number of worker threads
+        :param float timeout: Seconds to wait for the tasks in a cycle
+        :param float poll_interval: Seconds between reads of the process table
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.workers = workers
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.pool = None
+        self.poller = None
+
+        #: Tasks submitted in this cycle, in the order they were submitted
+        self.tasks = list()
+        #: Tasks that timed out and have not finished yet, by key
+        self.running = dict()
+
+    def __repr__(self):
+        return "Runtime(workers={0}, timeout={1})".format(
+            self.workers, self.timeout)
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates a runtime from the items in a config section"""
+        options = dict(items)
+        return cls(workers=int(options.get('workers', 4)),
+                   timeout=float(options.get('timeout', 10)),
+                   poll_interval=float(options.get('poll_interval', 1)))
+
+    def start(self, instance):
+        """Starts the worker threads and the process info poller
+
+        :param supermann.core.Supermann instance: The instance to run for
+        """
+        self.pool = multiprocessing.pool.ThreadPool(self.workers)
+        self.poller = Poller(instance.supervisor, self.poll_interval)
+        self.poller.start()
+
+    def stop(self):
+        """Stops the worker threads and the poller"""
+        if self.poller is not None:
+            self.poller.stop()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def process_info(self):
+        """Returns the process table read by the poller"""
+        return self.poller.process_info()
+
+    def map(self, function, items):
+        """Calls a function for each item in the pool, waiting for them all
+
+        Items that have not finished within the timeout are logged, and left
+        to finish in the background.
+
+        :returns: A list of results, with None for items that did not finish
+        """
+        results = [self.pool.apply_async(function, (item,)) for item in items]
+        deadline = time.time() + self.timeout
+        values = list()
+        for item, result in zip(items, results):
+            result.wait(max(deadline - time.time(), 0))
+            if not result.ready():
+                self.log.warning("Timed out calling {0} for {1}".format(
+                    function.__name__, item))
+                values.append(None)
+            elif not result.successful():
+                self.log.error("Calling {0} for {1} failed".format(
+                    function.__name__, item), exc_info=self.exc_info(result))
+                values.append(None)
+            else:
+                values.append(result.get())
+        return values
+
+    def submit(self, instance, receiver, key=None, **kwargs):
+        """Submits a receiver call to the pool
+
+        :param supermann.core.Supermann instance: The instance calling the
+            receiver
+        :param receiver: A blinker receiver
+        :param key: Identifies the call between cycles, so that a call that
+            is still running is not started again
+        :param kwargs: The arguments the signal is sent with
+        """
+        key = (receiver, key)
+        task = self.running.get(key)
+        if task is not None:
+            if not task.result.ready():
+                self.log.warning("Skipping {0}, which is still running".format(
+                    receiver.__name__))
+                return
+            del self.running[key]
+
+        sender = BufferedSender(instance)
+        result = self.pool.apply_async(call, (receiver, sender, kwargs))
+        self.tasks.append(Task(key, sender, result))
+
+    def wait(self, instance):
+        """Waits for the tasks submitted this cycle, and sends their metrics
+
+        Metrics are added to the instance's batch, and events sent to the
+        output, in the order the tasks were submitted. The metrics from tasks
+        that fail or do not finish within the timeout are dropped.
+
+        :param supermann.core.Supermann instance: The instance to send to
+        """
+        tasks, self.tasks = self.tasks, list()
+        deadline = time.time() + self.timeout
+        for task in tasks:
+            task.result.wait(max(deadline - time.time(), 0))
+            if not task.result.ready():
+                self.log.warning("Timed out waiting for {0}".format(
+                    task.key[0].__name__))
+                self.running[task.key] = task
+            elif not task.result.successful():
+                self.log.error("Receiver {0} failed".format(
+                    task.key[0].__name__), exc_info=self.exc_info(task.result))
+            else:
+                instance.batch.extend(task.sender.batch)
+                for data in task.sender.output_client.events:
+                    instance.output_client.event(**data)
+
+    @staticmethod
+    def exc_info(result):
+        """Returns the exception raised by a failed task"""
+        try:
+            result.get(0)
+        except Exception:
+            return sys.exc_info()
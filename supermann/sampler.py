@@ -0,0 +1,251 @@
+"""A per-cycle sample of system metrics, read from ``/proc`` in bulk
+
+The receivers in :py:mod:`supermann.metrics.system` used to make their own
+psutil calls and read ``/proc/loadavg`` twice each cycle. A
+:py:class:`SystemSampler` reads ``/proc/stat``, ``/proc/meminfo``,
+``/proc/loadavg`` and ``/proc/uptime`` once per cycle, and every system
+receiver reports values from that sample.
+
+Per-CPU, disk and network counters are kept in ``array.array`` buffers that
+are reused between cycles, so computing their rates does not allocate a
+Python object per counter. They are only read if one of the extended system
+receivers is connected.
+"""
+
+from __future__ import absolute_import, division
+
+import array
+import os
+import time
+
+#: The fields of a cpu line in ``/proc/stat`` that make up the total time,
+#: excluding guest time which is already counted in user time
+CPU_FIELDS = 8
+
+#: The bytes in a sector, as counted in ``/proc/diskstats``
+SECTOR_SIZE = 512
+
+
+def zeros(size):
+    """Returns an array of ``size`` doubles set to 0"""
+    return array.array('d', [0.0]) * size
+
+
+class SystemSampler(object):
+    """Reads system metrics from ``/proc``, and keeps counters between cycles
+
+    Rates are calculated from the values read by the previous call to
+    :py:meth:`read`, and are 0 the first time the sampler is read.
+    """
+
+    def __init__(self, proc='/proc'):
+        """
+        :param str proc: The path ``/proc`` is mounted at
+        """
+        self.proc = proc
+        self.time = None
+        self.elapsed = 0.0
+
+        self.cpu_percent = 0.0
+        self.cpu_count = 0
+        self.cpu_total = 0.0
+        self.cpu_idle = 0.0
+        self.cpu_times = array.array('d')
+        self.last_cpu_times = array.array('d')
+        self.per_cpu_percent = array.array('d')
+
+        self.mem_total = 0
+        self.mem_free = 0
+        self.mem_used = 0
+        self.mem_cached = 0
+        self.mem_buffers = 0
+        self.mem_percent = 0.0
+        self.swap_used = 0
+        self.swap_percent = 0.0
+
+        self.load = (0.0, 0.0, 0.0)
+        self.uptime = 0.0
+
+        #: Devices and interfaces, in the order of the counter arrays
+        self.disks = list()
+        self.disk_counters = array.array('d')
+        self.last_disk_counters = array.array('d')
+        self.disk_rates = array.array('d')
+        self.interfaces = list()
+        self.net_counters = array.array('d')
+        self.last_net_counters = array.array('d')
+        self.net_rates = array.array('d')
+
+    def __repr__(self):
+        return "SystemSampler(cpu={0}, mem={1})".format(
+            self.cpu_percent, self.mem_percent)
+
+    def path(self, *names):
+        return os.path.join(self.proc, *names)
+
+    def lines(self, *names):
+        with open(self.path(*names), 'rb') as f:
+            return f.read().splitlines()
+
+    def read(self, extended=False, now=None):
+        """Reads a new sample
+
+        :param bool extended: Also read per-CPU, disk and network counters
+        :param float now: The current time, used to calculate rates
+        :returns: The sampler
+        """
+        now = time.time() if now is None else now
+        self.elapsed = now - self.time if self.time is not None else 0.0
+        self.time = now
+
+        self.read_stat(extended)
+        self.read_meminfo()
+        with open(self.path('loadavg'), 'rb') as f:
+            self.load = tuple(float(v) for v in f.read().split()[:3])
+        with open(self.path('uptime'), 'rb') as f:
+            self.uptime = float(f.read().split()[0])
+        if extended:
+            self.read_diskstats()
+            self.read_net_dev()
+        return self
+
+    def read_stat(self, per_cpu=False):
+        """Reads the CPU times from ``/proc/stat``"""
+        cpus = list()
+        for line in self.lines('stat'):
+            if not line.startswith(b'cpu'):
+                break
+            cpus.append(line.split()[1:CPU_FIELDS + 1])
+
+        # The first line is the total over all CPUs
+        total = [float(v) for v in cpus[0]]
+        cpu_total, cpu_idle = sum(total), total[3] + total[4]
+        busy = (cpu_total - self.cpu_total) - (cpu_idle - self.cpu_idle)
+        self.cpu_percent = self.percent(busy, cpu_total - self.cpu_total)
+        self.cpu_total, self.cpu_idle = cpu_total, cpu_idle
+        self.cpu_count = len(cpus) - 1
+
+        if per_cpu:
+            self.read_per_cpu(cpus[1:])
+
+    def read_per_cpu(self, cpus):
+        """Calculates the utilisation of each CPU
+
+        :param list cpus: The fields of each ``cpuN`` line in ``/proc/stat``
+        """
+        size = self.cpu_count * CPU_FIELDS
+        if len(self.cpu_times) != size:
+            # The number of CPUs changed, so there is nothing to compare to
+            self.cpu_times, self.last_cpu_times = zeros(size), None
+            self.per_cpu_percent = zeros(self.cpu_count)
+        else:
+            # Reuse the buffer from the last cycle but one
+            self.cpu_times, self.last_cpu_times = (
+                self.last_cpu_times, self.cpu_times)
+
+        times, last = self.cpu_times, self.last_cpu_times
+        for index, fields in enumerate(cpus):
+            offset = index * CPU_FIELDS
+            for field, value in enumerate(fields):
+                times[offset + field] = float(value)
+
+        if last is None:
+            self.last_cpu_times = zeros(size)
+            return
+        for cpu in range(self.cpu_count):
+            offset = cpu * CPU_FIELDS
+            total = 0.0
+            for field in range(offset, offset + CPU_FIELDS):
+                total += times[field] - last[field]
+            idle = ((times[offset + 3] + times[offset + 4]) -
+                    (last[offset + 3] + last[offset + 4]))
+            self.per_cpu_percent[cpu] = self.percent(total - idle, total)
+
+    @staticmethod
+    def percent(part, total):
+        return (part / total) * 100 if total > 0 else 0.0
+
+    def read_meminfo(self):
+        """Reads memory and swap usage from ``/proc/meminfo``
+
+        Values are calculated in the same way as ``psutil.virtual_memory``.
+        """
+        meminfo = dict()
+        for line in self.lines('meminfo'):
+            fields = line.split()
+            meminfo[fields[0].rstrip(b':')] = int(fields[1]) * 1024
+
+        total = meminfo['MemTotal']
+        free = meminfo['MemFree']
+        buffers = meminfo.get('Buffers', 0)
+        cached = meminfo.get('Cached', 0) + meminfo.get('SReclaimable', 0)
+        available = meminfo.get('MemAvailable', free + buffers + cached)
+        used = total - free - cached - buffers
+        if used < 0:
+            used = total - free
+
+        self.mem_total = total
+        self.mem_free = free
+        self.mem_used = used
+        self.mem_cached = cached
+        self.mem_buffers = buffers
+        self.mem_percent = self.percent(total - available, total)
+
+        swap_total = meminfo.get('SwapTotal', 0)
+        self.swap_used = swap_total - meminfo.get('SwapFree', 0)
+        self.swap_percent = self.percent(self.swap_used, swap_total)
+
+    def counters(self, names, rows, counters, last, rates):
+        """Stores counters and calculates their rates per second
+
+        :param list names: The names of the devices read last time
+        :param list rows: ``(name, values)`` pairs read this time
+        :returns: The names, counters, last counters and rates
+        """
+        width = len(rows[0][1]) if rows else 0
+        size = len(rows) * width
+        first = [name for name, _ in rows] != names
+        if first:
+            # Devices were added or removed, so there is nothing to compare
+            names = [name for name, _ in rows]
+            counters, last, rates = zeros(size), zeros(size), zeros(size)
+        else:
+            # Reuse the buffer from the last cycle but one
+            last, counters = counters, last
+
+        for index, (_, values) in enumerate(rows):
+            for field, value in enumerate(values):
+                counters[index * width + field] = value
+
+        if not first and self.elapsed > 0:
+            for i in range(size):
+                delta = counters[i] - last[i]
+                # A counter that went backwards has been reset
+                rates[i] = delta / self.elapsed if delta >= 0 else 0.0
+        return names, counters, last, rates
+
+    def read_diskstats(self):
+        """Reads the bytes read and written by each disk"""
+        rows = list()
+        for line in self.lines('diskstats'):
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            rows.append((fields[2], (float(fields[5]) * SECTOR_SIZE,
+                                     float(fields[9]) * SECTOR_SIZE)))
+        (self.disks, self.disk_counters, self.last_disk_counters,
+         self.disk_rates) = self.counters(
+            self.disks, rows, self.disk_counters, self.last_disk_counters,
+            self.disk_rates)
+
+    def read_net_dev(self):
+        """Reads the bytes received and sent by each network interface"""
+        rows = list()
+        for line in self.lines('net', 'dev')[2:]:
+            name, _, data = line.partition(b':')
+            fields = data.split()
+            rows.append((name.strip(), (float(fields[0]), float(fields[8]))))
+        (self.interfaces, self.net_counters, self.last_net_counters,
+         self.net_rates) = self.counters(
+            self.interfaces, rows, self.net_counters, self.last_net_counters,
+            self.net_rates)
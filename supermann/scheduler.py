@@ -0,0 +1,171 @@
+"""Collects metrics on a schedule, independently of Supervisor events
+
+By default Supermann collects and flushes metrics between receiving an event
+from Supervisor and acknowledging it, so a slow collection or output holds up
+Supervisor's event buffer. When a :py:class:`Schedule` is set on a
+:py:class:`supermann.core.Supermann` instance, events are acknowledged as
+soon as they are received, and a :py:class:`Collector` thread runs each
+receiver at its own interval and flushes the output.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+
+import supermann.utils
+
+
+class Schedule(object):
+    """The intervals at which receivers are run
+
+    Intervals are looked up using a key for each receiver, which is the last
+    part of its module name and the receiver's name (i.e. ``process.fds`` for
+    :py:func:`supermann.metrics.process.fds`). If there is no interval for
+    that key, the interval for the module (i.e. ``process``) is used, and
+    then the default interval.
+    """
+
+    def __init__(self, interval=5, intervals=None):
+        """
+        :param float interval: The default interval in seconds
+        :param dict intervals: Intervals for receiver or module keys
+        """
+        self.interval = interval
+        self.intervals = dict(intervals or {})
+        self.last = dict()
+
+    def __repr__(self):
+        return "Schedule({0}, {1})".format(self.interval, self.intervals)
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates a schedule from the items in a config section
+
+        The ``interval`` option sets the default interval, and all other
+        options set the interval for a receiver or module key.
+
+        :param items: ``(key, interval)`` pairs
+        """
+        intervals = dict((key, float(value)) for key, value in items)
+        return cls(intervals.pop('interval', 5), intervals)
+
+    @staticmethod
+    def key(receiver):
+        """Returns the key used to find the interval for a receiver"""
+        module = getattr(receiver, '__module__', None) or ''
+        return '{0}.{1}'.format(module.rsplit('.', 1)[-1], receiver.__name__)
+
+    def interval_for(self, receiver):
+        """Returns the interval in seconds for a receiver"""
+        key = self.key(receiver)
+        for name in (key, key.split('.', 1)[0]):
+            if name in self.intervals:
+                return self.intervals[name]
+        return self.interval
+
+    def due(self, receivers, now):
+        """Returns the receivers that are due to run, marking them as run
+
+        :param receivers: An iterable of receivers
+        :param float now: The current time
+        :returns: A list of receivers that should be run now
+        """
+        due = list()
+        for receiver in receivers:
+            last = self.last.get(receiver)
+            if last is None or now - last >= self.interval_for(receiver):
+                self.last[receiver] = now
+                due.append(receiver)
+        return due
+
+    def next_run(self, now):
+        """Returns the time at which the next receiver is due to run
+
+        :param float now: The current time
+        """
+        if not self.last:
+            return now + self.interval
+        return min(last + self.interval_for(receiver)
+                   for receiver, last in self.last.items())
+
+
+class Collector(threading.Thread):
+    """A thread that collects metrics for a Supermann instance on a schedule
+
+    Exceptions raised while collecting stop the thread, and are raised again
+    in the main thread by :py:meth:`check` so that Supermann exits and is
+    restarted by Supervisor.
+    """
+
+    def __init__(self, instance, schedule):
+        """
+        :param supermann.core.Supermann instance: The instance to collect for
+        :param Schedule schedule: The schedule receivers are run on
+        """
+        super(Collector, self).__init__(name='supermann-collector')
+        self.daemon = True
+        self.log = supermann.utils.getLogger(self)
+        self.instance = instance
+        self.schedule = schedule
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.exc_info = None
+
+        #: The last event received from Supervisor
+        self.event = None
+
+        #: Processes that changed state since they were last reported
+        self.changed = list()
+        self.lock = threading.Lock()
+
+    def notify(self, event, changed=None):
+        """Records the last event received from Supervisor
+
+        :param event: An event received from Supervisor
+        :param str changed: The ``group:name`` of a process that changed
+            state, which wakes the thread to report it
+        """
+        self.event = event
+        if changed is not None:
+            with self.lock:
+                if changed not in self.changed:
+                    self.changed.append(changed)
+            self.wakeup.set()
+
+    def take_changed(self):
+        """Returns and clears the processes that changed state"""
+        with self.lock:
+            changed, self.changed = self.changed, list()
+        return changed
+
+    def run(self):
+        try:
+            next_run = 0
+            while not self.stopping.is_set():
+                self.wakeup.clear()
+                changed = self.take_changed()
+                if changed:
+                    self.instance.collect_state_changes(changed)
+                now = time.time()
+                if now >= next_run:
+                    self.instance.collect(self.event, now=now)
+                    next_run = self.schedule.next_run(now)
+                if not self.stopping.is_set():
+                    self.wakeup.wait(max(next_run - time.time(), 0))
+        except Exception:
+            self.exc_info = sys.exc_info()
+            self.log.error("Collector stopped:", exc_info=self.exc_info)
+
+    def check(self):
+        """Raises any exception that stopped the collector thread"""
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+    def stop(self):
+        """Stops the collector thread, waiting for it to finish"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,160 @@
+"""Chooses which metrics are collected for each program, and how often
+
+By default every process receiver runs for every program in every cycle.
+Each ``[process:{glob}]`` section in the config file sets the metrics
+collected for programs with names matching the glob, and the interval they
+are collected at::
+
+    [process:web-*]
+    metrics = cpu,mem,fds,state,uptime
+    interval = 5
+
+    [process:batch-*]
+    metrics = state,uptime
+
+The first section that matches a program is used. Programs are selected
+before their process trees are read, so a program that is not due, or whose
+metrics don't read ``/proc``, costs no ``/proc`` reads at all.
+"""
+
+from __future__ import absolute_import
+
+import fnmatch
+
+
+class Rule(object):
+    """The metrics collected for programs matching a glob"""
+
+    __slots__ = ['pattern', 'metrics', 'interval']
+
+    def __init__(self, pattern, metrics=None, interval=None):
+        """
+        :param str pattern: A glob matched against program names
+        :param metrics: The names of the process receivers to run (i.e.
+            ``cpu`` or ``state``), or None to run all of them
+        :param float interval: Seconds between collections, or None to
+            collect every cycle
+        """
+        self.pattern = pattern
+        self.metrics = None if metrics is None else frozenset(metrics)
+        self.interval = interval
+
+    def __repr__(self):
+        return "Rule({0!r}, {1!r}, {2!r})".format(
+            self.pattern, self.metrics and sorted(self.metrics), self.interval)
+
+    @classmethod
+    def from_items(cls, pattern, items):
+        """Creates a rule from the items in a ``[process:{glob}]`` section
+
+        ``metrics`` is a comma separated list of receiver names, and
+        ``interval`` is in seconds. An empty ``metrics`` collects nothing.
+        """
+        options = dict(items)
+        metrics = options.get('metrics')
+        if metrics is not None:
+            metrics = [m.strip() for m in metrics.split(',') if m.strip()]
+        interval = options.get('interval')
+        return cls(pattern, metrics, float(interval) if interval else None)
+
+    def receivers(self, receivers):
+        """Returns the receivers this rule selects"""
+        if self.metrics is None:
+            return receivers
+        return [r for r in receivers if r.__name__ in self.metrics]
+
+
+class Selection(object):
+    """The rules that choose the process receivers run for each program
+
+    The rule for each program name is cached, and the time each program was
+    last collected is kept to apply the rule's interval.
+    """
+
+    def __init__(self, rules=()):
+        """
+        :param rules: A list of :py:class:`Rule`, the first match is used
+        """
+        self.rules = list(rules)
+        self.matches = dict()
+        self.last = dict()
+
+    def __repr__(self):
+        return "Selection({0!r})".format(self.rules)
+
+    @classmethod
+    def from_config(cls, parser):
+        """Creates a selection from the ``[process:{glob}]`` config sections
+
+        :type parser: ConfigParser.ConfigParser
+        """
+        prefix = 'process:'
+        return cls(Rule.from_items(name[len(prefix):], parser.items(name))
+                   for name in parser.sections() if name.startswith(prefix))
+
+    def validate(self, receivers):
+        """Checks that each rule only names metrics that can be collected
+
+        :param list receivers: The receivers connected to the process signal
+        :raises ValueError: if a rule names a metric that is not a receiver
+        """
+        known = set(r.__name__ for r in receivers)
+        for rule in self.rules:
+            unknown = (rule.metrics or frozenset()) - known
+            if unknown:
+                raise ValueError("Unknown metrics {0} in [process:{1}], "
+                                 "expected {2}".format(
+                                     ', '.join(sorted(unknown)), rule.pattern,
+                                     ', '.join(sorted(known))))
+
+    def rule(self, name):
+        """Returns the first rule matching a program name, or None"""
+        try:
+            return self.matches[name]
+        except KeyError:
+            pass
+        for rule in self.rules:
+            if fnmatch.fnmatchcase(name, rule.pattern):
+                break
+        else:
+            rule = None
+        self.matches[name] = rule
+        return rule
+
+    def receivers(self, name, receivers):
+        """Returns the receivers selected for a program, ignoring intervals
+
+        :param str name: The program name
+        :param list receivers: The receivers connected to the process signal
+        """
+        rule = self.rule(name)
+        return receivers if rule is None else rule.receivers(receivers)
+
+    def select(self, name, receivers, now):
+        """Returns the receivers to run for a program in this cycle
+
+        The program is marked as collected if it is due.
+
+        :param str name: The program name
+        :param list receivers: The receivers due to run in this cycle
+        :param float now: The current time
+        :returns: A list of receivers, empty if the program is not due
+        """
+        rule = self.rule(name)
+        if rule is None:
+            return receivers
+        if rule.interval is not None:
+            last = self.last.get(name)
+            if last is not None and now - last < rule.interval:
+                return []
+            self.last[name] = now
+        return rule.receivers(receivers)
+
+    def forget(self, names):
+        """Drops the state kept for programs that are no longer running
+
+        :param names: Program names
+        """
+        for name in names:
+            self.matches.pop(name, None)
+            self.last.pop(name, None)
@@ -0,0 +1,115 @@
+"""Service names for each metric, declared once and cached
+
+Receivers used to format a service name such as
+``process:{name}:mem:rss:absolute`` for every process on every cycle, and
+outputs then split it up again to find the process name and field. Each
+metric is now declared once as a :py:class:`Metric`, which caches the
+:py:class:`Service` for each process name (or system device). A service is
+a ``str``, so it can be sent to any output, but also carries its
+``family``, ``process`` and ``field`` for outputs that need them.
+
+The cached services for a program are dropped with :py:meth:`Registry.forget`
+once it is no longer running under Supervisor.
+"""
+
+from __future__ import absolute_import
+
+
+class Service(str):
+    """A service name, with the parts that make it up
+
+    ``process:web:mem:rss:absolute`` has the family ``process``, the process
+    ``web`` and the field ``mem:rss:absolute``. ``system:cpu:percent`` has
+    the family ``system``, no process, and the field ``cpu:percent``.
+    """
+
+    def __new__(cls, name, family=None, process=None, field=None):
+        self = super(Service, cls).__new__(cls, name)
+        self.family = family
+        self.process = process
+        self.field = field
+        return self
+
+    def __getnewargs__(self):
+        return str(self), self.family, self.process, self.field
+
+
+class Metric(object):
+    """A metric in a family, and the service name for each key
+
+    For the ``process`` family the key is a program name. For the ``system``
+    family the key is formatted into the field, i.e. the device in
+    ``disk:{0}:read:bytes/s``, and is None for fields without one.
+    """
+
+    __slots__ = ['family', 'field', 'services']
+
+    def __init__(self, family, field):
+        """
+        :param str family: ``process`` or ``system``
+        :param str field: The rest of the service name
+        """
+        self.family = family
+        self.field = field
+        #: The cached service for each key
+        self.services = dict()
+
+    def __repr__(self):
+        return "Metric({0!r}, {1!r})".format(self.family, self.field)
+
+    def service(self, key=None):
+        """Returns the service for a program name or device
+
+        :rtype: Service
+        """
+        try:
+            return self.services[key]
+        except KeyError:
+            pass
+        if self.family == 'process':
+            service = Service('process:{0}:{1}'.format(key, self.field),
+                              self.family, key, self.field)
+        else:
+            field = self.field if key is None else self.field.format(key)
+            service = Service('{0}:{1}'.format(self.family, field),
+                              self.family, None, field)
+        self.services[key] = service
+        return service
+
+
+class Registry(object):
+    """The metrics declared by the receivers in :py:mod:`supermann.metrics`"""
+
+    def __init__(self):
+        self.metrics = list()
+
+    def metric(self, family, field):
+        """Declares a metric
+
+        :rtype: Metric
+        """
+        metric = Metric(family, field)
+        self.metrics.append(metric)
+        return metric
+
+    def process(self, field):
+        """Declares a metric reported for each program"""
+        return self.metric('process', field)
+
+    def system(self, field):
+        """Declares a metric reported for the system"""
+        return self.metric('system', field)
+
+    def forget(self, names):
+        """Drops the cached services for programs that are no longer running
+
+        :param names: Program names
+        """
+        for metric in self.metrics:
+            if metric.family == 'process':
+                for name in names:
+                    metric.services.pop(name, None)
+
+
+#: The registry used by the receivers in :py:mod:`supermann.metrics`
+registry = Registry()
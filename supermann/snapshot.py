@@ -0,0 +1,207 @@
+"""Per-cycle snapshots of the processes running under Supervisor
+
+Process receivers used to each walk a process tree and make their own psutil
+calls, reading the same files in ``/proc`` several times per event. A
+:py:class:`ProcessSnapshot` reads a process tree once, and the receivers in
+:py:mod:`supermann.metrics.process` report values from the snapshot.
+"""
+
+from __future__ import absolute_import, division
+
+import contextlib
+
+import psutil
+
+
+@contextlib.contextmanager
+def nothing():
+    """A context manager that does nothing"""
+    yield
+
+
+def oneshot(process):
+    """Caches ``/proc`` reads for a process, if psutil supports it
+
+    :param psutil.Process process: The process to read
+    :returns: ``process.oneshot()``, or a no-op context on older psutils
+    """
+    return process.oneshot() if hasattr(process, 'oneshot') else nothing()
+
+
+_total_memory = None
+
+
+def total_memory():
+    """Returns the total physical memory, read once and then cached
+
+    :returns: (*int*) Total physical memory in bytes
+    """
+    global _total_memory
+    if _total_memory is None:
+        _total_memory = psutil.virtual_memory().total
+    return _total_memory
+
+
+def get_nofile_limit(pid):
+    """Returns the NOFILE limit for a given PID
+
+    ``/proc`` is read from ``psutil.PROCFS_PATH`` if psutil sets it.
+
+    :param int pid: The PID of the process
+    :returns: (*int*) The NOFILE limit
+    """
+    proc = getattr(psutil, 'PROCFS_PATH', '/proc')
+    with open('%s/%s/limits' % (proc, pid), 'r') as f:
+        for line in f:
+            if line.startswith('Max open files'):
+                return int(line.split()[4])
+    raise RuntimeError('Could not find "Max open files" limit')
+
+
+class ProcessSnapshot(object):
+    """Metrics for a process and its children, read once per cycle
+
+    CPU, memory and file descriptor values are the sum over the process and
+    its children. ``cpu_percent`` is set afterwards by a
+    :py:class:`CpuTracker`, from the CPU times of the whole tree. IO counters
+    and the NOFILE limit are only read for the process itself. ``io_read``
+    and ``io_write`` are ``None`` if ``/proc/[pid]/io`` could not be read.
+    """
+
+    __slots__ = [
+        'pid', 'cpu_percent', 'cpu_time', 'cpu_times', 'vms', 'rss',
+        'mem_percent', 'num_fds', 'nofile', 'io_read', 'io_write']
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.cpu_percent = 0.0
+        self.cpu_time = 0.0
+        #: CPU seconds used by each process in the tree, keyed by
+        #: ``(pid, create_time)``
+        self.cpu_times = dict()
+        self.vms = 0
+        self.rss = 0
+        self.mem_percent = 0.0
+        self.num_fds = 0
+        self.nofile = None
+        self.io_read = None
+        self.io_write = None
+
+    def __repr__(self):
+        return "ProcessSnapshot(pid={0}, cpu={1}, rss={2}, fds={3})".format(
+            self.pid, self.cpu_percent, self.rss, self.num_fds)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def fds_percent(self):
+        """File descriptors in use as a percentage of the NOFILE limit"""
+        return (self.num_fds / self.nofile) * 100
+
+    @classmethod
+    def collect(cls, process, children=None):
+        """Reads a process tree into a new snapshot
+
+        Children that exit while the tree is being read are skipped, but
+        errors reading the process itself are raised.
+
+        :param psutil.Process process: The root of the process tree
+        :param list children: Child processes, found with
+            ``process.children()`` if not given
+        :rtype: ProcessSnapshot
+        """
+        snapshot = cls(process.pid)
+
+        with oneshot(process):
+            snapshot.add(process)
+            try:
+                io_counters = process.io_counters()
+            except psutil.AccessDenied:
+                pass
+            else:
+                snapshot.io_read = io_counters.read_bytes
+                snapshot.io_write = io_counters.write_bytes
+            if children is None:
+                children = process.children()
+        snapshot.nofile = get_nofile_limit(process.pid)
+
+        for child in children:
+            try:
+                with oneshot(child):
+                    snapshot.add(child)
+            except psutil.NoSuchProcess:
+                pass
+
+        return snapshot
+
+    def add(self, process):
+        """Adds the values for a single process to the snapshot
+
+        :param psutil.Process process: A process in the snapshot's tree
+        """
+        memory_info = process.memory_info()
+        cpu_time = sum(process.cpu_times())
+        self.cpu_time += cpu_time
+        self.cpu_times[(process.pid, process.create_time())] = cpu_time
+        self.vms += memory_info.vms
+        self.rss += memory_info.rss
+        self.mem_percent += (memory_info.rss / total_memory()) * 100
+        self.num_fds += process.num_fds()
+
+
+class CpuTracker(object):
+    """Computes CPU utilisation from the CPU times in successive snapshots
+
+    ``psutil.Process.cpu_percent`` keeps its state on each ``Process``
+    object, so it only works for processes that are read through the same
+    object every cycle, and it makes another ``/proc`` read. This keeps the
+    CPU time of each process in a tree between cycles instead, keyed by
+    ``(pid, create_time)``, and uses the same formula: the CPU time used
+    since the last cycle as a percentage of the time that has passed.
+    Processes seen for the first time count as 0, and processes that have
+    not been seen for a cycle are forgotten by :py:meth:`expire`, unless
+    their tree was skipped in that cycle.
+    """
+
+    def __init__(self):
+        self.last = dict()
+        self.current = dict()
+
+        #: The keys of the processes in each tree, by the PID of its root
+        self.trees = dict()
+
+    def expire(self, keep=()):
+        """Starts a new cycle, forgetting processes not seen in the last
+
+        :param keep: The root PIDs of trees that will not be read in this
+            cycle, whose CPU times are kept until they are next read
+        """
+        self.last, self.current = self.current, dict()
+        trees, self.trees = self.trees, dict()
+        for pid in keep:
+            if pid in trees:
+                self.trees[pid] = trees[pid]
+                for key in trees[pid]:
+                    if key in self.last:
+                        self.current[key] = self.last[key]
+
+    def update(self, snapshot, now):
+        """Sets ``cpu_percent`` on a snapshot
+
+        :param ProcessSnapshot snapshot: A snapshot read in this cycle
+        :param float now: The time the snapshot was read
+        """
+        used = elapsed = 0.0
+        for key, cpu_time in snapshot.cpu_times.items():
+            last = self.last.get(key)
+            if last is not None and cpu_time >= last[0]:
+                used += cpu_time - last[0]
+                elapsed = max(elapsed, now - last[1])
+            self.current[key] = (cpu_time, now)
+        self.trees[snapshot.pid] = list(snapshot.cpu_times)
+        snapshot.cpu_percent = (used / elapsed) * 100 if elapsed else 0.0
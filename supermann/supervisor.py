@@ -2,23 +2,154 @@
 
 from __future__ import absolute_import
 
+import errno
+import functools
+import httplib
 import os
+import socket
 import sys
+import threading
+import time
+import xmlrpclib
 
 import supervisor.childutils
+import supervisor.states
 
 import supermann.utils
 import supermann.signals
 
 
+def parse(line):
+    """Parses a Supervisor header or payload line
+
+    Tokens are split on the first ``:`` only, so values may contain ``:``.
+
+    :param str line: A line from a Supervisor message
+    :returns: A dictionary containing the header or payload
+    """
+    data = dict()
+    for token in line.split():
+        key, _, value = token.partition(':')
+        data[key] = value
+    return data
+
+
 class Event(object):
-    """An event recived from Supervisor"""
+    """An event recived from Supervisor
+
+    The payload can be given as the raw string read from Supervisor, in which
+    case it is only parsed the first time it is used. Most events are
+    ``TICK`` events that no receiver reads the payload of.
+    """
 
-    __slots__ = ['headers', 'payload']
+    __slots__ = ['headers', '_payload', 'raw']
 
     def __init__(self, headers, payload):
+        """
+        :param dict headers: The parsed event headers
+        :param payload: The parsed payload, or the raw payload as a str
+        """
         self.headers = headers
-        self.payload = payload
+        if isinstance(payload, dict):
+            self._payload, self.raw = payload, None
+        else:
+            self._payload, self.raw = None, payload
+
+    @property
+    def payload(self):
+        """The payload tokens on the first line of the event payload"""
+        if self._payload is None:
+            self._payload = parse(self.raw.split('\n', 1)[0])
+        return self._payload
+
+    @property
+    def body(self):
+        """The data following the first line of the payload, if any
+
+        ``PROCESS_LOG`` and ``PROCESS_COMMUNICATION`` events carry data here.
+        """
+        if self.raw is None:
+            return ''
+        return self.raw.partition('\n')[2]
+
+
+class ProtocolReader(object):
+    """Reads Supervisor messages from a stream with an internal buffer
+
+    If the stream has a file descriptor, it is read directly with
+    ``os.read``, bypassing the file object, and any partial reads are
+    buffered until a whole line or payload is available. Lines and payloads
+    are sliced out of the buffer at an offset, so the buffer is only copied
+    when more data is read.
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        """
+        :param file stream: The stream to read from, usually STDIN
+        :param int chunk_size: The most bytes to read at once
+        """
+        # The stream is referenced so its file descriptor stays open
+        self.stream = stream
+        try:
+            self._read = functools.partial(os.read, stream.fileno())
+        except (AttributeError, IOError, ValueError):
+            self._read = stream.read
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.offset = 0
+
+    def fill(self):
+        """Reads the next chunk from the stream into the buffer
+
+        Reads interrupted by a signal (i.e. ``SIGUSR1`` from the profiler)
+        are retried.
+
+        :raises EOFError: if the stream has been closed
+        """
+        while True:
+            try:
+                data = self._read(self.chunk_size)
+            except EnvironmentError as exception:
+                if exception.errno != errno.EINTR:
+                    raise
+            else:
+                break
+        if not data:
+            raise EOFError("Supervisor closed the event stream")
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+
+    def readline(self):
+        """Returns the next line, without the trailing newline"""
+        index = self.buffer.find(b'\n', self.offset)
+        while index < 0:
+            start = len(self.buffer) - self.offset
+            self.fill()
+            index = self.buffer.find(b'\n', start)
+        line = self.buffer[self.offset:index]
+        self.offset = index + 1
+        return line
+
+    def read(self, size):
+        """Returns exactly ``size`` bytes"""
+        while len(self.buffer) - self.offset < size:
+            self.fill()
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def wait(self):
+        """Reads the next event
+
+        :returns: An :py:class:`.Event` with a payload that is parsed lazily
+        """
+        line = self.readline()
+        while not line:
+            line = self.readline()
+        headers = parse(line)
+        # Event names come from a small set, and are compared by receivers
+        headers['eventname'] = intern(headers['eventname'])
+        return Event(headers, self.read(int(headers.pop('len'))))
 
 
 class EventListener(object):
@@ -40,6 +171,7 @@ class EventListener(object):
 
         self.stdin = stdin
         self.stdout = stdout
+        self.reader = ProtocolReader(stdin)
 
         # As stdin/stdout are used to communicate with Supervisor,
         # reserve them by replacing the sys attributes with None
@@ -50,14 +182,8 @@ class EventListener(object):
             sys.stdout = None
             self.log.debug("Supervisor listener has reserved STDOUT")
 
-    @staticmethod
-    def parse(line):
-        """Parses a Supervisor header or payload
-
-        :param str line: A line from a Supervisor message
-        :returns: A dictionary containing the header or payload
-        """
-        return dict([pair.split(':') for pair in line.split()])
+    #: Parses a Supervisor header or payload, see :py:func:`.parse`
+    parse = staticmethod(parse)
 
     def ready(self):
         """Writes and flushes the READY symbol to stdout"""
@@ -83,16 +209,258 @@ class EventListener(object):
 
         :returns: An :py:class:`.Event` containing the headers and payload
         """
-        headers = self.parse(self.stdin.readline())
-        payload = self.parse(self.stdin.read(int(headers.pop('len'))))
-        self.log.debug("Received %s from supervisor", headers['eventname'])
-        return Event(headers, payload)
+        event = self.reader.wait()
+        self.log.debug("Received %s from supervisor", event.headers['eventname'])
+        return event
+
+
+class RPCClient(object):
+    """Calls the Supervisor XML-RPC interface over a persistent connection
+
+    The transport used by :py:func:`supervisor.childutils.getRPCInterface`
+    keeps its connection open between requests. If a request fails because
+    the connection was closed, the connection is reopened and the request is
+    sent again once.
+    """
+
+    errors = (socket.error, httplib.HTTPException, xmlrpclib.ProtocolError)
+
+    def __init__(self, interface):
+        """
+        :param xmlrpclib.ServerProxy interface: The Supervisor interface
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.interface = interface
+
+        #: If set to a :py:class:`supermann.telemetry.Telemetry`, each call
+        #: is timed
+        self.telemetry = None
+
+    def call(self, method, *args):
+        """Calls an XML-RPC method, reconnecting if the connection failed
+
+        :param str method: The full method name, i.e. ``supervisor.getPID``
+        """
+        if self.telemetry is None:
+            return self._call(method, *args)
+        with self.telemetry.timer('rpc:' + method):
+            return self._call(method, *args)
+
+    def _call(self, method, *args):
+        function = self.interface
+        for name in method.split('.'):
+            function = getattr(function, name)
+        try:
+            return function(*args)
+        except self.errors as e:
+            self.log.info("Supervisor XML-RPC call failed ({0}), "
+                          "reconnecting".format(e))
+            self.close()
+            return function(*args)
+
+    def multicall(self, calls):
+        """Sends several calls in a single ``system.multicall`` request
+
+        :param list calls: ``(method, args)`` pairs
+        :returns: A list with the result of each call, or an
+            ``xmlrpclib.Fault`` for each call that failed
+        """
+        if not calls:
+            return []
+        results = self.call('system.multicall', [
+            dict(methodName=method, params=list(args))
+            for method, args in calls])
+        return [xmlrpclib.Fault(r['faultCode'], r['faultString'])
+                if isinstance(r, dict) else r[0] for r in results]
+
+    def close(self):
+        """Closes the connection, which is reopened by the next call"""
+        try:
+            self.interface('close')()
+        except (AttributeError, KeyError, TypeError):
+            pass
+
+
+class ProcessInfoCache(object):
+    """A table of the process info returned by Supervisor
+
+    The table is kept up to date from the payloads of ``PROCESS_STATE``
+    events, which carry the new state of a process and its PID, so no
+    XML-RPC calls are made when a process changes state. ``getAllProcessInfo``
+    is only called every ``ttl`` seconds, to reconcile the table with
+    Supervisor. Processes named in an event but missing from the table are
+    fetched with a single ``system.multicall`` of ``getProcessInfo`` the next
+    time the table is read. The ``now`` value of each process is advanced by
+    the time since it was updated, so uptimes stay correct in between.
+
+    XML-RPC calls are made without holding the lock that :py:meth:`update`
+    takes, so acknowledging an event is never delayed by a refresh. Events
+    applied while a refresh is in progress are kept over the info it
+    fetched, as they may be newer.
+    """
+
+    #: The Supervisor fault code for a process that doesn't exist
+    BAD_NAME = 10
+
+    #: States in which a process is not running and has no PID
+    STOPPED_STATES = ('STOPPED', 'EXITED', 'FATAL', 'BACKOFF')
+
+    def __init__(self, client, ttl=300.0):
+        """
+        :param RPCClient client: The client used to fetch process info
+        :param float ttl: Seconds before all process info is fetched again
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.client = client
+        self.ttl = ttl
+
+        #: Held while the table is read or changed
+        self.lock = threading.Lock()
+        #: Held while the table is refreshed, so only one thread refreshes it
+        self.refreshing = threading.Lock()
+        self.processes = dict()
+        self.order = list()
+        self.fetched_at = dict()
+        self.refreshed_at = None
+        self.stale = set()
+        self.changed = set()
+
+    @staticmethod
+    def key(info):
+        """Returns the name Supervisor uses to refer to a process"""
+        return '{0}:{1}'.format(info['group'], info['name'])
+
+    def update(self, event, now=None):
+        """Updates the table from an event received from Supervisor
+
+        Events that add or remove process groups expire the whole table.
+
+        :param Event event: An event received from Supervisor
+        :param float now: The current time
+        :returns: The name of the process a ``PROCESS_STATE`` event is
+            about, or None for other events
+        """
+        eventname = event.headers.get('eventname', '')
+        now = time.time() if now is None else now
+        with self.lock:
+            if eventname.startswith('PROCESS_STATE_'):
+                name = '{0}:{1}'.format(
+                    event.payload['groupname'], event.payload['processname'])
+                if name in self.processes:
+                    self.apply(name, eventname[len('PROCESS_STATE_'):],
+                               event.payload, now)
+                else:
+                    self.stale.add(name)
+                return name
+            elif eventname.startswith('PROCESS_GROUP'):
+                self.refreshed_at = None
+        return None
+
+    def mark_stale(self, name):
+        """Fetches the info for a process again the next time it is read
+
+        :param str name: The ``group:name`` of the process
+        """
+        with self.lock:
+            self.stale.add(name)
+
+    def apply(self, name, statename, payload, now):
+        """Applies a state change to the info for a process"""
+        info = self.processes[name]
+        info['statename'] = statename
+        info['state'] = getattr(
+            supervisor.states.ProcessStates, statename, info.get('state'))
+        if statename == 'RUNNING':
+            info['pid'] = int(payload.get('pid', info['pid']))
+        elif statename == 'STARTING':
+            info['start'] = int(now)
+        elif statename in self.STOPPED_STATES:
+            info['pid'] = 0
+            info['stop'] = int(now)
+        info['now'] = int(now)
+        self.fetched_at[name] = now
+        self.changed.add(name)
+
+    def refresh_all(self, now, stale=()):
+        """Replaces the cache with the info for every process
+
+        :param stale: The names that were stale when the refresh started
+        """
+        processes = self.client.call('supervisor.getAllProcessInfo')
+        with self.lock:
+            previous, fetched_at = self.processes, self.fetched_at
+            self.order = [self.key(info) for info in processes]
+            self.processes = dict(zip(self.order, processes))
+            self.fetched_at = dict.fromkeys(self.order, now)
+            for name in self.changed & set(self.processes) & set(previous):
+                self.processes[name] = previous[name]
+                self.fetched_at[name] = fetched_at[name]
+            self.refreshed_at = now
+            self.stale.difference_update(stale)
+
+    def refresh(self, names, now):
+        """Fetches the info for some processes in a single request"""
+        names = sorted(names)
+        results = self.client.multicall([
+            ('supervisor.getProcessInfo', (name,)) for name in names])
+        with self.lock:
+            for name, info in zip(names, results):
+                if isinstance(info, xmlrpclib.Fault):
+                    if info.faultCode != self.BAD_NAME:
+                        raise info
+                    self.remove(name)
+                    continue
+                if name in self.changed:
+                    continue
+                if name not in self.processes:
+                    self.order.append(name)
+                self.processes[name] = info
+                self.fetched_at[name] = now
+            self.stale.difference_update(names)
+
+    def remove(self, name):
+        """Removes a process that no longer exists from the cache"""
+        if name in self.processes:
+            del self.processes[name]
+            del self.fetched_at[name]
+            self.order.remove(name)
+
+    def get(self, now=None):
+        """Returns the info for each process, refreshing it if needed
+
+        :param float now: The current time
+        :returns: A list of new process info dicts
+        """
+        now = time.time() if now is None else now
+        with self.refreshing:
+            with self.lock:
+                expired = (self.refreshed_at is None or
+                           now - self.refreshed_at >= self.ttl)
+                stale = set(self.stale)
+                self.changed.clear()
+            if expired:
+                self.refresh_all(now, stale)
+            elif stale:
+                self.refresh(stale, now)
+
+        with self.lock:
+            processes = list()
+            for name in self.order:
+                info = dict(self.processes[name])
+                if 'now' in info:
+                    info['now'] += int(now - self.fetched_at[name])
+                processes.append(info)
+            return processes
 
 
 class Supervisor(object):
     """Contains the Supervisor event listener and XML-RPC interface"""
 
-    def __init__(self):
+    def __init__(self, process_info_ttl=300.0):
+        """
+        :param float process_info_ttl: Seconds before the info for all
+            processes is fetched again, see :py:class:`.ProcessInfoCache`
+        """
         self.log = supermann.utils.getLogger(self)
 
         try:
@@ -103,12 +471,37 @@ class Supervisor(object):
 
         self.listener = EventListener()
         self.interface = supervisor.childutils.getRPCInterface(os.environ)
+        self.client = RPCClient(self.interface)
+        self.processes = ProcessInfoCache(self.client, process_info_ttl)
 
     @property
     def rpc(self):
         """Returns the 'supervisor' namespace of the XML-RPC interface"""
         return self.interface.supervisor
 
+    def process_info(self):
+        """Returns the info for each process, from the cache if it is fresh
+
+        :returns: A list of dicts in the format of ``getAllProcessInfo``
+        """
+        return self.processes.get()
+
+    def update_processes(self, event):
+        """Updates the process table from an event
+
+        :param Event event: An event received from Supervisor
+        :returns: The ``group:name`` of the process that changed state, or
+            None if the event is not a ``PROCESS_STATE`` event
+        """
+        return self.processes.update(event)
+
+    def mark_stale(self, name):
+        """Fetches the info for a process again the next time it is read
+
+        :param str name: The ``group:name`` of the process
+        """
+        self.processes.mark_stale(name)
+
     def run_forever(self):
         """Yields events from Supervisor, managing the OK and READY signals
 
@@ -0,0 +1,201 @@
+"""Measures how long each stage of a cycle takes, and reports it as metrics
+
+When a :py:class:`Telemetry` instance is set on a
+:py:class:`supermann.core.Supermann` instance with
+:py:meth:`supermann.core.Supermann.instrument`, each receiver call, each
+Supervisor XML-RPC call, the snapshot stage, each cycle and each flush are
+timed with a monotonic clock. The output is wrapped in a
+:py:class:`supermann.outputs.telemetry.TelemetryOutput`, which counts the
+events sent and reports the timings as ``supermann:*`` metrics before each
+flush.
+
+A :py:class:`Profiler` can also be started with the ``--profile`` option,
+which writes ``cProfile`` stats to a file when Supermann receives
+``SIGUSR1``.
+"""
+
+from __future__ import absolute_import
+
+import array
+import contextlib
+import cProfile
+import signal
+import threading
+
+import supermann.utils
+from supermann.outputs.aggregate import percentile
+
+
+class Timer(object):
+    """The last durations measured for one stage, in a ring buffer"""
+
+    __slots__ = ['durations', 'index', 'count', 'last']
+
+    def __init__(self, size):
+        self.durations = array.array('d', [0.0]) * size
+        self.index = 0
+        self.count = 0
+        self.last = 0.0
+
+    def add(self, duration):
+        self.durations[self.index] = duration
+        self.index = (self.index + 1) % len(self.durations)
+        self.count = min(self.count + 1, len(self.durations))
+        self.last = duration
+
+    def percentile(self, percent):
+        """Returns a percentile of the durations, in seconds"""
+        return percentile(self.durations[:self.count], percent)
+
+
+class Telemetry(object):
+    """Timers and counters describing Supermann itself
+
+    Enabled by adding a ``[telemetry]`` section to the config file.
+    """
+
+    def __init__(self, window=100):
+        """
+        :param int window: The number of durations kept for each timer
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.window = window
+        self.lock = threading.Lock()
+
+        #: Timers by name, i.e. ``receiver:process.cpu`` or ``tick``
+        self.timers = dict()
+
+        #: The number of events sent since the last report
+        self.events = 0
+
+    def __repr__(self):
+        return "Telemetry(window={0})".format(self.window)
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates an instance from the items in a config section"""
+        options = dict(items)
+        return cls(window=int(options.get('window', 100)))
+
+    def record(self, name, duration):
+        """Adds a duration in seconds to a timer"""
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer(self.window)
+            timer.add(duration)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Times the body of a ``with`` statement"""
+        start = supermann.utils.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, supermann.utils.monotonic() - start)
+
+    @staticmethod
+    def receiver_key(receiver):
+        """Returns the timer name for a receiver, i.e. ``receiver:process.cpu``"""
+        module = getattr(receiver, '__module__', None) or ''
+        return 'receiver:{0}.{1}'.format(
+            module.rsplit('.', 1)[-1], receiver.__name__)
+
+    def count(self, events=1):
+        with self.lock:
+            self.events += events
+
+    def report(self, output, bytes_sent=None, background=()):
+        """Sends the telemetry metrics to an output
+
+        - ``supermann:tick:events``
+        - ``supermann:tick:duration``
+        - ``supermann:flush:latency``
+        - ``supermann:flush:bytes``
+        - ``supermann:enqueue:latency``
+        - ``supermann:background:{counter}``
+        - ``supermann:{timer}:p50``
+        - ``supermann:{timer}:p99``
+
+        :param output: The output to send events to
+        :param int bytes_sent: The bytes sent by the output since the last
+            report, if the output counts them
+        :param list background: ``(name, counters)`` tuples for each
+            background output, where the name is None if there is only one.
+            The flush latency is the slowest of their last flushes.
+        """
+        with self.lock:
+            events, self.events = self.events, 0
+            timers = sorted(
+                (name, timer.last, timer.percentile(50), timer.percentile(99))
+                for name, timer in self.timers.items())
+
+        output.event(service='supermann:tick:events', metric_f=events)
+        if bytes_sent is not None:
+            output.event(service='supermann:flush:bytes', metric_f=bytes_sent)
+        for name, counters in background:
+            prefix = 'supermann:background'
+            if name is not None:
+                prefix = '{0}:{1}'.format(prefix, name)
+            for counter, value in sorted(counters.items()):
+                output.event(service='{0}:{1}'.format(prefix, counter),
+                             metric_f=value)
+        if background:
+            output.event(service='supermann:flush:latency', metric_f=max(
+                counters['flush_latency'] for _, counters in background))
+        for name, last, p50, p99 in timers:
+            if name == 'tick':
+                output.event(service='supermann:tick:duration', metric_f=last)
+            elif name in ('flush', 'enqueue'):
+                output.event(service='supermann:{0}:latency'.format(name),
+                             metric_f=last)
+            output.event(
+                service='supermann:{0}:p50'.format(name), metric_f=p50)
+            output.event(
+                service='supermann:{0}:p99'.format(name), metric_f=p99)
+
+
+class Profiler(object):
+    """Profiles Supermann, and writes the stats to a file on ``SIGUSR1``
+
+    ``cProfile`` only profiles the thread it is started in, so receivers
+    run by a :py:class:`supermann.runtime.Runtime` or a
+    :py:class:`supermann.scheduler.Collector` are not included.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: The file the stats are written to, which can be read
+            with the ``pstats`` module
+        """
+        self.log = supermann.utils.getLogger(self)
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def __repr__(self):
+        return "Profiler({0!r})".format(self.path)
+
+    def start(self):
+        """Starts profiling, and handles ``SIGUSR1``
+
+        System calls interrupted by the signal are restarted, so that reads
+        from Supervisor are not interrupted by a dump.
+        """
+        signal.signal(signal.SIGUSR1, self.dump)
+        signal.siginterrupt(signal.SIGUSR1, False)
+        self.profile.enable()
+        self.log.info("Profiling, send SIGUSR1 to write stats to {0}".format(
+            self.path))
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, signum=None, frame=None):
+        """Writes the stats collected so far to the file
+
+        Creating the stats disables the profiler, so it is enabled again to
+        keep profiling after the dump.
+        """
+        self.profile.dump_stats(self.path)
+        self.profile.enable()
+        self.log.info("Wrote profile stats to {0}".format(self.path))
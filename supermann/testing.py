@@ -0,0 +1,264 @@
+"""Fake outputs and servers shared by the tests and the benchmarks
+
+- :py:class:`ListOutput` keeps the events it is sent in a list.
+- :py:class:`FakeRiemann` and :py:class:`FakeInflux` accept events sent by
+  the Riemann and InfluxDB line protocol outputs.
+- :py:class:`FakeSupervisor` serves the Supervisor XML-RPC methods that
+  Supermann calls.
+
+Each server runs in a background thread from when it is created until
+:py:meth:`Sink.stop` or ``stop()`` is called.
+"""
+
+from __future__ import absolute_import
+
+import BaseHTTPServer
+import SimpleXMLRPCServer
+import socket
+import SocketServer
+import struct
+import threading
+import time
+import xmlrpclib
+import zlib
+
+import riemann_client.riemann_pb2
+import supervisor.xmlrpc
+
+import supermann.supervisor
+from supermann.outputs.base import BaseOutput
+
+
+class ListOutput(BaseOutput):
+    """An output that saves flushed events in a list"""
+    section_name = "list"
+
+    def __init__(self, failures=0):
+        """
+        :param int failures: The number of flushes that fail before one
+            succeeds
+        """
+        super(ListOutput, self).__init__()
+        self.failures = failures
+        self.bulk = []
+        self.flushed = []
+
+    def init(self, **params):
+        pass
+
+    def event(self, **data):
+        self.bulk.append(data)
+
+    def flush(self):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("Backend unavailable")
+        self.flushed.extend(self.bulk)
+        self.bulk = []
+
+    def clear(self):
+        self.bulk = []
+
+
+def wait_for(condition, timeout=5):
+    """Waits for a condition to be true, and returns its last value"""
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class Sink(object):
+    """Counts the events received by a server, and keeps them if recording
+
+    Benchmarks only count events, so that keeping them does not change the
+    memory used by the process being measured.
+    """
+
+    def __init__(self, record=True):
+        self.record = record
+        self.received_events = 0
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, events, size):
+        with self.lock:
+            self.received_events += events
+            self.received_bytes += size
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeRiemannHandler(SocketServer.BaseRequestHandler):
+    """Reads length-prefixed protobuf messages and acknowledges them"""
+
+    def handle(self):
+        self.server.connections.append(self.request)
+        while True:
+            try:
+                header = self.request.recv(4)
+            except socket.error:
+                # TLS connections can be closed without a close_notify
+                return
+            if len(header) < 4:
+                return
+            length = struct.unpack('!I', header)[0]
+            data = b''
+            while len(data) < length:
+                data += self.request.recv(length - len(data))
+            message = riemann_client.riemann_pb2.Msg()
+            message.ParseFromString(data)
+            self.server.count(len(message.events), length)
+            if self.server.record:
+                self.server.messages.append(message)
+            response = riemann_client.riemann_pb2.Msg(ok=True)
+            response = response.SerializeToString()
+            self.request.sendall(struct.pack('!I', len(response)) + response)
+
+
+class FakeRiemann(Sink, SocketServer.ThreadingTCPServer):
+    """A Riemann server that records the messages it receives"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, record=True):
+        SocketServer.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', port), FakeRiemannHandler)
+        self.messages = []
+        self.connections = []
+        Sink.__init__(self, record)
+
+    @property
+    def events(self):
+        return [e.service for m in self.messages for e in m.events]
+
+    def drop_connections(self):
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            connection.close()
+        self.connections = []
+
+    def stop(self):
+        Sink.stop(self)
+        self.drop_connections()
+
+
+class FakeInfluxHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Accepts chunked line protocol writes"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        assert self.headers.get('Transfer-Encoding') == 'chunked'
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if size == 0:
+                break
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.count(body.count(b'\n'), len(body))
+        if self.server.record:
+            self.server.writes.append((self.path, body))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeInflux(Sink, BaseHTTPServer.HTTPServer):
+    """An InfluxDB server that records the writes it receives"""
+
+    def __init__(self, record=True):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), FakeInfluxHandler)
+        self.writes = []
+        self.status = 204
+        Sink.__init__(self, record)
+
+    @property
+    def lines(self):
+        return [l for _, body in self.writes for l in body.splitlines()]
+
+
+class FakeSupervisorHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    """Keeps connections open, like supervisord's HTTP server"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.setup(self)
+        self.server.connections += 1
+
+
+class FakeSupervisor(SocketServer.ThreadingMixIn,
+                     SimpleXMLRPCServer.SimpleXMLRPCServer):
+    """A Supervisor XML-RPC server with a fixed set of processes"""
+    daemon_threads = True
+
+    def __init__(self, processes=None):
+        """
+        :param list processes: The process info for each program, in the
+            form returned by ``getProcessInfo``
+        """
+        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(
+            self, ('127.0.0.1', 0), FakeSupervisorHandler, logRequests=False,
+            allow_none=True)
+        self.connections = 0
+        self.calls = []
+        self.processes = processes if processes is not None else [
+            dict(group='web', name='web_0', pid=10, statename='RUNNING',
+                 start=100, stop=0, now=200),
+            dict(group='cat', name='cat', pid=0, statename='STOPPED',
+                 start=100, stop=150, now=200),
+        ]
+        self.register_function(self.getAllProcessInfo,
+                               'supervisor.getAllProcessInfo')
+        self.register_function(self.getProcessInfo,
+                               'supervisor.getProcessInfo')
+        self.register_multicall_functions()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def info(self, data):
+        """Returns the info sent for a process"""
+        return data
+
+    def getAllProcessInfo(self):
+        self.calls.append('getAllProcessInfo')
+        return [self.info(info) for info in self.processes]
+
+    def getProcessInfo(self, name):
+        self.calls.append('getProcessInfo')
+        for info in self.processes:
+            if '{0}:{1}'.format(info['group'], info['name']) == name:
+                return self.info(info)
+        raise xmlrpclib.Fault(10, 'BAD_NAME: {0}'.format(name))
+
+    def client(self):
+        transport = supervisor.xmlrpc.SupervisorTransport(serverurl=self.url)
+        return supermann.supervisor.RPCClient(
+            xmlrpclib.ServerProxy('http://127.0.0.1', transport))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+
+from supermann.batch import MetricBatch
+from supermann.testing import ListOutput
+
+
+EVENTS = [
+    dict(service='a', metric_f=1),
+    dict(service='b', state='running'),
+    dict(service='c', metric_f=2.5, time=10.0),
+    dict(service='d', metric_f=3.0, tags=['x'], ttl=60),
+]
+
+
+class TestMetricBatch(object):
+    def test_columns(self):
+        batch = MetricBatch()
+        batch.add('a', 1)
+        batch.add('b', state='running')
+        assert len(batch) == 2
+        assert batch.services == ['a', 'b']
+        assert batch.values == [1, None]
+        assert batch.states == [None, 'running']
+        assert list(batch.rows()) == [('a', 1, None), ('b', None, 'running')]
+
+    def test_events(self):
+        batch = MetricBatch.from_events(EVENTS)
+        assert list(batch) == EVENTS
+        assert batch[-1] == EVENTS[-1]
+        assert batch.extra == {3: dict(tags=['x'], ttl=60)}
+
+    def test_extend(self):
+        batch = MetricBatch.from_events(EVENTS[:2])
+        batch.extend(MetricBatch.from_events(EVENTS[2:]))
+        assert list(batch) == EVENTS
+
+    def test_stamp(self):
+        batch = MetricBatch.from_events(EVENTS)
+        batch.stamp(20.0)
+        assert batch.times == [20.0, 20.0, 10.0, 20.0]
+
+    def test_clear(self):
+        batch = MetricBatch.from_events(EVENTS)
+        batch.clear()
+        assert len(batch) == 0
+        assert list(batch) == []
+        assert not batch.extra
+
+
+def test_event_batch_shim():
+    # Outputs that only implement event() are sent each metric in turn
+    output = ListOutput()
+    output.event_batch(MetricBatch.from_events(EVENTS))
+    assert output.bulk == EVENTS
@@ -63,6 +63,31 @@ class TestCLI(object):
         main(['--log-level', 'WARNING'])
         configure_logging.assert_called_with('WARNING')
 
+    @mock.patch('supermann.telemetry.Profiler', autospec=True)
+    def test_profile(self, profiler_cls, supermann_cls):
+        main(['--profile', 'supermann.prof'])
+        profiler_cls.assert_called_with('supermann.prof')
+        assert profiler_cls.return_value.start.called
+
+    def test_telemetry(self, supermann_cls, tmpdir):
+        config = tmpdir.join('supermann.ini')
+        config.write('[supermann]\noutput_class = supermann.outputs.debug.DebugOutput\n'
+                     '[telemetry]\nwindow = 10\n')
+        main([str(config)], command=supermann.cli.from_config)
+        telemetry = supermann_cls.return_value.instrument.call_args[0][0]
+        assert telemetry.window == 10
+
+    def test_selection(self, supermann_cls, tmpdir):
+        config = tmpdir.join('supermann.ini')
+        config.write('[supermann]\noutput_class = supermann.outputs.debug.DebugOutput\n'
+                     '[process:web-*]\nmetrics = cpu, mem\ninterval = 5\n'
+                     '[process:*]\nmetrics = state\n')
+        main([str(config)], command=supermann.cli.from_config)
+        selection = supermann_cls.return_value.selection
+        assert [r.pattern for r in selection.rules] == ['web-*', '*']
+        assert selection.rules[0].metrics == frozenset(['cpu', 'mem'])
+        assert selection.rules[0].interval == 5.0
+
     @mock.patch('supermann.utils.configure_logging')
     def test_from_file(self, configure_logging, supermann_cls):
         path = os.path.join(os.path.dirname(__file__), 'supermann.args')
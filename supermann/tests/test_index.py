@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+
+import os
+
+import psutil
+import py.test
+
+from supermann.index import ProcfsIndex, PsutilIndex
+
+
+def write_stat(proc, pid, ppid, start):
+    path = proc.ensure_dir(str(pid)).join('stat')
+    path.write('{0} (a (weird) name) S {1} {2}\n'.format(
+        pid, ppid, ' '.join(['0'] * 17 + [str(start)] + ['0'] * 20)))
+
+
+@py.test.fixture
+def proc(tmpdir):
+    write_stat(tmpdir, 1, 0, 10)
+    write_stat(tmpdir, 100, 1, 20)
+    write_stat(tmpdir, 101, 100, 30)
+    write_stat(tmpdir, 102, 101, 40)
+    return tmpdir
+
+
+@py.test.fixture
+def index(proc):
+    index = ProcfsIndex(proc=str(proc))
+    index.refresh()
+    return index
+
+
+class TestProcfsIndex(object):
+    def test_stat(self, index):
+        assert index.stat(101) == (100, 30)
+
+    def test_descendants(self, index):
+        assert index.descendants(100) == [101, 102]
+
+    def test_exited_process(self, proc, index):
+        proc.join('102').remove()
+        index.refresh()
+        assert index.descendants(100) == [101]
+
+    def test_reparented_process(self, proc, index):
+        proc.join('101').remove()
+        write_stat(proc, 102, 1, 40)
+        index.refresh()
+        assert index.descendants(100) == []
+        assert sorted(index.descendants(1)) == [100, 102]
+
+    def test_only_new_processes_are_read(self, proc, index):
+        write_stat(proc, 101, 1, 30)
+        write_stat(proc, 103, 100, 50)
+        index.refresh()
+        assert sorted(index.descendants(100)) == [101, 102, 103]
+
+    def test_reused_pid(self, proc, index):
+        write_stat(proc, 101, 1, 50)
+        write_stat(proc, 102, 1, 40)
+        index.verify(101)
+        assert index.descendants(100) == []
+        assert index.entries[101] == (1, 50)
+
+    def test_reused_descendant_pid(self, proc, index):
+        write_stat(proc, 102, 1, 60)
+        index.verify(100)
+        assert index.descendants(100) == [101]
+        assert index.entries[102] == (1, 60)
+        assert sorted(index.descendants(1)) == [100, 101, 102]
+
+    def test_exited_descendant(self, proc, index):
+        proc.join('101').remove()
+        write_stat(proc, 102, 1, 40)
+        index.verify(100)
+        assert index.descendants(100) == []
+        assert 101 not in index.entries
+
+
+def test_psutil_index():
+    index = PsutilIndex()
+    index.refresh()
+    assert os.getpid() in index.descendants(psutil.Process().ppid())
+
+
+def test_procfs_index():
+    index = ProcfsIndex()
+    index.refresh()
+    assert os.getpid() in index.descendants(os.getppid())
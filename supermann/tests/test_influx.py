@@ -0,0 +1,225 @@
+from __future__ import absolute_import
+
+import mock
+import py.test
+
+from supermann.batch import MetricBatch
+from supermann.outputs.influx import (
+    InfluxLineOutput, InfluxOutput, WidePoints, escape_tag)
+from supermann.services import Metric
+from supermann.testing import FakeInflux
+
+
+@py.test.fixture
+def server(request):
+    server = FakeInflux()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def influx(server, **params):
+    output = InfluxLineOutput()
+    output.hostname = 'host'
+    output.init(host='127.0.0.1', port=server.server_address[1],
+                database='db', **params)
+    return output
+
+
+EVENTS = [
+    dict(service='system:mem:total', metric_f=1024),
+    dict(service='system:cpu:percent', metric_f=12.5),
+    dict(service='process:web 1:cpu:percent', metric_f=0.5),
+    dict(service='process:web 1:state', state='running'),
+]
+
+
+def send_events(output, events=EVENTS):
+    for data in events:
+        output.event(**data)
+    output.flush()
+
+
+def send_batch(output, events=EVENTS):
+    output.event_batch(MetricBatch.from_events(events))
+    output.flush()
+
+
+senders = py.test.mark.parametrize('send', [send_events, send_batch])
+
+
+class TestInfluxLineOutput(object):
+    @senders
+    def test_lines(self, server, send):
+        with influx(server) as output:
+            send(output)
+        assert server.writes[0][0] == '/write?db=db&precision=ms'
+        assert server.lines == [
+            'system:mem:total,hostname=host metric=1024i',
+            'system:cpu:percent,hostname=host metric=12.5',
+            'process:cpu:percent,hostname=host,process=web\\ 1 metric=0.5',
+        ]
+
+    def test_gzip(self, server):
+        with influx(server, gzip='true') as output:
+            send_events(output)
+        assert len(server.lines) == 3
+
+    def test_batch_size(self, server):
+        with influx(server, batch_size=2) as output:
+            send_events(output)
+            send_events(output)
+        assert [len(body.splitlines()) for _, body in server.writes] == [
+            2, 1, 2, 1]
+
+    def test_failed_write(self, server):
+        server.status = 500
+        with influx(server) as output:
+            output.event(service='system:cpu:percent', metric_f=1.0)
+            with py.test.raises(IOError):
+                output.flush()
+
+    @senders
+    def test_timestamps(self, server, send):
+        with influx(server) as output:
+            send(output, [dict(data, time=10.5) for data in EVENTS])
+        assert [line.rsplit(' ', 1)[1] for line in server.lines] == [
+            '10500', '10500', '10500']
+
+    def test_failed_batch(self, server):
+        # Batches written before a failed write are not written again
+        output = influx(server, batch_size=1)
+        write, calls = output.write, []
+
+        def flaky_write(data):
+            calls.append(data.tobytes())
+            if len(calls) == 2:
+                raise IOError("InfluxDB write failed")
+            write(data)
+
+        output.write = flaky_write
+        with output:
+            for data in EVENTS:
+                output.event(**data)
+            with py.test.raises(IOError):
+                output.flush()
+            output.flush()
+        assert server.lines == [
+            'system:mem:total,hostname=host metric=1024i',
+            'system:cpu:percent,hostname=host metric=12.5',
+            'process:cpu:percent,hostname=host,process=web\\ 1 metric=0.5',
+        ]
+        assert len(server.writes) == 3
+
+    @senders
+    def test_non_finite(self, server, send):
+        events = [dict(service='system:a', metric_f=float('nan')),
+                  dict(service='system:b', metric_f=float('inf')),
+                  dict(service='system:c', metric_f=-float('inf')),
+                  dict(service='system:d', metric_f=1.5)]
+        with influx(server) as output:
+            send(output, events)
+        with influx(server, schema='wide') as output:
+            send(output, events)
+        assert server.lines == [
+            'system:d,hostname=host metric=1.5', 'system,hostname=host d=1.5']
+
+    def test_prefix_cache(self, server):
+        output = influx(server)
+        output.event(service='process:web:cpu:percent', metric_f=1.0)
+        assert 'process:web:cpu:percent' in output.prefixes
+
+
+def test_structured_services(server):
+    # The process name is read from the service, not split from the string
+    service = Metric('process', 'cpu:percent').service('group:web')
+    with influx(server) as output:
+        output.event(service=service, metric_f=0.5)
+        output.flush()
+    assert server.lines == [
+        'process:cpu:percent,hostname=host,process=group:web metric=0.5']
+    assert WidePoints().key(service) == ('process', 'group:web', 'cpu_percent')
+
+
+@senders
+@mock.patch('supermann.outputs.influx.InfluxDBClient')
+def test_client_points(client, send):
+    output = InfluxOutput()
+    output.hostname = 'host'
+    output.init(database='db')
+    send(output)
+    points = client.return_value.write_points.call_args[0][0]
+    assert [(p['measurement'], p['tags'].get('process')) for p in points] == [
+        ('system:mem:total', None), ('system:cpu:percent', None),
+        ('process:cpu:percent', 'web 1')]
+
+
+@senders
+@mock.patch('supermann.outputs.influx.InfluxDBClient')
+def test_client_timestamps(client, send):
+    output = InfluxOutput()
+    output.init(database='db')
+    send(output, [dict(data, time=10.5) for data in EVENTS])
+    args, kwargs = client.return_value.write_points.call_args
+    assert [p['time'] for p in args[0]] == [10500, 10500, 10500]
+    assert kwargs == dict(time_precision='ms')
+
+
+def test_escape_tag():
+    assert escape_tag('a b,c=d') == 'a\\ b\\,c\\=d'
+
+
+class TestWideSchema(object):
+    @senders
+    def test_line_output(self, server, send):
+        with influx(server, schema='wide') as output:
+            send(output)
+        assert server.lines == [
+            'system,hostname=host cpu_percent=12.5,mem_total=1024i',
+            'process,hostname=host,process=web\\ 1 '
+            'cpu_percent=0.5,state="running"',
+        ]
+
+    @senders
+    @mock.patch('supermann.outputs.influx.InfluxDBClient')
+    def test_client_output(self, client, send):
+        output = InfluxOutput()
+        output.hostname = 'host'
+        output.init(schema='wide', database='db')
+        send(output)
+
+        client.assert_called_with(database='db')
+        points = client.return_value.write_points.call_args[0][0]
+        assert points == [
+            dict(measurement='system', tags=dict(hostname='host'),
+                 fields=dict(mem_total=1024, cpu_percent=12.5)),
+            dict(measurement='process',
+                 tags=dict(hostname='host', process='web 1'),
+                 fields=dict(cpu_percent=0.5, state='running')),
+        ]
+
+
+    def test_coalesced_cycles(self, server):
+        # Batches from two cycles flushed together are written as two points
+        batch = MetricBatch.from_events(
+            [dict(data, time=10) for data in EVENTS])
+        batch.extend(MetricBatch.from_events(
+            [dict(data, time=20) for data in EVENTS[2:]]))
+        with influx(server, schema='wide') as output:
+            output.event_batch(batch)
+            output.flush()
+        assert server.lines == [
+            'system,hostname=host cpu_percent=12.5,mem_total=1024i 10000',
+            'process,hostname=host,process=web\\ 1 '
+            'cpu_percent=0.5,state="running" 10000',
+            'process,hostname=host,process=web\\ 1 '
+            'cpu_percent=0.5,state="running" 20000',
+        ]
+
+
+def test_wide_points():
+    points = WidePoints()
+    points.add(service='process:web:io:read:bytes', state='access denied')
+    points.add(service='riemann:other', metric_f=1)
+    assert len(points) == 0
+    assert points.key('process:web:mem:rss:absolute') == (
+        'process', 'web', 'mem_rss_absolute')
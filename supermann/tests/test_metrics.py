@@ -1,9 +1,11 @@
 from multiprocessing.pool import Pool
 
+import mock
 import psutil
 import pytest
 
 from supermann.metrics.process import with_children
+from supermann.snapshot import ProcessSnapshot, get_nofile_limit
 
 
 @pytest.fixture()
@@ -17,3 +19,30 @@ def test_with_children(process):
     assert len(process.children()) == 5
 
     assert with_children(process, lambda p: p.memory_info().rss) > process.memory_info().rss
+
+
+def test_snapshot(process):
+    #type: (psutil.Process)->None
+    snapshot = ProcessSnapshot.collect(process)
+
+    assert snapshot.pid == process.pid
+    assert snapshot.rss > process.memory_info().rss
+    assert snapshot.num_fds == with_children(process, lambda p: p.num_fds())
+    assert 0 < snapshot.fds_percent < 100
+
+
+def test_snapshot_skips_dead_children(process):
+    #type: (psutil.Process)->None
+    dead = psutil.Process(process.pid)
+    dead.memory_info = mock.Mock(side_effect=psutil.NoSuchProcess(0))
+
+    snapshot = ProcessSnapshot.collect(process, children=[dead])
+    assert snapshot.num_fds == process.num_fds()
+
+
+def test_nofile_limit_procfs_path(tmpdir):
+    tmpdir.ensure_dir('10').join('limits').write(
+        'Limit                     Soft Limit           Hard Limit           Units\n'
+        'Max open files            1024                 4096                 files\n')
+    with mock.patch.object(psutil, 'PROCFS_PATH', str(tmpdir)):
+        assert get_nofile_limit(10) == 4096
@@ -0,0 +1,468 @@
+from __future__ import absolute_import
+
+import ConfigParser
+import errno
+import threading
+import time
+
+import mock
+import py.test
+
+from supermann.core import Supermann
+from supermann.outputs.aggregate import AggregateOutput, Window, percentile
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.deadband import DeadbandOutput, Threshold
+from supermann.outputs.debug import DebugOutput
+from supermann.outputs.fanout import FanoutOutput
+from supermann.outputs.influx import InfluxLineOutput, InfluxOutput
+from supermann.outputs.rate import RateOutput
+from supermann.outputs.spool import HEADER, Spool
+from supermann.testing import ListOutput, wait_for
+from supermann.utils import fullname
+
+
+def background(output, **params):
+    params.setdefault('retry_backoff', 0)
+    instance = BackgroundOutput(output)
+    instance.init(**params)
+    return instance
+
+
+class TestBackgroundOutput(object):
+    def test_flush(self):
+        output = ListOutput()
+        with background(output) as instance:
+            instance.event(service='a', metric_f=1)
+            instance.flush()
+        assert output.flushed == [dict(service='a', metric_f=1)]
+        assert instance.counters['sent_events'] == 1
+
+    def test_retry(self):
+        output = ListOutput(failures=2)
+        with background(output) as instance:
+            instance.event(service='a', metric_f=1)
+            instance.flush()
+            assert wait_for(lambda: output.flushed)
+        assert output.flushed == [dict(service='a', metric_f=1)]
+        assert instance.counters['failed_flushes'] == 2
+
+    def test_give_up(self):
+        output = ListOutput(failures=10)
+        with background(output, max_retries=1) as instance:
+            instance.event(service='a', metric_f=1)
+            instance.flush()
+            assert wait_for(lambda: instance.counters['dropped_events'])
+        assert output.flushed == []
+        assert instance.counters['dropped_events'] == 1
+
+    def test_counters_locked(self):
+        # The sender thread waits for the queue's lock to update counters
+        flushing, failing = threading.Event(), threading.Event()
+        output = ListOutput()
+
+        def flush():
+            flushing.set()
+            failing.wait()
+            raise IOError("Backend unavailable")
+
+        output.flush = flush
+        with background(output, max_retries=0) as instance:
+            instance.event(service='a', metric_f=1)
+            instance.flush()
+            assert flushing.wait(5)
+            with instance.condition:
+                failing.set()
+                time.sleep(0.1)
+                assert instance.counters['failed_flushes'] == 0
+            assert wait_for(lambda: instance.counters['dropped_events'])
+        assert instance.counters['failed_flushes'] == 1
+
+    @py.test.mark.parametrize(('policy', 'kept'), [
+        ('oldest', ['b', 'c']),
+        ('newest', ['a', 'b']),
+    ])
+    def test_drop_policy(self, policy, kept):
+        instance = background(ListOutput(), queue_size=2, drop_policy=policy)
+        for service in 'abc':
+            instance.event(service=service)
+            instance.flush()
+        assert [batch[0]['service'] for batch in instance.queue] == kept
+        assert instance.counters['dropped_events'] == 1
+
+    def test_sample_drop_policy(self):
+        instance = background(ListOutput(), queue_size=2, drop_policy='sample')
+        for service in 'abc':
+            instance.event(service=service)
+            instance.flush()
+        assert len(instance.queue) == 2
+        assert instance.queue[-1][0]['service'] == 'c'
+
+    def test_unknown_drop_policy(self):
+        with py.test.raises(ValueError):
+            background(ListOutput(), drop_policy='random')
+
+    def test_coalesce(self):
+        instance = background(ListOutput(), max_batch_events=2)
+        for service in 'abc':
+            instance.event(service=service)
+            instance.flush()
+        assert len(instance.take()) == 2
+        assert len(instance.take()) == 1
+
+
+class TestSpool(object):
+    def test_replay(self, tmpdir):
+        spool = Spool(str(tmpdir))
+        spool.append([dict(service='a', metric_f=1.0)])
+        spool.append([dict(service='b')])
+
+        assert spool.peek() == [dict(service='a', metric_f=1.0)]
+        assert spool.peek() == [dict(service='a', metric_f=1.0)]
+        spool.pop()
+        assert spool.peek() == [dict(service='b')]
+        assert isinstance(spool.peek()[0]['service'], str)
+        spool.pop()
+        assert spool.peek() is None
+        assert len(spool) == 0
+
+    def test_segments(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_bytes=1)
+        for service in 'abc':
+            spool.append([dict(service=service)])
+        assert len(spool) == 3
+
+    def test_max_bytes(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_bytes=1, max_bytes=63)
+        for service in 'abcde':
+            spool.append([dict(service=service)])
+        assert spool.peek() == [dict(service='c')]
+
+    def test_max_age(self, tmpdir):
+        spool = Spool(str(tmpdir), max_age=-1)
+        spool.append([dict(service='a')])
+        assert spool.peek() is None
+
+
+    def test_corrupt_record(self, tmpdir):
+        spool = Spool(str(tmpdir))
+        spool.append([dict(service='a')])
+        spool.writer.write(HEADER.pack(5) + b'{bad}')
+        spool.writer.write(HEADER.pack(2) + b'[]')
+        spool.rotate()
+        time.sleep(0.001)
+        spool.append([dict(service='c')])
+        assert spool.peek() == [dict(service='a')]
+        spool.pop()
+        # The rest of a segment is skipped after a corrupt record
+        assert spool.peek() == [dict(service='c')]
+        spool.pop()
+        assert spool.peek() is None
+
+
+def write_corrupt_spool(tmpdir):
+    segment = tmpdir.join('0000000000000001' + Spool.suffix)
+    segment.write_binary(HEADER.pack(5) + b'{bad}')
+
+
+class TestBackgroundSpool(object):
+    def test_spool_and_replay(self, tmpdir):
+        output = ListOutput(failures=1)
+        with background(output, max_retries=0, spool_dir=str(tmpdir),
+                        replay_rate=100) as instance:
+            instance.event(service='a')
+            instance.flush()
+            assert wait_for(lambda: instance.counters['spooled_events'])
+            instance.event(service='b')
+            instance.flush()
+            assert wait_for(lambda: instance.counters['replayed_events'])
+        assert output.flushed == [dict(service='b'), dict(service='a')]
+        assert len(instance.spool) == 0
+
+    def test_corrupt_spool(self, tmpdir):
+        write_corrupt_spool(tmpdir)
+        output = ListOutput()
+        with background(output, spool_dir=str(tmpdir),
+                        replay_rate=100) as instance:
+            assert wait_for(lambda: len(instance.spool) == 0)
+            instance.event(service='a')
+            instance.flush()
+            assert wait_for(lambda: output.flushed)
+        assert output.flushed == [dict(service='a')]
+
+    def test_spool_full(self, tmpdir):
+        output = ListOutput(failures=1)
+        with background(output, max_retries=0,
+                        spool_dir=str(tmpdir)) as instance:
+            full = IOError(errno.ENOSPC, "No space left on device")
+            with mock.patch.object(instance.spool, 'append', side_effect=full):
+                instance.event(service='a')
+                instance.flush()
+                assert wait_for(lambda: instance.counters['dropped_events'])
+            # The sender thread is still running
+            instance.event(service='b')
+            instance.flush()
+            assert wait_for(lambda: output.flushed)
+        assert output.flushed == [dict(service='b')]
+        assert instance.counters['spooled_events'] == 0
+
+
+class TestFanoutOutput(object):
+    def test_isolation(self):
+        working, failing = ListOutput(), ListOutput(failures=10)
+        fanout = FanoutOutput([working, failing])
+        fanout.init(retry_backoff=0, max_retries=1)
+        with fanout:
+            fanout.event(service='a')
+            fanout.flush()
+            assert wait_for(lambda: working.flushed)
+        assert working.flushed == [dict(service='a')]
+        assert failing.flushed == []
+
+    def test_spool_dir(self, tmpdir):
+        fanout = FanoutOutput([ListOutput(), DebugOutput()])
+        fanout.init(spool_dir=str(tmpdir))
+        assert [o.spool.directory for o in fanout.outputs] == [
+            str(tmpdir.join(fullname(ListOutput))),
+            str(tmpdir.join('supermann.outputs.debug.DebugOutput'))]
+
+    def test_same_section(self, tmpdir):
+        # Outputs that share a section name are spooled separately
+        fanout = FanoutOutput([InfluxOutput(), InfluxLineOutput()])
+        fanout.init(spool_dir=str(tmpdir))
+        assert len(set(o.spool.directory for o in fanout.outputs)) == 2
+
+    def test_same_class(self, tmpdir):
+        fanout = FanoutOutput([ListOutput(), DebugOutput(), ListOutput()])
+        assert fanout.spool_names() == [
+            fullname(ListOutput) + '-1', 'supermann.outputs.debug.DebugOutput',
+            fullname(ListOutput) + '-2']
+
+    @mock.patch('supermann.supervisor.Supervisor', autospec=True)
+    def test_load_outputs(self, supervisor_class):
+        parser = ConfigParser.ConfigParser()
+        parser.add_section('debug_output')
+        parser.add_section('influx')
+        parser.set('influx', 'database', 'db')
+
+        instance = Supermann()
+        instance.load_output(
+            'supermann.outputs.debug.DebugOutput, '
+            'supermann.outputs.influx.InfluxLineOutput', parser)
+        assert isinstance(instance.output_client, FanoutOutput)
+        assert [type(o.output) for o in instance.output_client.outputs] == [
+            DebugOutput, InfluxLineOutput]
+
+
+class TestRateOutput(object):
+    @py.test.fixture
+    def identities(self):
+        return dict(web=(100, 1.0))
+
+    @py.test.fixture
+    def output(self, identities):
+        instance = RateOutput(ListOutput(), identities.get)
+        instance.init()
+        return instance
+
+    def send(self, output, value, time):
+        output.event(service='process:web:io:read:bytes', metric_f=value,
+                     time=time)
+        output.flush()
+        return [(e['service'], e['metric_f']) for e in output.output.flushed]
+
+    def test_rate(self, output):
+        self.send(output, 100, time=10)
+        assert self.send(output, 600, time=20)[-1] == (
+            'process:web:io:read:bytes/s', 50.0)
+
+    def test_other_events(self, output):
+        output.event(service='process:web:state', state='running')
+        output.event(service='system:cpu:percent', metric_f=1.0)
+        output.flush()
+        assert len(output.output.flushed) == 2
+        assert not output.samples
+
+    def test_keep_counters(self, output):
+        output.init(keep_counters='false')
+        assert self.send(output, 100, time=10) == []
+        assert self.send(output, 200, time=20) == [
+            ('process:web:io:read:bytes/s', 10.0)]
+
+    def test_counter_went_backwards(self, output):
+        self.send(output, 100, time=10)
+        assert len(self.send(output, 50, time=20)) == 2
+        assert self.send(output, 150, time=30)[-1] == (
+            'process:web:io:read:bytes/s', 10.0)
+
+    def test_restart(self, output, identities):
+        self.send(output, 100, time=10)
+        identities['web'] = (200, 2.0)
+        assert len(self.send(output, 500, time=20)) == 2
+
+    def test_expire(self, output, identities):
+        self.send(output, 100, time=10)
+        assert output.samples
+        del identities['web']
+        output.flush()
+        assert not output.samples
+
+    @mock.patch('supermann.supervisor.Supervisor', autospec=True)
+    def test_load_output(self, supervisor_class):
+        parser = ConfigParser.ConfigParser()
+        parser.add_section('debug_output')
+        parser.add_section('rate')
+        parser.set('rate', 'counters', 'cpu:absolute')
+
+        instance = Supermann()
+        instance.load_output('supermann.outputs.debug.DebugOutput', parser)
+        assert isinstance(instance.output_client, RateOutput)
+        assert isinstance(instance.output_client.output, DebugOutput)
+        assert instance.output_client.counters == (':cpu:absolute',)
+
+
+class TestAggregateOutput(object):
+    @py.test.fixture
+    def output(self):
+        instance = AggregateOutput(ListOutput())
+        instance.init(interval=0, window=4, system='system:* min, max, mean',
+                      cpu='process:*:cpu:* p95')
+        return instance
+
+    def flushed(self, output):
+        return sorted((e['service'], e.get('metric_f', e.get('state')))
+                      for e in output.output.flushed)
+
+    def test_aggregate(self, output):
+        output.flush()
+        for value in (1.0, 2.0, 6.0):
+            output.event(service='system:load:1min', metric_f=value)
+        output.flush()
+        assert self.flushed(output) == [
+            ('system:load:1min:max', 6.0),
+            ('system:load:1min:mean', 3.0),
+            ('system:load:1min:min', 1.0)]
+
+    def test_not_due(self, output):
+        output.init(interval=60, system='system:* mean')
+        output.flush()
+        output.event(service='system:load:1min', metric_f=1.0)
+        output.flush()
+        assert output.output.flushed == []
+
+    def test_passthrough(self, output):
+        output.event(service='process:web:state', state='running')
+        output.event(service='process:web:uptime', metric_f=10.0)
+        output.event(service='process:web:cpu:percent', metric_f=10.0)
+        output.flush()
+        assert self.flushed(output) == [
+            ('process:web:state', 'running'), ('process:web:uptime', 10.0)]
+
+    def test_window_size(self, output):
+        output.flush()
+        for value in range(10):
+            output.event(service='process:web:cpu:percent', metric_f=value)
+        output.flush()
+        assert self.flushed(output) == [('process:web:cpu:percent:p95', 9.0)]
+
+    def test_expire(self, output):
+        output.flush()
+        output.event(service='system:load:1min', metric_f=1.0)
+        output.flush()
+        assert len(output.windows) == 1
+        output.flush()
+        assert not output.windows
+
+    @mock.patch('supermann.supervisor.Supervisor', autospec=True)
+    def test_load_output(self, supervisor_class):
+        parser = ConfigParser.ConfigParser()
+        parser.add_section('debug_output')
+        parser.add_section('rate')
+        parser.add_section('aggregate')
+        parser.set('aggregate', 'system', 'system:* mean')
+        parser.add_section('deadband')
+
+        instance = Supermann()
+        instance.load_output('supermann.outputs.debug.DebugOutput', parser)
+        output = instance.output_client
+        assert isinstance(output, RateOutput)
+        assert isinstance(output.output, AggregateOutput)
+        assert isinstance(output.output.output, DeadbandOutput)
+        assert isinstance(output.output.output.output, DebugOutput)
+        assert output.output.families[0].pattern == 'system:*'
+
+    def test_last(self, output):
+        output.init(interval=0, window=3, system='system:* last, max')
+        output.flush()
+        for value in [5.0, 1.0, 4.0, 2.0]:
+            output.event(service='system:load:1min', metric_f=value)
+        output.flush()
+        assert self.flushed(output) == [
+            ('system:load:1min:last', 2.0), ('system:load:1min:max', 4.0)]
+
+    def test_unknown_statistic(self):
+        with py.test.raises(ValueError):
+            AggregateOutput(ListOutput()).init(system='system:* median')
+
+
+class TestWindow(object):
+    def test_samples(self):
+        window = Window(None, 3)
+        for value in range(5):
+            window.add(value, None)
+        assert window.samples() == [2, 3, 4]
+        window.reset()
+        window.add(5, None)
+        assert window.samples() == [5]
+
+    def test_percentile(self):
+        assert percentile(range(1, 101), 95) == 95
+        assert percentile([3.0], 50) == 3.0
+
+
+class TestDeadbandOutput(object):
+    @py.test.fixture
+    def output(self):
+        instance = DeadbandOutput(ListOutput())
+        instance.init(heartbeat=3, uptime='system:uptime relative=0.1')
+        return instance
+
+    def send(self, output, **data):
+        output.output.flushed = []
+        output.event(**data)
+        output.flush()
+        return output.output.flushed
+
+    def test_unchanged(self, output):
+        assert self.send(output, service='system:mem:total', metric_f=1.0)
+        assert not self.send(output, service='system:mem:total', metric_f=1.0)
+        assert self.send(output, service='system:mem:total', metric_f=1.5)
+        assert output.counters == dict(sent_events=2, suppressed_events=1)
+
+    def test_state(self, output):
+        assert self.send(output, service='process:web:state', state='running')
+        assert not self.send(output, service='process:web:state',
+                             state='running')
+        assert self.send(output, service='process:web:state', state='fatal')
+
+    def test_threshold(self, output):
+        assert self.send(output, service='system:uptime', metric_f=100.0)
+        assert not self.send(output, service='system:uptime', metric_f=105.0)
+        assert not self.send(output, service='system:uptime', metric_f=110.0)
+        assert self.send(output, service='system:uptime', metric_f=111.0)
+
+    def test_heartbeat(self, output):
+        sent = [bool(self.send(output, service='system:mem:total', metric_f=1.0))
+                for _ in range(7)]
+        assert sent == [True, False, False, True, False, False, True]
+
+    def test_expire(self, output):
+        self.send(output, service='system:mem:total', metric_f=1.0)
+        for _ in range(3):
+            output.flush()
+        assert not output.readings
+
+    def test_threshold_parse(self):
+        threshold = Threshold.parse('system:mem:* absolute=1024')
+        assert threshold.pattern == 'system:mem:*'
+        assert not threshold.changed(0, 1024)
+        assert threshold.changed(0, 1025)
@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+
+import pickle
+import time
+
+import mock
+import psutil
+import py.test
+
+from supermann.parallel import ParallelSnapshots, shard
+from supermann.snapshot import CpuTracker, ProcessSnapshot
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def instance(cpu=None):
+    instance = mock.Mock(snapshots=dict(), cpu=cpu or CpuTracker())
+    instance.children.return_value = []
+    instance.snapshot.side_effect = lambda p: instance.snapshots.setdefault(
+        p.pid, ProcessSnapshot.collect(p, []))
+    instance.read_snapshot.side_effect = instance.snapshot.side_effect
+    return instance
+
+
+@py.test.fixture(params=ParallelSnapshots.modes)
+def parallel(request):
+    parallel = ParallelSnapshots(request.param, workers=2)
+    parallel.start()
+    request.addfinalizer(parallel.stop)
+    return parallel
+
+
+def test_shard():
+    assert shard(range(5), 2) == [[0, 1, 2], [3, 4]]
+    assert shard(range(2), 4) == [[0], [1]]
+    assert shard([], 4) == []
+
+
+def test_collect(parallel):
+    process = psutil.Process()
+    snapshots = parallel.collect(instance(), [process])
+    assert snapshots[process.pid].nofile == process.rlimit(psutil.RLIMIT_NOFILE)[1]
+
+
+def test_process_mode_cpu_percent():
+    parallel = ParallelSnapshots('process', workers=1)
+    parallel.start()
+    try:
+        process = psutil.Process()
+        cpu = CpuTracker()
+        first = parallel.collect(instance(cpu), [process])[process.pid]
+        busy(0.2)
+        cpu.expire()
+        second = parallel.collect(instance(cpu), [process])[process.pid]
+    finally:
+        parallel.stop()
+    assert first.cpu_percent == 0.0
+    assert second.cpu_percent > 10
+
+
+def test_unknown_mode():
+    with py.test.raises(ValueError):
+        ParallelSnapshots('carrier-pigeon')
+
+
+def test_cpu_tracker():
+    tracker = CpuTracker()
+    snapshot = ProcessSnapshot(1)
+    snapshot.cpu_times = {(1, 0): 1.0, (2, 0): 1.0}
+    tracker.update(snapshot, now=10)
+    tracker.expire()
+    snapshot.cpu_times = {(1, 0): 2.0, (3, 0): 5.0}
+    tracker.update(snapshot, now=12)
+    tracker.expire()
+    assert snapshot.cpu_percent == 50.0
+    assert sorted(tracker.last) == [(1, 0), (3, 0)]
+
+
+def test_cpu_tracker_keep():
+    # A tree that was skipped keeps its CPU times until it is next read
+    tracker = CpuTracker()
+    snapshot = ProcessSnapshot(1)
+    snapshot.cpu_times = {(1, 0): 1.0, (2, 0): 1.0}
+    tracker.update(snapshot, now=10)
+    tracker.expire(keep=[1])
+    tracker.expire(keep=[1])
+    tracker.expire()
+    snapshot.cpu_times = {(1, 0): 2.0, (2, 0): 3.0}
+    tracker.update(snapshot, now=20)
+    assert snapshot.cpu_percent == 30.0
+
+
+def test_pickle_snapshot():
+    snapshot = ProcessSnapshot.collect(psutil.Process(), [])
+    copy = pickle.loads(pickle.dumps(snapshot))
+    assert (copy.pid, copy.rss, copy.cpu_times) == (
+        snapshot.pid, snapshot.rss, snapshot.cpu_times)
@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+
+import distutils.spawn
+import socket
+import ssl
+import subprocess
+
+import py.test
+import riemann_client.riemann_pb2
+
+from supermann.batch import MetricBatch
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.riemann import (
+    ReconnectingTransport, RiemannOutput, TLSTransport, split_message)
+from supermann.testing import FakeRiemann, wait_for
+
+
+class FakeRiemannTLS(FakeRiemann):
+    """A Riemann server that only accepts TLS connections"""
+
+    def __init__(self, certfile):
+        self.certfile = certfile
+        FakeRiemann.__init__(self)
+
+    def get_request(self):
+        connection, address = self.socket.accept()
+        connection = ssl.wrap_socket(
+            connection, server_side=True, certfile=self.certfile)
+        return connection, address
+
+
+def self_signed(directory, name):
+    """Creates a self-signed certificate and its key, in one file"""
+    if distutils.spawn.find_executable('openssl') is None:
+        py.test.skip("openssl is not installed")
+    key, cert = directory.join('key.pem'), directory.join('cert.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '1', '-subj', '/CN=' + name,
+         '-keyout', str(key), '-out', str(cert)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    combined = directory.join(name + '.pem')
+    combined.write(key.read() + cert.read())
+    return str(combined)
+
+
+@py.test.fixture
+def certificate(tmpdir):
+    return self_signed(tmpdir, 'localhost')
+
+
+@py.test.fixture
+def tls_server(request, certificate):
+    server = FakeRiemannTLS(certificate)
+    request.addfinalizer(server.stop)
+    return server
+
+
+@py.test.fixture
+def server(request):
+    server = FakeRiemann()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def riemann(port, **params):
+    output = RiemannOutput()
+    output.init(host='127.0.0.1', port=port, **params)
+    return output
+
+
+class TestReconnectingTransport(object):
+    def test_send(self, server):
+        with riemann(server.port) as output:
+            output.event(service='a')
+            output.flush()
+        assert server.events == ['a']
+
+    def test_reconnect_after_server_closes(self, server):
+        with riemann(server.port) as output:
+            output.event(service='a')
+            output.flush()
+            server.drop_connections()
+            output.event(service='b')
+            output.flush()
+        assert server.events == ['a', 'b']
+
+    def test_pool(self, server):
+        with riemann(server.port, pool_size=2) as output:
+            for service in 'abc':
+                output.event(service=service)
+                output.flush()
+        assert server.events == ['a', 'b', 'c']
+        assert len(server.connections) == 2
+
+    def test_unavailable(self):
+        transport = ReconnectingTransport('127.0.0.1', 1, connect_timeout=1)
+        with py.test.raises(socket.error):
+            transport.send(riemann_client.riemann_pb2.Msg())
+        assert transport.retry_at[0] > 0
+
+
+class TestRiemannOutputBatch(object):
+    def test_same_events(self):
+        events = [dict(service='a', metric_f=1.5),
+                  dict(service='b', state='running'),
+                  dict(service='c', metric_f=2, time=10.5),
+                  dict(service='d', metric_f=3, tags=['x'])]
+        single, batched = riemann(5555), riemann(5555)
+        for data in events:
+            single.event(**data)
+        batched.event_batch(MetricBatch.from_events(events))
+        assert batched.riemann.queue == single.riemann.queue
+        assert batched.riemann.queue.events[2].time == 10
+
+
+class TestRiemannOutputBuffering(object):
+    def test_buffered_during_outage(self, server):
+        output = riemann(1, max_buffered_events=2)
+        with output:
+            for service in 'abc':
+                output.event(service=service)
+                with py.test.raises(socket.error):
+                    output.flush()
+            assert len(output.riemann.queue.events) == 2
+
+            # Point the output at the running server and resend
+            transport = output.riemann.transport
+            transport.port = server.port
+            transport.retry_at[0] = 0
+            output.flush()
+        assert server.events == ['b', 'c']
+
+    def test_background_spool(self, server, tmpdir):
+        # Failed flushes reach the background output, which spools them
+        output = riemann(1, connect_timeout=1)
+        background = BackgroundOutput(output)
+        background.init(max_retries=0, spool_dir=str(tmpdir), replay_rate=100)
+        with background:
+            background.event(service='a')
+            background.flush()
+            assert wait_for(lambda: background.counters['spooled_events'])
+            assert background.counters['sent_events'] == 0
+            assert len(output.riemann.queue.events) == 0
+
+            transport = output.riemann.transport
+            transport.port = server.port
+            transport.retry_at[0] = 0
+            background.event(service='b')
+            background.flush()
+            assert wait_for(lambda: background.counters['replayed_events'])
+        assert server.events == ['b', 'a']
+
+
+class FakeRiemannUDP(object):
+    """A Riemann UDP server that records the datagrams it receives"""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(1)
+        self.port = self.socket.getsockname()[1]
+
+    def receive(self):
+        datagrams = []
+        try:
+            while True:
+                datagrams.append(self.socket.recv(65535))
+                self.socket.settimeout(0.1)
+        except socket.timeout:
+            pass
+        return datagrams
+
+
+class TestTransportModes(object):
+    def test_max_events_per_message(self, server):
+        with riemann(server.port, max_events_per_message=2) as output:
+            for service in 'abcde':
+                output.event(service=service)
+            output.flush()
+        assert [len(m.events) for m in server.messages] == [2, 2, 1]
+        assert server.events == list('abcde')
+
+    def test_udp_split_to_mtu(self):
+        server = FakeRiemannUDP()
+        with riemann(server.port, transport='udp', mtu=200) as output:
+            for i in range(20):
+                output.event(service='process:example:{0}'.format(i),
+                             metric_f=i, description='x' * 20)
+            output.flush()
+            datagrams = server.receive()
+
+        assert len(datagrams) > 1
+        assert all(len(d) <= 200 for d in datagrams)
+        messages = [riemann_client.riemann_pb2.Msg.FromString(d)
+                    for d in datagrams]
+        assert sum(len(m.events) for m in messages) == 20
+
+    def test_tls_transport(self):
+        output = riemann(5555, transport='tls', ca_certs='/dev/null')
+        transport = output.riemann.transport
+        assert transport.transport_class.func is TLSTransport
+        assert transport.transport_class.keywords == dict(ca_certs='/dev/null')
+
+    def test_tls_server(self, tls_server, certificate):
+        with riemann(tls_server.port, transport='tls',
+                     ca_certs=certificate) as output:
+            for service in 'ab':
+                output.event(service=service)
+                output.flush()
+        assert tls_server.events == ['a', 'b']
+        assert len(tls_server.connections) == 1
+
+    def test_tls_untrusted(self, tls_server, tmpdir):
+        # The server's certificate is not signed by the CA
+        ca = self_signed(tmpdir.mkdir('ca'), 'other')
+        with riemann(tls_server.port, transport='tls', ca_certs=ca) as output:
+            output.event(service='a')
+            with py.test.raises(socket.error):
+                output.flush()
+        assert tls_server.events == []
+
+    def test_unknown_transport(self):
+        with py.test.raises(ValueError):
+            riemann(5555, transport='carrier-pigeon')
+
+
+def test_split_message():
+    message = riemann_client.riemann_pb2.Msg()
+    for i in range(10):
+        message.events.add(service='s' * 100)
+    assert list(split_message(message)) == [message]
+    chunks = list(split_message(message, max_bytes=250))
+    assert [len(m.events) for m in chunks] == [2] * 5
+    assert all(m.ByteSize() <= 250 for m in chunks)
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import threading
+
+import mock
+import py.test
+
+from supermann.runtime import BufferedSender, Runtime
+
+
+def send(sender, service):
+    sender.output_client.event(service=service)
+
+
+def fail(sender):
+    raise RuntimeError("receiver failed")
+
+
+@py.test.fixture
+def runtime(request):
+    runtime = Runtime(workers=2, timeout=0.5)
+    runtime.start(mock.Mock(**{'supervisor.process_info.return_value': [
+        dict(name='web', pid=1)]}))
+    request.addfinalizer(runtime.stop)
+    return runtime
+
+
+class TestRuntime(object):
+    def test_events_in_order(self, runtime):
+        instance = mock.Mock(telemetry=None)
+        for service in 'abcd':
+            runtime.submit(instance, send, service=service)
+        runtime.wait(instance)
+        assert [c[1]['service'] for c in instance.output_client.event.call_args_list] == list('abcd')
+
+    def test_failed_receiver(self, runtime):
+        instance = mock.Mock(telemetry=None)
+        runtime.submit(instance, fail)
+        runtime.submit(instance, send, service='a')
+        runtime.wait(instance)
+        instance.output_client.event.assert_called_once_with(service='a')
+
+    def test_slow_receiver(self, runtime):
+        release = threading.Event()
+
+        def slow(sender):
+            release.wait()
+            sender.output_client.event(service='slow')
+
+        instance = mock.Mock(telemetry=None)
+        runtime.submit(instance, slow, key='web')
+        runtime.submit(instance, send, service='fast')
+        runtime.wait(instance)
+        instance.output_client.event.assert_called_once_with(service='fast')
+
+        # The slow receiver is skipped while it is still running
+        runtime.submit(instance, slow, key='web')
+        assert runtime.tasks == []
+        release.set()
+
+    def test_map(self, runtime):
+        assert runtime.map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+
+    def test_process_info(self, runtime):
+        processes = runtime.process_info()
+        processes[0].pop('pid')
+        assert runtime.process_info() == [dict(name='web', pid=1)]
+
+    def test_from_items(self):
+        runtime = Runtime.from_items([('workers', '8'), ('timeout', '2')])
+        assert (runtime.workers, runtime.timeout) == (8, 2.0)
+
+
+def test_buffered_sender():
+    instance = mock.Mock(telemetry=None)
+    sender = BufferedSender(instance)
+    sender.output_client.event(service='a')
+    assert sender.snapshot is instance.snapshot
+    assert sender.output_client.events == [dict(service='a')]
+    assert not instance.output_client.event.called
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import mock
+import psutil
+import py.test
+
+import supermann.metrics.system
+from supermann.batch import MetricBatch
+from supermann.sampler import SystemSampler
+
+
+MEMINFO = """MemTotal:        1000 kB
+MemFree:          200 kB
+MemAvailable:     600 kB
+Buffers:          100 kB
+Cached:           250 kB
+SReclaimable:      50 kB
+SwapTotal:        400 kB
+SwapFree:         300 kB
+"""
+
+NET_DEV = """Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes
+    lo: {0} 0 0 0 0 0 0 0 {1} 0 0 0 0 0 0 0
+  eth0: 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+
+def write_proc(proc, cpu, disk, net):
+    proc.join('stat').write(
+        'cpu  {0} 0 {0} {1} 0 0 0 0 0 0\n'
+        'cpu0 {0} 0 {0} {1} 0 0 0 0 0 0\n'
+        'cpu1 0 0 0 {1} 0 0 0 0 0 0\n'
+        'intr 1 2 3\n'.format(*cpu))
+    proc.join('meminfo').write(MEMINFO)
+    proc.join('loadavg').write('1.00 0.50 0.25 1/100 1000\n')
+    proc.join('uptime').write('1234.5 100.0\n')
+    proc.join('diskstats').write(
+        '   8       0 sda 0 0 {0} 0 0 0 {1} 0 0 0 0\n'
+        '   7       0 loop0 0 0 0 0 0 0 0 0 0 0 0\n'.format(*disk))
+    proc.ensure_dir('net').join('dev').write(NET_DEV.format(*net))
+
+
+@py.test.fixture
+def proc(tmpdir):
+    write_proc(tmpdir, cpu=(10, 80), disk=(0, 0), net=(0, 0))
+    return tmpdir
+
+
+@py.test.fixture
+def sampler(proc):
+    sampler = SystemSampler(proc=str(proc))
+    sampler.read(extended=True, now=100)
+    write_proc(proc, cpu=(20, 160), disk=(10, 20), net=(1000, 500))
+    return sampler.read(extended=True, now=110)
+
+
+class TestSystemSampler(object):
+    def test_cpu(self, sampler):
+        assert sampler.cpu_percent == 20.0
+        assert sampler.cpu_count == 2
+        assert list(sampler.per_cpu_percent) == [20.0, 0.0]
+
+    def test_memory(self, sampler):
+        assert sampler.mem_total == 1000 * 1024
+        assert sampler.mem_used == 400 * 1024
+        assert sampler.mem_cached == 300 * 1024
+        assert sampler.mem_percent == 40.0
+        assert sampler.swap_percent == 25.0
+
+    def test_load_and_uptime(self, sampler):
+        assert sampler.load == (1.0, 0.5, 0.25)
+        assert sampler.uptime == 1234.5
+
+    def test_counters(self, sampler):
+        assert sampler.disks == ['sda', 'loop0']
+        assert list(sampler.disk_rates) == [512.0, 1024.0, 0.0, 0.0]
+        assert sampler.interfaces == ['lo', 'eth0']
+        assert list(sampler.net_rates) == [100.0, 50.0, 0.0, 0.0]
+
+    def test_buffers_reused(self, proc, sampler):
+        buffers = sampler.last_disk_counters, sampler.disk_counters
+        sampler.read(extended=True, now=120)
+        assert (sampler.disk_counters, sampler.last_disk_counters) == buffers
+        assert list(sampler.disk_rates) == [0.0] * 4
+
+    def test_counter_reset(self, proc, sampler):
+        write_proc(proc, cpu=(20, 160), disk=(0, 0), net=(0, 0))
+        sampler.read(extended=True, now=120)
+        assert list(sampler.net_rates) == [0.0] * 4
+
+    def test_host(self):
+        sampler = SystemSampler().read(extended=True)
+        assert sampler.mem_total == psutil.virtual_memory().total
+        assert sampler.cpu_count == psutil.cpu_count()
+
+
+def test_receivers(sampler):
+    instance = mock.Mock(batch=MetricBatch(), **{
+        'system_sample.return_value': sampler})
+    supermann.metrics.system.disk(instance, None)
+    supermann.metrics.system.load_scaled(instance, None)
+    assert instance.batch.services == [
+        'system:disk:sda:read:bytes/s', 'system:disk:sda:write:bytes/s',
+        'system:load_scaled:1min']
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+
+import mock
+import py.test
+
+import supermann.metrics.process
+import supermann.metrics.system
+from supermann.scheduler import Collector, Schedule
+
+
+@py.test.fixture
+def schedule():
+    return Schedule.from_items([
+        ('interval', '5'),
+        ('system', '10'),
+        ('process.fds', '60'),
+    ])
+
+
+class TestSchedule(object):
+    def test_key(self):
+        assert Schedule.key(supermann.metrics.process.fds) == 'process.fds'
+
+    def test_interval_for_receiver(self, schedule):
+        assert schedule.interval_for(supermann.metrics.process.fds) == 60
+
+    def test_interval_for_module(self, schedule):
+        assert schedule.interval_for(supermann.metrics.system.cpu) == 10
+
+    def test_default_interval(self, schedule):
+        assert schedule.interval_for(supermann.metrics.process.cpu) == 5
+
+    def test_due(self, schedule):
+        receivers = [
+            supermann.metrics.process.cpu,
+            supermann.metrics.process.fds,
+        ]
+        assert schedule.due(receivers, 0) == receivers
+        assert schedule.due(receivers, 1) == []
+        assert schedule.due(receivers, 5) == receivers[:1]
+        assert schedule.next_run(5) == 10
+
+
+class TestCollector(object):
+    def test_collects(self, schedule):
+        instance = mock.Mock()
+        collector = Collector(instance, schedule)
+        instance.collect.side_effect = lambda *a, **k: collector.stopping.set()
+        collector.notify('event')
+        collector.start()
+        collector.join()
+        instance.collect.assert_called_with('event', now=mock.ANY)
+
+    def test_check(self, schedule):
+        instance = mock.Mock(**{'collect.side_effect': RuntimeError})
+        collector = Collector(instance, schedule)
+        collector.start()
+        collector.join()
+        with py.test.raises(RuntimeError):
+            collector.check()
+
+    def test_state_changes(self, schedule):
+        instance = mock.Mock()
+        collector = Collector(instance, schedule)
+        instance.collect_state_changes.side_effect = (
+            lambda *a, **k: collector.stopping.set())
+        collector.notify('event', 'web:web_0')
+        collector.notify('event', 'web:web_0')
+        collector.start()
+        collector.join()
+        instance.collect_state_changes.assert_called_once_with(['web:web_0'])
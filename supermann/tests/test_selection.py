@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+
+import ConfigParser
+
+import py.test
+
+import supermann.metrics.process
+from supermann.selection import Rule, Selection
+
+RECEIVERS = [
+    supermann.metrics.process.cpu,
+    supermann.metrics.process.mem,
+    supermann.metrics.process.state,
+    supermann.metrics.process.uptime,
+]
+
+
+def names(receivers):
+    return [r.__name__ for r in receivers]
+
+
+class TestRule(object):
+    def test_from_items(self):
+        rule = Rule.from_items('web-*', [('metrics', 'cpu, mem'),
+                                         ('interval', '5')])
+        assert rule.metrics == frozenset(['cpu', 'mem'])
+        assert rule.interval == 5.0
+        assert names(rule.receivers(RECEIVERS)) == ['cpu', 'mem']
+
+    def test_defaults(self):
+        rule = Rule.from_items('*', [])
+        assert (rule.metrics, rule.interval) == (None, None)
+        assert rule.receivers(RECEIVERS) is RECEIVERS
+
+    def test_no_metrics(self):
+        assert Rule.from_items('*', [('metrics', '')]).receivers(RECEIVERS) == []
+
+
+class TestSelection(object):
+    def selection(self):
+        return Selection([
+            Rule('web-*', ['cpu', 'mem'], interval=10),
+            Rule('*', ['state']),
+        ])
+
+    def test_first_match(self):
+        selection = self.selection()
+        assert names(selection.select('web-1', RECEIVERS, 0)) == ['cpu', 'mem']
+        assert names(selection.select('batch', RECEIVERS, 0)) == ['state']
+        assert Selection().select('web-1', RECEIVERS, 0) is RECEIVERS
+
+    def test_validate(self):
+        self.selection().validate(RECEIVERS)
+        selection = Selection([Rule('*', ['state', 'memory'])])
+        with py.test.raises(ValueError) as error:
+            selection.validate(RECEIVERS)
+        assert 'memory' in str(error.value)
+
+    def test_interval(self):
+        selection = self.selection()
+        due = [bool(selection.select('web-1', RECEIVERS, now))
+               for now in (0, 5, 10, 15, 20)]
+        assert due == [True, False, True, False, True]
+        # State changes are reported whether or not the program is due
+        assert names(selection.receivers('web-1', RECEIVERS)) == ['cpu', 'mem']
+
+    def test_forget(self):
+        selection = self.selection()
+        selection.select('web-1', RECEIVERS, 0)
+        selection.forget(['web-1'])
+        assert selection.matches == {} and selection.last == {}
+
+    def test_from_config(self):
+        parser = ConfigParser.ConfigParser()
+        for section in ('supermann', 'process:web-*', 'process:*'):
+            parser.add_section(section)
+        parser.set('process:*', 'metrics', 'state,uptime')
+        selection = Selection.from_config(parser)
+        assert [r.pattern for r in selection.rules] == ['web-*', '*']
+        assert selection.rules[0].metrics is None
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+import pickle
+
+import mock
+
+import supermann.metrics.process
+from supermann.batch import MetricBatch
+from supermann.services import Registry, Service
+
+
+class TestServices(object):
+    def test_process_metric(self):
+        metric = Registry().process('mem:rss:absolute')
+        service = metric.service('web')
+        assert service == 'process:web:mem:rss:absolute'
+        assert (service.family, service.process, service.field) == (
+            'process', 'web', 'mem:rss:absolute')
+        assert metric.service('web') is service
+
+    def test_system_metric(self):
+        registry = Registry()
+        service = registry.system('cpu:percent').service()
+        assert service == 'system:cpu:percent'
+        assert (service.process, service.field) == (None, 'cpu:percent')
+        disk = registry.system('disk:{0}:read:bytes/s').service('sda')
+        assert disk == 'system:disk:sda:read:bytes/s'
+        assert disk.field == 'disk:sda:read:bytes/s'
+
+    def test_forget(self):
+        registry = Registry()
+        metric = registry.process('state')
+        service = metric.service('web')
+        metric.service('worker')
+        registry.forget(['web'])
+        assert list(metric.services) == ['worker']
+        assert metric.service('web') is not service
+
+    def test_pickle(self):
+        service = Service('process:web:state', 'process', 'web', 'state')
+        copy = pickle.loads(pickle.dumps(service, pickle.HIGHEST_PROTOCOL))
+        assert copy == service
+        assert copy.process == 'web'
+
+
+def test_receiver_services():
+    sender = mock.Mock(batch=MetricBatch())
+    data = dict(name='web', statename='RUNNING')
+    supermann.metrics.process.state(sender, None, data)
+    service, = sender.batch.services
+    assert service == 'process:web:state'
+    assert service.process == 'web'
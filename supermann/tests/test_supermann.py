@@ -1,13 +1,22 @@
 from __future__ import absolute_import
 
 import datetime
+import socket
+import subprocess
+import sys
 import time
 import os
 
 from supermann import Supermann
+from supermann.parallel import ParallelSnapshots
+from supermann.runtime import Runtime
+from supermann.scheduler import Schedule
+from supermann.selection import Rule, Selection
 from supermann.supervisor import Event
+from supermann.telemetry import Telemetry
 
 import mock
+import psutil
 import py.test
 
 
@@ -25,6 +34,7 @@ def getAllProcessInfo():
     yield {
         'pid': os.getpid(),
         'name': 'this-process',
+        'group': 'this-process',
         'statename': 'RUNNING',
 
         'start': timestamp(),
@@ -34,6 +44,7 @@ def getAllProcessInfo():
     yield {
         'pid': 0,
         'name': 'dead-process',
+        'group': 'dead-process',
         'statename': 'STOPPED',
 
         'start': timestamp(),
@@ -42,6 +53,12 @@ def getAllProcessInfo():
     }
 
 
+def sent_services(output):
+    """Returns the services in the batches sent to a mock output"""
+    return [service for c in output.event_batch.call_args_list
+            for service in c[0][0].services]
+
+
 @py.test.fixture
 @mock.patch('supermann.supervisor.Supervisor', autospec=True)
 @mock.patch('riemann_client.transport.TCPTransport', autospec=True)
@@ -49,7 +66,8 @@ def supermann_instance(riemann_client_class, supervisor_class):
     instance = Supermann("localhost", None).with_all_recivers()
     instance.supervisor.configure_mock(**{
         # At least one process must be visible for the process metrics to run
-        'rpc.getAllProcessInfo': mock.Mock(wraps=getAllProcessInfo),
+        'process_info.side_effect': lambda: list(getAllProcessInfo()),
+        'update_processes.return_value': None,
 
         # The information in each event isn't important to Supermann
         'run_forever.return_value': [Event({}, {}), Event({}, {})]
@@ -59,13 +77,244 @@ def supermann_instance(riemann_client_class, supervisor_class):
     return instance.run()
 
 
+def riemann_transport(instance):
+    """Returns the mock TCPTransport used by the reconnecting transport"""
+    return instance.output_client.riemann.transport.transport_class.return_value
+
+
 def test_riemann_client(supermann_instance):
-    assert supermann_instance.output_client.riemann.transport.connect.called
+    assert riemann_transport(supermann_instance).connect.called
 
 
 def test_one_message_per_event(supermann_instance):
-    assert len(supermann_instance.output_client.riemann.transport.send.call_args_list) == 2
+    assert len(riemann_transport(supermann_instance).send.call_args_list) == 2
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+@mock.patch('riemann_client.transport.TCPTransport', autospec=True)
+def test_riemann_outage(transport_class, supervisor_class):
+    # Without a background output, failed flushes don't stop Supermann
+    transport_class.return_value.send.side_effect = socket.error(
+        "Connection refused")
+    instance = Supermann("localhost", None).with_all_recivers()
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: list(getAllProcessInfo()),
+        'update_processes.return_value': None,
+        'run_forever.return_value': [Event({}, {}), Event({}, {})]
+    })
+    instance.run()
+    assert transport_class.return_value.send.called
+    # The unsent events are kept for the next flush
+    assert len(instance.output_client.riemann.queue.events) > 0
+
+
+def test_supervisor_process_info_called(supermann_instance):
+    assert supermann_instance.supervisor.process_info.called
+
+
+def test_process_identity(supermann_instance):
+    process = psutil.Process(os.getpid())
+    assert supermann_instance.process_identity('this-process') == (
+        process.pid, process.create_time())
+    assert supermann_instance.process_identity('dead-process') is None
+
+
+@py.test.fixture
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+@mock.patch('riemann_client.transport.TCPTransport', autospec=True)
+def scheduled_instance(riemann_client_class, supervisor_class):
+    instance = Supermann("localhost", None).with_all_recivers()
+    instance.schedule = Schedule(interval=60)
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: list(getAllProcessInfo()),
+        'update_processes.return_value': None,
+        'run_forever.return_value': [Event({}, {}), Event({}, {})]
+    })
+    return instance.run()
+
+
+def test_scheduled_collection(scheduled_instance):
+    assert scheduled_instance.collector.event is not None
+    assert not scheduled_instance.collector.is_alive()
+
+
+def test_collect_state_changes(supermann_instance):
+    output = supermann_instance.output_client = mock.Mock()
+    supermann_instance.collect_state_changes(['dead-process:dead-process'])
+    assert sorted(sent_services(output)) == [
+        'process:dead-process:state', 'process:dead-process:uptime']
+    assert output.flush.called
+    # Metrics are stamped with the time they were collected
+    batch = output.event_batch.call_args[0][0]
+    assert None not in batch.times
+    assert len(set(batch.times)) == 1
+
+
+@py.test.fixture
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+@mock.patch('riemann_client.transport.TCPTransport', autospec=True)
+def concurrent_instance(riemann_client_class, supervisor_class):
+    instance = Supermann("localhost", None).with_all_recivers()
+    instance.runtime = Runtime(workers=2)
+    instance.output_client = mock.MagicMock()
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: list(getAllProcessInfo()),
+        'update_processes.return_value': None,
+        'run_forever.return_value': [Event({}, {})]
+    })
+    return instance.run()
+
 
+def test_concurrent_collection(concurrent_instance):
+    services = sent_services(concurrent_instance.output_client)
+    assert 'process:this-process:cpu:percent' in services
+    assert 'system:cpu:percent' in services
+    assert concurrent_instance.output_client.flush.called
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_parallel_event_order(supervisor_class):
+    services = list()
+    for mode in (None, 'thread', 'process'):
+        instance = Supermann().with_all_recivers()
+        instance.output_client = mock.Mock()
+        instance.supervisor.configure_mock(**{
+            'process_info.side_effect': lambda: list(getAllProcessInfo())})
+        if mode is not None:
+            instance.parallel = ParallelSnapshots(mode, workers=2)
+            instance.parallel.start()
+        try:
+            instance.emit_processes(None)
+        finally:
+            if mode is not None:
+                instance.parallel.stop()
+        services.append(instance.batch.services)
+    assert services[0] == services[1] == services[2]
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_selection(supervisor_class):
+    instance = Supermann().with_all_recivers()
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: list(getAllProcessInfo())})
+    instance.selection = Selection([Rule('this-*', ['state'], interval=10)])
+    instance.process_index = mock.Mock()
+
+    # The selected program is not read, as its receivers don't read /proc
+    instance.emit_processes(None, now=100)
+    assert sorted(instance.batch.services) == [
+        'process:dead-process:state', 'process:dead-process:uptime',
+        'process:this-process:state']
+    assert not instance.process_index.refresh.called
+    assert instance.snapshots == {}
+
+    # Until it is due again, the program is skipped but not forgotten
+    instance.batch.clear()
+    instance.emit_processes(None, now=105)
+    assert 'process:this-process:state' not in instance.batch.services
+    assert os.getpid() in instance.process_cache
+    assert 'this-process' in instance.identities
+    assert 'this-process' in instance.programs
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_unknown_selected_metric(supervisor_class):
+    instance = Supermann().with_all_recivers()
+    instance.selection = Selection([Rule('*', ['cpu', 'rss'])])
+    with py.test.raises(ValueError):
+        instance.run()
+    assert not instance.supervisor.run_forever.called
+
+
+@py.test.mark.parametrize('cached', [False, True])
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_exited_process(supervisor_class, cached):
+    # The PID in the process info is out of date, as no event reported it
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process = psutil.Process(child.pid)
+    child.wait()
+    info = dict(next(getAllProcessInfo()), pid=child.pid, name='exited',
+                group='exited')
+
+    instance = Supermann().with_all_recivers()
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: [dict(info)]})
+    if cached:
+        instance.process_cache[child.pid] = process
+    instance.emit_processes(None)
+    assert sorted(instance.batch.services) == [
+        'process:exited:state', 'process:exited:uptime']
+    instance.supervisor.mark_stale.assert_called_with('exited:exited')
+    assert child.pid not in instance.process_cache
+
+
+@py.test.fixture
+def busy_child(request):
+    child = subprocess.Popen([sys.executable, '-c', 'while True: pass'])
+    request.addfinalizer(child.kill)
+    return child
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_child_cache(supervisor_class, busy_child):
+    instance = Supermann()
+    process = psutil.Process()
+    instance.process_index.refresh()
+    children = instance.children(process)
+    assert busy_child.pid in [c.pid for c in children]
+    assert all(c is d for c, d in zip(instance.children(process), children))
+
+    # Children not seen in the last cycle are dropped
+    instance.expire_children()
+    instance.expire_children()
+    assert instance.child_cache == {}
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_child_cache_reused_pid(supervisor_class, busy_child):
+    instance = Supermann()
+    process = psutil.Process()
+    instance.process_index.refresh()
+    child, = [c for c in instance.children(process)
+              if c.pid == busy_child.pid]
+
+    # A cached process is replaced when its PID is started again
+    start_time, _ = instance.child_cache[busy_child.pid]
+    instance.child_cache[busy_child.pid] = (start_time - 1, child)
+    replaced, = [c for c in instance.children(process)
+                 if c.pid == busy_child.pid]
+    assert replaced is not child
+    assert instance.child_cache[busy_child.pid] == (start_time, replaced)
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+def test_child_cpu_percent(supervisor_class, busy_child):
+    instance = Supermann()
+    process = psutil.Process()
+    instance.process_index.refresh()
+    instance.snapshot(process)
+    time.sleep(0.5)
+    instance.snapshots = dict()
+    instance.cpu.expire()
+    assert instance.snapshot(process).cpu_percent > 20
+
+
+@mock.patch('supermann.supervisor.Supervisor', autospec=True)
+@mock.patch('riemann_client.transport.TCPTransport', autospec=True)
+def test_telemetry(riemann_client_class, supervisor_class):
+    instance = Supermann("localhost", None).with_all_recivers()
+    instance.supervisor.configure_mock(**{
+        'process_info.side_effect': lambda: list(getAllProcessInfo()),
+        'update_processes.return_value': None,
+        'run_forever.return_value': [Event({}, {}), Event({}, {})]
+    })
+    instance.supervisor.client = mock.Mock()
+    telemetry = Telemetry()
+    instance.instrument(telemetry).run()
 
-def test_supervisor_rpc_called(supermann_instance):
-    assert supermann_instance.supervisor.rpc.getAllProcessInfo.called
+    assert instance.supervisor.client.telemetry is telemetry
+    assert set(['tick', 'flush', 'snapshots', 'receiver:process.cpu',
+                'receiver:system.mem']) <= set(telemetry.timers)
+    assert telemetry.timers['tick'].count == 2
+    queue = riemann_client_class.return_value.send.call_args[0][0]
+    assert 'supermann:tick:duration' in [e.service for e in queue.events]
@@ -1,12 +1,16 @@
 from __future__ import absolute_import
 
+import errno
 import os
 import StringIO
+import threading
 
 import mock
 import py.test
 
 import supermann.supervisor
+from supermann.telemetry import Telemetry
+from supermann.testing import FakeSupervisor
 
 
 def local_file(name):
@@ -43,9 +47,178 @@ class TestEventListener(object):
         assert event.headers['ver'] == '3.0'
         assert event.payload['pid'] == '2766'
 
+    def test_parse_colon_in_value(self):
+        payload = supermann.supervisor.parse("processname:a:b pid:1")
+        assert payload == {'processname': 'a:b', 'pid': '1'}
+
+    def test_lazy_payload(self, listener):
+        event = listener.wait()
+        assert event._payload is None
+        assert event.payload['processname'] == 'cat'
+        assert event.headers['eventname'] is intern('PROCESS_STATE_STARTING')
+
+    def test_body(self):
+        event = supermann.supervisor.Event({}, 'processname:cat\nline')
+        assert event.payload == {'processname': 'cat'}
+        assert event.body == 'line'
+
+
+class TestProtocolReader(object):
+    def test_partial_reads(self):
+        read_fd, write_fd = os.pipe()
+        reader = supermann.supervisor.ProtocolReader(os.fdopen(read_fd, 'rb'))
+        with open(local_file('supervisor.txt'), 'rb') as f:
+            data = f.read() * 2
+
+        def write():
+            for i in range(0, len(data), 7):
+                os.write(write_fd, data[i:i + 7])
+            os.close(write_fd)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        events = [reader.wait(), reader.wait()]
+        thread.join()
+        assert [e.payload['pid'] for e in events] == ['2766', '2766']
+        with py.test.raises(EOFError):
+            reader.wait()
+
+    def test_interrupted_read(self):
+        stream = StringIO.StringIO('line\n')
+        reader = supermann.supervisor.ProtocolReader(stream)
+        reader._read = mock.Mock(side_effect=[
+            OSError(errno.EINTR, 'Interrupted system call'), 'line\n'])
+        assert reader.readline() == 'line'
+
+    def test_read_error(self):
+        reader = supermann.supervisor.ProtocolReader(StringIO.StringIO())
+        reader._read = mock.Mock(side_effect=OSError(errno.EBADF, 'Bad fd'))
+        with py.test.raises(OSError):
+            reader.readline()
+
 
 class TestSupervisor(object):
     @mock.patch.dict('os.environ', {'SUPERVISOR_SERVER_URL': '-'})
     @mock.patch('supervisor.childutils.getRPCInterface')
     def test_rpc_property(self, getRPCInterface):
         assert supermann.supervisor.Supervisor().rpc
+
+
+@py.test.fixture
+def server(request):
+    server = FakeSupervisor()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def state_event(group, name, state='RUNNING', **payload):
+    payload.update(groupname=group, processname=name)
+    return supermann.supervisor.Event(
+        {'eventname': 'PROCESS_STATE_{0}'.format(state)}, payload)
+
+
+class TestRPCClient(object):
+    def test_persistent_connection(self, server):
+        client = server.client()
+        for _ in range(3):
+            client.call('supervisor.getAllProcessInfo')
+        assert server.connections == 1
+
+    def test_reconnect(self, server):
+        client = server.client()
+        client.call('supervisor.getAllProcessInfo')
+        client.interface('transport').connection.sock.close()
+        assert len(client.call('supervisor.getAllProcessInfo')) == 2
+        assert server.connections == 2
+
+    def test_multicall(self, server):
+        client = server.client()
+        results = client.multicall([
+            ('supervisor.getProcessInfo', ('web:web_0',)),
+            ('supervisor.getProcessInfo', ('web:missing',))])
+        assert results[0]['pid'] == 10
+        assert results[1].faultCode == 10
+        assert client.multicall([]) == []
+
+    def test_telemetry(self, server):
+        client = server.client()
+        client.telemetry = Telemetry()
+        client.multicall([('supervisor.getProcessInfo', ('web:web_0',))])
+        assert client.telemetry.timers['rpc:system.multicall'].count == 1
+
+
+class TestProcessInfoCache(object):
+    def test_ttl(self, server):
+        cache = supermann.supervisor.ProcessInfoCache(server.client(), ttl=30)
+        assert [p['name'] for p in cache.get(now=1000)] == ['web_0', 'cat']
+        assert cache.get(now=1010)[0]['now'] == 210
+        cache.get(now=1030)
+        assert server.calls == ['getAllProcessInfo'] * 2
+
+    def test_process_state_event(self, server):
+        cache = supermann.supervisor.ProcessInfoCache(server.client(), ttl=30)
+        cache.get(now=1000)
+        name = cache.update(state_event('cat', 'cat', pid='12'), now=1001)
+        info = cache.get(now=1002)[1]
+        assert name == 'cat:cat'
+        assert (info['statename'], info['pid'], info['now']) == (
+            'RUNNING', 12, 1002)
+        assert server.calls == ['getAllProcessInfo']
+
+    def test_stopped_event(self, server):
+        cache = supermann.supervisor.ProcessInfoCache(server.client(), ttl=30)
+        cache.get(now=1000)
+        cache.update(state_event('web', 'web_0', 'EXITED', pid='10'), now=1001)
+        info = cache.get(now=1001)[0]
+        assert (info['statename'], info['pid'], info['stop']) == (
+            'EXITED', 0, 1001)
+
+    def test_unknown_process(self, server):
+        cache = supermann.supervisor.ProcessInfoCache(server.client(), ttl=30)
+        cache.get(now=1000)
+        server.processes.append(dict(
+            group='new', name='new', pid=13, statename='RUNNING',
+            start=100, stop=0, now=200))
+        cache.update(state_event('new', 'new', pid='13'))
+        cache.update(state_event('gone', 'gone'))
+        assert [p['name'] for p in cache.get(now=1001)] == [
+            'web_0', 'cat', 'new']
+        assert server.calls == ['getAllProcessInfo'] + ['getProcessInfo'] * 2
+
+    def test_update_during_refresh(self):
+        # Events are applied while getAllProcessInfo is in progress
+        fetching, release = threading.Event(), threading.Event()
+        client = mock.Mock()
+
+        def call(method):
+            fetching.set()
+            assert release.wait(5)
+            return [dict(group='web', name='web_0', pid=10,
+                         statename='RUNNING', start=100, stop=0, now=200)]
+
+        client.call.side_effect = call
+        cache = supermann.supervisor.ProcessInfoCache(client, ttl=30)
+        release.set()
+        cache.get(now=1000)
+
+        fetching.clear()
+        release.clear()
+        thread = threading.Thread(target=cache.get, kwargs=dict(now=2000))
+        thread.start()
+        try:
+            assert fetching.wait(5)
+            cache.update(state_event('web', 'web_0', 'EXITED'), now=2001)
+        finally:
+            release.set()
+            thread.join()
+        # The event is newer than the info being fetched, so it is kept
+        info = cache.get(now=2002)[0]
+        assert (info['statename'], info['pid']) == ('EXITED', 0)
+
+    def test_mark_stale(self, server):
+        cache = supermann.supervisor.ProcessInfoCache(server.client(), ttl=30)
+        cache.get(now=1000)
+        server.processes[0]['pid'] = 11
+        cache.mark_stale('web:web_0')
+        assert cache.get(now=1001)[0]['pid'] == 11
+        assert server.calls == ['getAllProcessInfo', 'getProcessInfo']
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+import os
+import signal
+
+import mock
+import pstats
+import py.test
+
+from supermann.batch import MetricBatch
+from supermann.outputs.background import BackgroundOutput
+from supermann.outputs.fanout import FanoutOutput
+from supermann.outputs.telemetry import TelemetryOutput, bytes_sent
+from supermann.runtime import BufferedSender, call
+from supermann.telemetry import Profiler, Telemetry, Timer
+from supermann.testing import ListOutput
+
+
+
+def services(output):
+    return [e['service'] for e in output.bulk]
+
+
+class TestTimer(object):
+    def test_percentile(self):
+        timer = Timer(100)
+        for duration in range(1, 201):
+            timer.add(duration)
+        assert timer.last == 200
+        assert timer.percentile(50) == 150
+        assert timer.percentile(99) == 199
+
+    def test_empty(self):
+        timer = Timer(10)
+        timer.add(1.5)
+        assert timer.percentile(99) == 1.5
+
+
+class TestTelemetry(object):
+    def test_timer(self):
+        telemetry = Telemetry()
+        with telemetry.timer('tick'):
+            pass
+        with py.test.raises(ValueError):
+            with telemetry.timer('tick'):
+                raise ValueError()
+        assert telemetry.timers['tick'].count == 2
+
+    def test_receiver_key(self):
+        import supermann.metrics.process
+        assert Telemetry.receiver_key(supermann.metrics.process.cpu) == (
+            'receiver:process.cpu')
+
+    def test_report(self):
+        telemetry = Telemetry()
+        telemetry.record('tick', 0.5)
+        telemetry.record('flush', 0.25)
+        telemetry.count(3)
+        output = ListOutput()
+        telemetry.report(output, bytes_sent=100)
+        assert services(output) == [
+            'supermann:tick:events', 'supermann:flush:bytes',
+            'supermann:flush:latency', 'supermann:flush:p50',
+            'supermann:flush:p99', 'supermann:tick:duration',
+            'supermann:tick:p50', 'supermann:tick:p99']
+        assert output.bulk[0]['metric_f'] == 3
+        assert telemetry.events == 0
+
+    def test_runtime_call(self):
+        telemetry = Telemetry()
+        sender = BufferedSender(mock.Mock(telemetry=telemetry))
+
+        def receiver(sender, data):
+            return data
+        assert call(receiver, sender, dict(data=1)) == 1
+        assert 'receiver:test_telemetry.receiver' in telemetry.timers
+
+
+class TestTelemetryOutput(object):
+    def test_flush(self):
+        telemetry = Telemetry()
+        inner = ListOutput()
+        inner.bytes_sent = 0
+        output = TelemetryOutput(inner, telemetry)
+        output.event(service='a', metric_f=1)
+        inner.bytes_sent = 50
+        output.flush()
+        flushed = dict((e['service'], e['metric_f']) for e in inner.flushed)
+        assert flushed['supermann:tick:events'] == 1
+        assert flushed['supermann:flush:bytes'] == 50
+        assert 'flush' in telemetry.timers
+
+    def test_background_flush(self):
+        telemetry = Telemetry()
+        background = BackgroundOutput(ListOutput())
+        background.init()
+        background.count('dropped_events', 5)
+        background.counters['flush_latency'] = 2.0
+        output = TelemetryOutput(background, telemetry)
+        output.flush()
+        output.flush()
+        metrics = dict((e['service'], e['metric_f'])
+                       for batch in background.queue for e in batch)
+        assert metrics['supermann:background:dropped_events'] == 5
+        assert metrics['supermann:background:queue_depth'] == 1
+        assert metrics['supermann:flush:latency'] == 2.0
+        assert 'supermann:enqueue:latency' in metrics
+        assert 'flush' not in telemetry.timers
+
+    def test_fanout_flush(self):
+        telemetry = Telemetry()
+        fanout = FanoutOutput([ListOutput(), ListOutput()])
+        fanout.init()
+        fanout.outputs[1].counters['flush_latency'] = 3.0
+        output = TelemetryOutput(fanout, telemetry)
+        output.flush()
+        metrics = dict((e['service'], e['metric_f'])
+                       for batch in fanout.outputs[0].queue for e in batch)
+        name = 'supermann:background:supermann.testing.ListOutput-2'
+        assert metrics[name + ':flush_latency'] == 3.0
+        assert metrics['supermann:flush:latency'] == 3.0
+
+    def test_event_batch(self):
+        telemetry = Telemetry()
+        inner = mock.Mock()
+        batch = MetricBatch.from_events([dict(service='a'), dict(service='b')])
+        TelemetryOutput(inner, telemetry).event_batch(batch)
+        inner.event_batch.assert_called_once_with(batch)
+        assert telemetry.events == 2
+
+    def test_bytes_sent(self):
+        inner = ListOutput()
+        inner.bytes_sent = 10
+        assert bytes_sent(mock.Mock(spec=['output'], output=inner)) == 10
+        assert bytes_sent(mock.Mock(spec=['outputs'], outputs=[
+            inner, ListOutput(), inner])) == 20
+        assert bytes_sent(ListOutput()) is None
+
+
+def test_profiler(tmpdir):
+    path = str(tmpdir.join('supermann.prof'))
+    previous = signal.getsignal(signal.SIGUSR1)
+    profiler = Profiler(path)
+    try:
+        profiler.start()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        first = pstats.Stats(path).total_calls
+        sorted(range(100), key=abs)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        second = pstats.Stats(path).total_calls
+    finally:
+        profiler.stop()
+        signal.signal(signal.SIGUSR1, previous)
+    assert 0 < first < second
@@ -2,7 +2,12 @@
 
 from __future__ import absolute_import
 
+import ctypes
+import ctypes.util
+import importlib
 import logging
+import os
+import time
 
 #: The default log format
 LOG_FORMAT = '%(asctime)s %(levelname)-8s [%(name)s] %(message)s'
@@ -34,6 +39,45 @@ def configure_logging(level=logging.INFO, format=LOG_FORMAT, log=''):
     log.addHandler(handler)
 
 
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _clock_gettime():
+    """Returns a function reading CLOCK_MONOTONIC, or None if unavailable"""
+    try:
+        library = ctypes.CDLL(ctypes.util.find_library('rt') or 'libc.so.6',
+                              use_errno=True)
+        clock_gettime = library.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic():
+        t = timespec()
+        if clock_gettime(1, ctypes.pointer(t)) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+
+#: Returns the time in seconds from a clock that never goes backwards, for
+#: measuring durations. Python 2 has no ``time.monotonic``, so this uses
+#: ``clock_gettime``, falling back to ``time.time`` where it is unavailable.
+monotonic = getattr(time, 'monotonic', None) or _clock_gettime() or time.time
+
+
+def boolean(value):
+    """Converts a config value to a boolean
+
+    :param value: A boolean, or a string like ``true``, ``yes``, ``off``
+    :rtype: bool
+    """
+    if isinstance(value, basestring):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
 def fullname(obj):
     """Returns the qualified name of an object's class
 
@@ -51,3 +95,13 @@ def getLogger(obj):
     :returns: A logger object using the :py:func:`.fullname` of the object
     """
     return logging.getLogger(fullname(obj))
+
+
+def import_object(path):
+    """Imports an object from a dotted path
+
+    :param str path: A path like ``package.module.ClassName``
+    :returns: The object named by the path
+    """
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)